@@ -0,0 +1,133 @@
+import hashlib
+from functools import lru_cache
+
+import duckdb
+from flask import Blueprint, abort, current_app, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from snapshot import get_snapshot_version, load_status_table
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+FILTERS = ["project", "session", "stage", "scan"]
+
+# Every filter is optional: a NULL parameter matches every row
+WHERE = " AND ".join(f"(${name} IS NULL OR {name} = ${name})" for name in FILTERS)
+COUNTS_QUERY = f"""
+SELECT project, session, stage, scan,
+       COUNT(*) FILTER (WHERE value) AS count,
+       COUNT(*) AS n_subjects
+FROM status
+WHERE {WHERE}
+GROUP BY ALL
+ORDER BY ALL
+"""
+SUBJECT_QUERY = """
+SELECT project, session, stage, scan, value
+FROM status
+WHERE study_id = $study_id AND ($project IS NULL OR project = $project)
+ORDER BY ALL
+"""
+MATCHES = f"SELECT DISTINCT project, study_id FROM status WHERE {WHERE} AND value = $value"
+SUBJECTS_QUERY = f"""
+SELECT project, study_id FROM ({MATCHES})
+ORDER BY project, study_id
+LIMIT $limit OFFSET $offset
+"""
+N_SUBJECTS_QUERY = f"SELECT COUNT(*) AS total FROM ({MATCHES})"
+
+
+@lru_cache(maxsize=1)
+def connect(version):
+    """Load the status table of one snapshot version into an in-memory database."""
+    con = duckdb.connect()
+    con.register("df_status", load_status_table())
+    con.execute("CREATE TABLE status AS SELECT * FROM df_status")
+    con.unregister("df_status")
+    return con
+
+
+def query(sql, **params):
+    """Run a parameterized query against the current snapshot, as a list of dicts."""
+    version, _ = get_snapshot_version()
+    # Each request gets its own cursor on the shared snapshot database
+    with connect(version).cursor() as cur:
+        cur.execute(sql, params)
+        columns = [col[0] for col in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def get_filters():
+    return {name: request.args.get(name) for name in FILTERS}
+
+
+def get_etag():
+    """ETag of a response, from the snapshot version and the full query string."""
+    version, _ = get_snapshot_version()
+    query_hash = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+    return f"{version}-{query_hash}"
+
+
+@api.before_request
+def return_not_modified():
+    """Answer with a 304 without running the query, if the snapshot is unchanged."""
+    if request.if_none_match:
+        etag = get_etag()
+        # Compression may have suffixed the ETag we sent (e.g. "<etag>:br")
+        client_etags = request.if_none_match.as_set(include_weak=True)
+        if any(tag.split(":")[0] == etag for tag in client_etags):
+            return current_app.response_class(status=304, headers={"ETag": f'"{etag}"'})
+    return None
+
+
+@api.after_request
+def add_cache_headers(response):
+    if response.status_code == 200:
+        response.set_etag(get_etag())
+        response.cache_control.no_cache = True
+    return response
+
+
+@api.errorhandler(HTTPException)
+def handle_error(error):
+    return jsonify(error=error.description), error.code
+
+
+@api.get("/counts")
+def get_counts():
+    """Count the acquired (or processed) scans per project, session, stage and scan."""
+    return jsonify(counts=query(COUNTS_QUERY, **get_filters()))
+
+
+@api.get("/subjects/<study_id>")
+def get_subject(study_id):
+    """Get the status of every scan of one subject."""
+    rows = query(SUBJECT_QUERY, study_id=study_id, project=request.args.get("project"))
+    if not rows:
+        abort(404, f"No subject {study_id}")
+    return jsonify(study_id=study_id, status=rows)
+
+
+@api.get("/subjects")
+def get_subjects():
+    """List the subjects whose scans match the filters, one page at a time.
+
+    ``value=false`` lists the subjects that are missing the scan instead.
+    """
+    page = request.args.get("page", 1, type=int)
+    page_size = request.args.get("page_size", DEFAULT_PAGE_SIZE, type=int)
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        abort(400, f"page must be >= 1 and page_size between 1 and {MAX_PAGE_SIZE}")
+    value = request.args.get("value", "true").lower()
+    if value not in ["true", "false"]:
+        abort(400, "value must be 'true' or 'false'")
+    params = {**get_filters(), "value": value == "true"}
+    rows = query(SUBJECTS_QUERY, **params, limit=page_size, offset=(page - 1) * page_size)
+    [count] = query(N_SUBJECTS_QUERY, **params)
+    return jsonify(subjects=rows,
+                   total=count["total"],
+                   page=page,
+                   page_size=page_size,
+                   )
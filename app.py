@@ -1,11 +1,42 @@
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 import dash_bootstrap_components as dbc
 import duckdb
 import pandas as pd
 import plotly.graph_objects as go
-from dash import Dash, Input, Output, callback, dash_table, dcc, html
-from duckdb.duckdb import DuckDBPyRelation
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import diskcache
+from dash import (
+    ClientsideFunction,
+    Dash,
+    DiskcacheManager,
+    Input,
+    Output,
+    State,
+    callback,
+    clientside_callback,
+    ctx,
+    dash_table,
+    dcc,
+    html,
+    no_update,
+)
+from flask import request
+from flask_compress import Compress
+
+from api import api
+from cube import CUBE_FNAME, get_count, load_cube
+from dataframes import ACQUISITION_SCHEMA, DERIVATIVES_SCHEMA
+from history import AGGREGATE_FNAME, get_backlog, load_aggregate
+from inventory import get_subject_inventory
+from paths import get_csv_paths
+from pipeline import PipelineLockedError, run_pipeline
+from snapshot import get_data_dir, get_snapshot_path, get_snapshot_version
+from subject_index import STATUSES, build_index, get_study_ids, lookup, to_labels
 
 #################### STYLES #####################
 TABLE_KWARGS = {
@@ -29,6 +60,22 @@ TABLE_KWARGS = {
         "textAlign": "left",
     },
 }
+STAGES = ["Acquired", "Processed"]
+# Columns of the tracking tables, and the name of their bar in the chart
+SCANS = {"Anatomical": "Anatomical", "Functional": "BOLD", "DWI": "DWI"}
+# Visit of the final dataframe (and so of the cube) behind each visit of the dashboard
+CUBE_VISITS = {"Newborn": "Newborn", "Six Month": "Six Months"}
+# Column of the final dataframe behind each bar, per stage
+CUBE_SCANS = {"Acquired": {"Anatomical": "Anatomical", "Functional": "BOLD", "DWI": "DWI"},
+              "Processed": {"Anatomical": "Anatomical", "Functional-Volume": "BOLD", "DWI": "DWI"},
+              }
+# Scan counts of every visit and stage, straight from the snapshot's Arrow table, until
+# the pipeline has built the cube
+COUNTS_QUERY = f"""
+SELECT visit, stage, {", ".join(f'count(*) FILTER (WHERE "{column}") AS "{scan}"' for column, scan in SCANS.items())}
+FROM tracking
+GROUP BY visit, stage
+"""
 
 ############### FUNCTIONS #####################
 
@@ -44,10 +91,11 @@ def combine_acq_proc_dfs(df_acq: pd.DataFrame, df_proc: pd.DataFrame,) -> pd.Dat
     df_combined = pd.concat([df_acq, df_proc], axis=1)
     return df_combined
 
-def make_dash_table(db: DuckDBPyRelation) -> dash_table.DataTable:
-    df: pd.DataFrame = db.to_df()
+def make_dash_table(table: pa.Table, table_id: str) -> dash_table.DataTable:
     table = dash_table.DataTable(
-        data=df.to_dict("records"),
+        id=table_id,
+        # Rows come straight from the Arrow buffers, without a pandas copy
+        data=table.to_pylist(),
         editable=False,
         page_size=10,
         page_action='none',
@@ -71,21 +119,31 @@ def make_dash_table(db: DuckDBPyRelation) -> dash_table.DataTable:
     return table
 
 
-def get_count_query(db_name: str) -> str:
-    return f"SELECT COUNT(Anatomical) FILTER (WHERE Anatomical) AS Anatomical, COUNT(Functional) FILTER (WHERE Functional) AS BOLD, COUNT(DWI) FILTER (WHERE DWI) AS DWI FROM {db_name}"
+def make_inventory_panel(df_inventory: pd.DataFrame, study_id: str, session: str) -> dbc.Card:
+    """Summarize the file-level inventory of a single subject."""
+    header = dbc.CardHeader(f"{study_id} ({session})")
+    if df_inventory.empty:
+        return dbc.Card([header, dbc.CardBody("No inventory recorded for this subject.")])
+
+    bids = df_inventory.loc[df_inventory["category"] == "BIDS", "name"]
+    runs = df_inventory.loc[df_inventory["category"] == "NiBabies run", ["name", "detail", "date"]]
+    runs = runs.rename(columns={"name": "Run", "detail": "Surface-Recon-Method", "date": "Date"})
+    derivatives = df_inventory.loc[df_inventory["category"] == "Derivative", ["name", "detail"]]
+    body = dbc.CardBody([
+        html.H6("BIDS files"),
+        html.Ul([html.Li(name) for name in bids]) if len(bids) else html.P("None"),
+        html.H6("NiBabies runs"),
+        dash_table.DataTable(
+            data=runs.to_dict("records"),
+            style_header=TABLE_KWARGS["style_header"],
+            style_cell=TABLE_KWARGS["style_cell"],
+            ) if len(runs) else html.P("None"),
+        html.H6("Derivative folders", className="mt-2"),
+        html.Ul([html.Li(f"{row.name} ({row.detail})") for row in derivatives.itertuples()])
+        if len(derivatives) else html.P("None"),
+    ], style={"maxHeight": "450px", "overflowY": "auto"})
+    return dbc.Card([header, body])
 
-def make_query_df(
-    db_name: str,
-    query: str,
-    ) -> pd.DataFrame:
-    # query = duckdb.sql(get_count_query(db_name))
-    df = duckdb.sql(query).to_df().T.reset_index()
-    if "acq" in db_name:
-        return df.rename(columns={"index": "Scan", 0: "Acquired"}).set_index("Scan")
-    elif "proc" in db_name:
-        return df.rename(columns={"index": "Scan", 0: "Processed"}).set_index("Scan")
-    else:
-        raise ValueError(f"acq or proc should exist in the database name. Got: {db_name}")
 
 def make_query_table(df: pd.DataFrame) -> dash_table.DataTable:
     return dash_table.DataTable(
@@ -94,47 +152,101 @@ def make_query_table(df: pd.DataFrame) -> dash_table.DataTable:
     )
 
 ############# I/O #################
-csv_dir = Path(__file__).parent.resolve() / "csv"
-assert csv_dir.exists()
-newborn_acq_fname = csv_dir / "BABIES_newborn_acquisition.csv"
-sixmonth_acq_fname = csv_dir / "BABIES_sixmonth_acquisition.csv"
+def get_version() -> tuple[str, datetime]:
+    """Version of the data snapshot (and of this module) being served."""
+    return get_snapshot_version(extra_files=[Path(__file__)])
 
-newborn_proc_fname = csv_dir / "BABIES_newborn_derivatives.csv"
-sixmonth_proc_fname = csv_dir / "BABIES_sixmonth_derivatives.csv"
 
-db_newborn_acq: DuckDBPyRelation = duckdb.read_csv(newborn_acq_fname)
-db_sixmonth_acq: DuckDBPyRelation = duckdb.read_csv(sixmonth_acq_fname)
+def read_tracking_table(fname: Path, schema: pa.Schema, visit: str, stage: str) -> pa.Table:
+    """Read one tracking CSV into Arrow, typed by the schema it was written with."""
+    table = pv.read_csv(fname,
+                        read_options=pv.ReadOptions(use_threads=False),
+                        convert_options=pv.ConvertOptions(column_types=dict(zip(schema.names, schema.types))),
+                        )
+    table = table.rename_columns(["Functional" if name == "Functional-Volume" else name for name in table.column_names])
+    table = table.append_column("visit", pa.array([visit] * table.num_rows, pa.string()))
+    return table.append_column("stage", pa.array([stage] * table.num_rows, pa.string()))
 
-df_newborn_proc = pd.read_csv(newborn_proc_fname).rename(columns={"Functional-Volume": "Functional"})
-df_sixmonth_proc = pd.read_csv(sixmonth_proc_fname).rename(columns={"Functional-Volume": "Functional"})
 
-db_newborn_proc: DuckDBPyRelation = duckdb.sql("SELECT study_id, Anatomical, Functional, DWI FROM df_newborn_proc")
-db_sixmonth_proc: DuckDBPyRelation = duckdb.sql("SELECT study_id, Anatomical, Functional, DWI FROM df_sixmonth_proc")
-# db_newborn_proc: DuckDBPyRelation = duckdb.read_csv(newborn_proc_fname)
-# db_sixmonth_proc: DuckDBPyRelation = duckdb.read_csv(sixmonth_proc_fname)
+def get_cube_counts(cube: dict, project: str = "BABIES") -> pd.DataFrame:
+    """Scan counts of every visit and stage, read from the cube."""
+    counts = {
+        (visit, stage): {
+            scan: get_count(cube, project=project, visit=cube_visit, stage=stage, modality=column, status=stage)
+            for column, scan in CUBE_SCANS[stage].items()
+        }
+        for visit, cube_visit in CUBE_VISITS.items()
+        for stage in STAGES
+    }
+    return pd.DataFrame(counts).rename_axis("Scan")
 
-# Counts
-query = get_count_query("db_newborn_acq")
-query_df_newborn_acq = make_query_df("db_newborn_acq", query)
 
-query = get_count_query("db_sixmonth_acq")
-query_df_sixmonth_acq = make_query_df("db_sixmonth_acq", query=query)
+@lru_cache(maxsize=1)
+def load_snapshot(version: str) -> dict:
+    """Load the tracking tables once per snapshot version.
 
-query = get_count_query("db_newborn_proc")
-query_df_newborn_proc = make_query_df("db_newborn_proc", query)
+    The four tracking CSVs are read once into Arrow and concatenated, without
+    copying, into a single table. The tables of each (visit, stage) share its
+    buffers. Counts are read from the cube that the pipeline builds, or, before
+    it has, scanned from that table by DuckDB. Every file is read from the
+    snapshot the pipeline published last, never from files it is writing.
+    """
+    data_dir = get_data_dir()
+    csvs = {key: get_snapshot_path(fname, data_dir) for key, fname in get_csv_paths("BABIES").items()}
+    tables = {
+        ("Newborn", "Acquired"): read_tracking_table(csvs["acquisition_newborn"], ACQUISITION_SCHEMA, "Newborn", "Acquired"),
+        ("Newborn", "Processed"): read_tracking_table(csvs["derivatives_newborn"], DERIVATIVES_SCHEMA, "Newborn", "Processed"),
+        ("Six Month", "Acquired"): read_tracking_table(csvs["acquisition_sixmonth"], ACQUISITION_SCHEMA, "Six Month", "Acquired"),
+        ("Six Month", "Processed"): read_tracking_table(csvs["derivatives_sixmonth"], DERIVATIVES_SCHEMA, "Six Month", "Processed"),
+    }
+    tracking = pa.concat_tables(tables.values(), promote_options="default")
 
-query = get_count_query("db_sixmonth_proc")
-query_df_sixmonth_proc = make_query_df("db_sixmonth_proc", query)
+    # Counts
+    cube = load_cube(get_snapshot_path(CUBE_FNAME, data_dir))
+    if get_count(cube, project="BABIES"):
+        counts_df = get_cube_counts(cube)
+    else:
+        with duckdb.connect() as con:
+            con.register("tracking", tracking)
+            counts = con.sql(COUNTS_QUERY).df().set_index(["visit", "stage"])
+        counts_df = counts.T.reindex(columns=pd.MultiIndex.from_tuples(tables))
+        counts_df.index.name = "Scan"
+
+    # Subjects behind every bar, so that clicking bars filters the subject tables
+    study_ids = get_study_ids(tables)
+    subject_index = build_index({
+        key: table.select(["study_id", *SCANS]).rename_columns(["study_id", *SCANS.values()])
+        for key, table in tables.items()
+    }, study_ids)
+
+    # Weekly trends from the tracking history
+    backlog_df = get_backlog("BABIES", aggregate=load_aggregate(get_snapshot_path(AGGREGATE_FNAME, data_dir)))
+    acquired = {visit: tables[(visit, "Acquired")].drop_columns(["visit", "stage"]) for visit in ["Newborn", "Six Month"]}
+    return {
+        "acquired": acquired,
+        "acquired_labels": {visit: pa.array(to_labels(table["study_id"].to_pandas(), study_ids)) for visit, table in acquired.items()},
+        "subject_index": subject_index,
+        "newborn_df": counts_df["Newborn"],
+        "sixmonth_df": counts_df["Six Month"],
+        "counts_df": counts_df,
+        "backlog_df": backlog_df,
+    }
 
-newborn_df = pd.concat([query_df_newborn_acq, query_df_newborn_proc], axis=1)
-sixmonth_df = pd.concat([query_df_sixmonth_acq, query_df_sixmonth_proc], axis=1)
-counts_df = pd.concat([newborn_df, sixmonth_df], axis=1, keys=["Newborn", "Six Month"])
+
+def get_snapshot() -> dict:
+    """Get the tracking tables for the current data snapshot."""
+    version, _ = get_version()
+    return load_snapshot(version)
 
 ############################ COMPONENTS ############################
 save_button = dbc.Button(
                     "Download CSV", id="btn_csv", color="success", className="m-1"
                     )
 downloader = dcc.Download(id="download-dataframe-csv")
+refresh_button = dbc.Button(
+                    "Refresh now", id="refresh-btn", color="info", className="m-1"
+                    )
+refresh_progress = dbc.Progress(id="refresh-progress", value=0, striped=True, animated=True)
 dropdown = dcc.Dropdown(
     ["BABIES"],
     value="BABIES",
@@ -142,108 +254,251 @@ dropdown = dcc.Dropdown(
     style={"margin-top": "5px"},
     )
 
-# DataFrames of acquired and processed scans
-table_newborn_acq: dash_table.DataTable = make_dash_table(db_newborn_acq)
-table_sixmonth_acq: dash_table.DataTable = make_dash_table(db_sixmonth_acq)
-
-table_tabs = dbc.Tabs(
-    id="table-tabs",
-    active_tab="newborn_acq",
-    children=[
-        dbc.Tab(tab_id="newborn_acq", label="Newborn", children=table_newborn_acq),
-        dbc.Tab(tab_id="sixmonth_acq", label="Six Month", children=table_sixmonth_acq),
-    ],
-)
 
-# Scan Count Tables
-newborn_table = make_query_table(newborn_df.reset_index())
-sixmonth_table = make_query_table(sixmonth_df.reset_index())
-query_tabs = dbc.Tabs(
-    id="query-tabs",
-    active_tab="newborn",
-    children=[
-        dbc.Tab(tab_id="newborn", label="Newborn", children=newborn_table),
-        dbc.Tab(tab_id="sixmonth", label="Six Month", children=sixmonth_table),
-    ]
-)
+def make_counts_data(counts_df: pd.DataFrame) -> dict:
+    """Columnar scan counts for the bar chart, which is drawn in the browser."""
+    visits = counts_df.columns.get_level_values(0).unique()
+    return {
+        "scans": counts_df.index.tolist(),
+        "visits": visits.tolist(),
+        "counts": {
+            visit: {stage: counts_df[visit][stage].tolist() for stage in counts_df[visit].columns}
+            for visit in visits
+        },
+    }
 
-# Bar Chart
-y_max = counts_df.T.groupby(level=0).sum().max().max() * 1.5
-
-# Create a figure with the right layout
-fig = go.Figure(
-    layout=go.Layout(
-        #height=600,
-        #width=1000,
-        barmode="overlay",
-        title="Number of Acquired and Processed Scans",
-        yaxis_title="Count",
-        yaxis_showticklabels=True,
-        yaxis_showgrid=True,
-        yaxis_range=[0, y_max],
-       # Secondary y-axis overlayed on the primary one and not visible
-        yaxis2=go.layout.YAxis(
-            visible=False,
-            matches="y",
-            overlaying="y",
-            anchor="x",
-        ),
-        font=dict(size=18),
-        legend_x=0,
-        legend_y=.8,
-        legend_orientation="h",
-        hovermode="x",
-        margin=dict(b=0,t=40,l=0,r=10)
-    )
-)
 
-for ii, (level, col) in zip([0,0,1,1], (counts_df.columns)):
-    fig.add_bar(
-        x=counts_df.index,
-        y=counts_df[level][col],
-        yaxis=f"y{ii + 1}",
-        offsetgroup=str(ii),
-        offset=(ii - 1) * 1/3,
-        width=1/3,
-        legendgroup=level,
-        legendgrouptitle_text=level,
-        name=col,
-        hovertemplate="%{y}<extra></extra>",
+def make_trend_chart(backlog_df: pd.DataFrame) -> go.Figure:
+    """Line chart of the processing backlog at the end of each week."""
+    fig = go.Figure(
+        layout=go.Layout(
+            title="Processing Backlog Over Time",
+            yaxis_title="Acquired but not Processed",
+            font=dict(size=14),
+            hovermode="x unified",
+            margin=dict(b=0,t=40,l=0,r=10)
         )
+    )
+    for (session, scan), df in backlog_df.groupby(["session", "scan"]):
+        fig.add_scatter(
+            x=df["week"],
+            y=df["backlog"],
+            mode="lines+markers",
+            name=f"{session} {scan}",
+            )
+    return fig
+
+
+def make_dashboard_body() -> list:
+    """Build the tables and charts from the current data snapshot."""
+    snapshot = get_snapshot()
+
+    # DataFrames of acquired and processed scans
+    table_newborn_acq: dash_table.DataTable = make_dash_table(snapshot["acquired"]["Newborn"], "table-newborn-acq")
+    table_sixmonth_acq: dash_table.DataTable = make_dash_table(snapshot["acquired"]["Six Month"], "table-sixmonth-acq")
+
+    table_tabs = dbc.Tabs(
+        id="table-tabs",
+        active_tab="newborn_acq",
+        children=[
+            dbc.Tab(tab_id="newborn_acq", label="Newborn", children=table_newborn_acq),
+            dbc.Tab(tab_id="sixmonth_acq", label="Six Month", children=table_sixmonth_acq),
+        ],
+    )
+
+    # Scan Count Tables
+    newborn_table = make_query_table(snapshot["newborn_df"].reset_index())
+    sixmonth_table = make_query_table(snapshot["sixmonth_df"].reset_index())
+    query_tabs = dbc.Tabs(
+        id="query-tabs",
+        active_tab="newborn",
+        children=[
+            dbc.Tab(tab_id="newborn", label="Newborn", children=newborn_table),
+            dbc.Tab(tab_id="sixmonth", label="Six Month", children=sixmonth_table),
+        ]
+    )
+
+    # Bar Chart, drawn client-side from the columnar counts (see assets/tracking.js)
+    counts_data = make_counts_data(snapshot["counts_df"])
+    trend_fig = make_trend_chart(snapshot["backlog_df"])
+
+    return [
+        dbc.Row(
+            [
+                dbc.Col(table_tabs, id="table-div", md=7),
+                dbc.Col(
+                    query_tabs,
+                    id="query-div",
+                    md=5,
+                    style={"margin-left": "5"},
+                    ),
+            ],
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    [
+                        dcc.Store(id="counts-store", data=counts_data),
+                        dbc.Row(
+                            [
+                                dbc.Col(dbc.Checklist(
+                                    id="visit-select",
+                                    options=counts_data["visits"],
+                                    value=counts_data["visits"],
+                                    inline=True,
+                                    )),
+                                dbc.Col(dbc.Checklist(
+                                    id="stage-select",
+                                    options=STAGES,
+                                    value=STAGES,
+                                    inline=True,
+                                    )),
+                            ],
+                        ),
+                        dcc.Graph(id="bar-chart"),
+                        dcc.Store(id="bar-selection", data=[]),
+                        dbc.Row(
+                            [
+                                dbc.Col(dbc.RadioItems(
+                                    id="status-select",
+                                    options=STATUSES,
+                                    value="Done",
+                                    inline=True,
+                                    ), md="auto"),
+                                dbc.Col(dbc.Button(
+                                    "Clear selection", id="clear-selection-btn", color="secondary", size="sm",
+                                    ), md="auto"),
+                                dbc.Col(html.Div("Click a bar to filter the subjects.", id="selection-status")),
+                            ],
+                            align="center",
+                        ),
+                    ],
+                    id="bar-div",
+                    md=7,
+                    ),
+                dbc.Col(
+                    html.P("Click a study_id to see its files."),
+                    id="inventory-div",
+                    md=5,
+                    ),
+            ],
+            style={"margin-top": "10px"},
+        ),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Graph(figure=trend_fig), id="trend-div", md=7),
+            ],
+            style={"margin-top": "10px"},
+        ),
+    ]
+
+
+def serve_layout() -> dbc.Container:
+    """Build the layout from the current data snapshot."""
+    return dbc.Container([
+        dbc.Label('SEA Lab MRI Tracking Dashboard'),
+        dbc.Row(
+            children=[dbc.Col(
+                children=[save_button, downloader, refresh_button],
+                md=4,
+                ),
+            dbc.Col(dropdown, md=7),
+            ],
+        ),
+        dbc.Row(
+            [
+                dbc.Col(refresh_progress, md=7),
+                dbc.Col(html.Div(id="refresh-status"), md=5),
+            ],
+            style={"margin-bottom": "5px"},
+        ),
+        html.Div(make_dashboard_body(), id="dashboard-body"),
+    ])
 
 ############################ APP ####################################
-app = Dash(external_stylesheets=[dbc.themes.SLATE])
+# Refreshes run in a separate process, so gunicorn workers stay responsive
+cache = diskcache.Cache(Path(__file__).parent.resolve() / ".cache" / "dash")
+background_callback_manager = DiskcacheManager(cache)
+
+app = Dash(
+    __name__,
+    external_stylesheets=[dbc.themes.SLATE],
+    compress=False,
+    background_callback_manager=background_callback_manager,
+)
 server = app.server
 
+################################## HTTP CACHING ##################################
+# Dash only enables gzip when it sets up compression itself, so we do it here.
+server.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+server.config["COMPRESS_MIMETYPES"] = [
+    "text/html",
+    "text/css",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+]
+Compress(server)
+
+# Responses that are fully determined by the data snapshot
+SNAPSHOT_ROUTES = ["/", "/_dash-layout", "/_dash-dependencies"]
+# Dash fingerprints these URLs, so they can be cached for a long time
+STATIC_PREFIXES = ["/assets/", "/_dash-component-suites/"]
+STATIC_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def _get_etag(version: str) -> str:
+    return f"{version}-{request.path.strip('/') or 'index'}"
+
+
+@server.before_request
+def return_not_modified():
+    """Answer with a 304 before Dash rebuilds the layout, if the data is unchanged."""
+    if request.method != "GET" or request.path not in SNAPSHOT_ROUTES:
+        return None
+    version, last_modified = get_version()
+    etag = _get_etag(version)
+    # Compression may have suffixed the ETag we sent (e.g. "<etag>:br")
+    if request.if_none_match:
+        client_etags = request.if_none_match.as_set(include_weak=True)
+        if any(tag.split(":")[0] == etag for tag in client_etags):
+            return server.response_class(status=304, headers={"ETag": f'"{etag}"'})
+    elif request.if_modified_since and request.if_modified_since >= last_modified:
+        return server.response_class(status=304)
+    return None
+
+
+@server.after_request
+def add_cache_headers(response):
+    if request.method != "GET" or response.status_code != 200:
+        return response
+    if request.path in SNAPSHOT_ROUTES:
+        version, last_modified = get_version()
+        response.set_etag(_get_etag(version))
+        response.last_modified = last_modified
+        # Browsers must revalidate, but can reuse the body on a 304
+        response.cache_control.no_cache = True
+    elif any(request.path.startswith(prefix) for prefix in STATIC_PREFIXES):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+    return response
+
+################################## JSON API ##################################
+# Read-only queries over the current snapshot, for the other lab tools
+server.register_blueprint(api)
+
 ################################## LAYOUT ##################################
-app.layout = dbc.Container([
-    dbc.Label('SEA Lab MRI Tracking Dashboard'),
-    dbc.Row(
-        children=[dbc.Col(
-            children=[save_button, downloader],
-            md=3,
-            ),
-        dbc.Col(dropdown, md=8),
-        ],
-    ),
-    dbc.Row(
-        [
-            dbc.Col(table_tabs, id="table-div", md=7),
-            dbc.Col(
-                query_tabs,
-                id="query-div",
-                md=5,
-                style={"margin-left": "5"},
-                ),
-        ],
-    ),
-    dbc.Row(
-        [
-            dbc.Col(dcc.Graph(figure=fig), id="bar-div", md=7),
-        ],
-        style={"margin-top": "10px"},
-    ),
-])
+app.layout = serve_layout
+
+# View state (visits, stages, y-axis range) is handled in the browser
+clientside_callback(
+    ClientsideFunction(namespace="tracking", function_name="barChart"),
+    Output("bar-chart", "figure"),
+    Input("counts-store", "data"),
+    Input("visit-select", "value"),
+    Input("stage-select", "value"),
+    Input("bar-selection", "data"),
+)
 
 ################ CALLBACKS #####################
 @callback(
@@ -253,7 +508,92 @@ app.layout = dbc.Container([
 )
 def func(n_clicks):
     print("Downloading CSV")
-    return dcc.send_data_frame(counts_df.to_csv, "mydf.csv")
+    return dcc.send_data_frame(get_snapshot()["counts_df"].to_csv, "mydf.csv")
+
+
+@callback(
+    Output("dashboard-body", "children"),
+    Output("refresh-status", "children"),
+    Input("refresh-btn", "n_clicks"),
+    State("project-dropdown", "value"),
+    background=True,
+    running=[(Output("refresh-btn", "disabled"), True, False)],
+    progress=[Output("refresh-progress", "value"), Output("refresh-progress", "label")],
+    prevent_initial_call=True,
+)
+def refresh_data(set_progress, n_clicks, project):
+    """Re-run the crawl -> merge -> count pipeline and show the new data."""
+    def progress(n_done, n_steps, label):
+        set_progress((100 * n_done / n_steps, label))
+
+    try:
+        run_pipeline([project], progress=progress)
+    except PipelineLockedError as err:
+        return no_update, str(err)
+    return make_dashboard_body(), f"Refreshed at {datetime.now():%Y-%m-%d %H:%M}"
+
+
+@callback(
+    Output("bar-selection", "data"),
+    Input("bar-chart", "clickData"),
+    Input("clear-selection-btn", "n_clicks"),
+    State("bar-selection", "data"),
+    State("status-select", "value"),
+    prevent_initial_call=True,
+)
+def select_bar(click_data, n_clicks, selection, status):
+    """Add the clicked bar to the selection, or remove it if it was already selected."""
+    if ctx.triggered_id == "clear-selection-btn" or not click_data:
+        return []
+    point = click_data["points"][0]
+    visit, stage = point["customdata"]
+    cell = [visit, stage, point["x"], status]
+    if cell in selection:
+        return [other for other in selection if other != cell]
+    return selection + [cell]
+
+
+@callback(
+    Output("table-newborn-acq", "data"),
+    Output("table-sixmonth-acq", "data"),
+    Output("selection-status", "children"),
+    Input("bar-selection", "data"),
+    prevent_initial_call=True,
+)
+def filter_subject_tables(selection):
+    """Show only the subjects that are in every selected bar."""
+    snapshot = get_snapshot()
+    visits = ["Newborn", "Six Month"]
+    if not selection:
+        return *[snapshot["acquired"][visit].to_pylist() for visit in visits], "Click a bar to filter the subjects."
+    labels = pa.array(lookup(snapshot["subject_index"], selection))
+    tables = [snapshot["acquired"][visit].filter(pc.is_in(snapshot["acquired_labels"][visit], value_set=labels)).to_pylist()
+              for visit in visits]
+    cells = " and ".join(f"{visit} {modality} {stage.lower()} ({status.lower()})"
+                         for visit, stage, modality, status in selection)
+    return *tables, f"{len(labels)} subjects: {cells}"
+
+
+@callback(
+    Output("inventory-div", "children"),
+    Input("table-newborn-acq", "active_cell"),
+    Input("table-sixmonth-acq", "active_cell"),
+    State("table-newborn-acq", "data"),
+    State("table-sixmonth-acq", "data"),
+    State("project-dropdown", "value"),
+    prevent_initial_call=True,
+)
+def show_subject_inventory(cell_newborn, cell_sixmonth, data_newborn, data_sixmonth, project):
+    """Fetch the file-level inventory of the clicked subject."""
+    if ctx.triggered_id == "table-newborn-acq":
+        cell, data, session = cell_newborn, data_newborn, "newborn"
+    else:
+        cell, data, session = cell_sixmonth, data_sixmonth, "sixmonth"
+    if not cell or cell["column_id"] != "study_id":
+        return no_update
+    study_id = data[cell["row"]]["study_id"]
+    df_inventory = get_subject_inventory(project, study_id, session)
+    return make_inventory_panel(df_inventory, study_id, session)
 
 if __name__ == "__main__":
-    app.run(debug=False)
\ No newline at end of file
+    app.run(debug=False)
@@ -0,0 +1,60 @@
+// Client-side callbacks for the tracking dashboard (see clientside_callback in app.py).
+// They only rearrange data that is already in the browser, so they never hit the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    tracking: {
+        // Bar chart of the acquired and processed scans of the selected visits.
+        // Each visit gets its own slot on the x-axis, with processed overlaid on acquired.
+        // Selected bars (see select_bar in app.py) are outlined.
+        barChart: function (data, visits, stages, selection) {
+            const shown = data.visits.filter((visit) => visits.includes(visit));
+            const width = 2 / 3 / Math.max(shown.length, 1);
+            const traces = [];
+            let yMax = 0;
+            shown.forEach((visit, ii) => {
+                const totals = data.scans.map(() => 0);
+                stages.forEach((stage) => {
+                    const counts = data.counts[visit][stage];
+                    if (!counts) {
+                        return;
+                    }
+                    counts.forEach((count, jj) => { totals[jj] += count; });
+                    const selected = data.scans.map((scan) => (selection || []).some(
+                        (cell) => cell[0] === visit && cell[1] === stage && cell[2] === scan));
+                    traces.push({
+                        type: "bar",
+                        x: data.scans,
+                        y: counts,
+                        offsetgroup: String(ii),
+                        offset: -1 / 3 + ii * width,
+                        width: width,
+                        legendgroup: visit,
+                        legendgrouptitle: {text: visit},
+                        name: stage,
+                        // Tells select_bar which bar was clicked
+                        customdata: data.scans.map(() => [visit, stage]),
+                        marker: {line: {color: "white", width: selected.map((isSelected) => (isSelected ? 3 : 0))}},
+                        hovertemplate: "%{y}<extra></extra>",
+                    });
+                });
+                yMax = Math.max(yMax, ...totals);
+            });
+            return {
+                data: traces,
+                layout: {
+                    barmode: "overlay",
+                    title: {text: "Number of Acquired and Processed Scans"},
+                    yaxis: {
+                        title: {text: "Count"},
+                        showticklabels: true,
+                        showgrid: true,
+                        range: [0, (yMax || 1) * 1.5],
+                    },
+                    font: {size: 18},
+                    legend: {x: 0, y: 0.8, orientation: "h"},
+                    hovermode: "closest",
+                    margin: {b: 0, t: 40, l: 0, r: 10},
+                },
+            };
+        },
+    },
+});
@@ -0,0 +1,114 @@
+import argparse
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+import paths as p
+from redcap import clean_redcap_ids, read_redcap
+
+# stage: derivatives column that is only filled in for subjects that have a folder in that stage
+DERIVATIVES_STAGES = {"NiBabies": "Anatomical",
+                      "DWI": "DWI",
+                      "Precomputed": "Precomputed",
+                      "Recon-all": "Recon-all",
+                      }
+COLUMNS = ["project", "session", "in_stage", "not_in_stage", "count", "study_ids"]
+
+
+def _to_id_array(study_ids):
+    # The IDs are kept as they are, so that odd folder names (e.g. "sub-1001b") are reported
+    return np.unique(np.asarray(study_ids, dtype=str))
+
+
+def load_stage_ids(project):
+    """Load the set of study IDs found in every stage of every session.
+
+    Only the saved tables are read, so the audit changes no state. The IDs are
+    sorted NumPy arrays, so the set operations stay fast for tens of thousands
+    of IDs.
+
+    Returns
+    -------
+    dict
+        Maps (session, stage) to a sorted array of study IDs. REDCap is not
+        tied to a session, so its IDs are stored under (None, "REDCap").
+    """
+    csvs = p.get_csv_paths(project)
+    stage_ids = {}
+    for session in p.SESSIONS[project]:
+        fname = csvs[f"acquisition_{session}"]
+        if fname.exists():
+            df = pd.read_csv(fname, usecols=["study_id"])
+            stage_ids[(session, "BIDS")] = _to_id_array(df["study_id"])
+        fname = csvs[f"derivatives_{session}"]
+        if fname.exists():
+            df = pd.read_csv(fname)
+            for stage, column in DERIVATIVES_STAGES.items():
+                stage_ids[(session, stage)] = _to_id_array(df.loc[df[column].notna(), "study_id"])
+    if csvs["redcap"].exists():
+        # The saved export, rather than an ingest, which would update the REDCap state
+        df_redcap = clean_redcap_ids(read_redcap(csvs["redcap"], project), project)
+        stage_ids[(None, "REDCap")] = _to_id_array(df_redcap.index)
+    else:
+        print(f"No REDCap export found at {csvs['redcap']}, skipping REDCap")
+    return stage_ids
+
+
+def audit(stage_ids, project):
+    """Find the subjects that are in one stage but not another, for every pair of stages.
+
+    Stages are compared within each session, and every session is compared
+    with REDCap.
+
+    Parameters
+    ----------
+    stage_ids : dict
+        The output of ``load_stage_ids``.
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per (session, in_stage, not_in_stage) with at least one
+        discrepancy, with the space-separated study IDs.
+    """
+    redcap_ids = stage_ids.get((None, "REDCap"))
+    rows = []
+    for session in p.SESSIONS[project]:
+        stages = {stage: ids for (ses, stage), ids in stage_ids.items() if ses == session}
+        if redcap_ids is not None:
+            stages["REDCap"] = redcap_ids
+        for (left, left_ids), (right, right_ids) in itertools.permutations(stages.items(), 2):
+            missing = np.setdiff1d(left_ids, right_ids, assume_unique=True)
+            if missing.size:
+                rows.append((project, session, left, right, missing.size, " ".join(missing)))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find subjects missing from a stage they should be in.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    stage_ids = load_stage_ids(args.project)
+    start = time.perf_counter()
+    report = audit(stage_ids, args.project)
+    elapsed = time.perf_counter() - start
+    for row in report.itertuples():
+        print(f"{row.session}: {row.count} in {row.in_stage} but not in {row.not_in_stage}")
+    out_dir = p.ROOT_DIR / "reports"
+    out_dir.mkdir(exist_ok=True)
+    report.to_csv(out_dir / f"{args.project}_audit.csv", index=False)
+    print(f"Compared {len(stage_ids)} ID sets in {elapsed * 1000:.1f} ms")
+    print("✅ Done!")
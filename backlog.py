@@ -0,0 +1,157 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import paths as p
+from utils import read_final_df
+
+# pipeline: (acquired scan it needs, processed column that says it is done)
+PIPELINES = {"nibabies-anat": ("Anatomical", "Anatomical"),
+             "nibabies-func": ("Functional", "Functional-Volume"),
+             "dwi": ("DWI", "DWI"),
+             "recon-all": ("Anatomical", "Recon-all"),
+             }
+VISITS = {"Newborn": "newborn",
+          "Six Months": "sixmonth",
+          "Twelve Months": "twelvemonth",
+          }
+
+
+def read_acquisition_dates(project):
+    """Get the acquisition date of every subject and session, where it is known."""
+    csvs = p.get_csv_paths(project)
+    dates = []
+    for session in VISITS.values():
+        fname = csvs[f"acquisition_{session}"]
+        if not fname.exists():
+            continue
+        df = pd.read_csv(fname, usecols=lambda col: col in ["study_id", "Date-Acquired"])
+        if "Date-Acquired" not in df.columns:
+            continue
+        df["session"] = session
+        dates.append(df)
+    if not dates:
+        return pd.DataFrame(columns=["study_id", "session", "Date-Acquired"])
+    dates = pd.concat(dates, ignore_index=True)
+    dates["Date-Acquired"] = pd.to_datetime(dates["Date-Acquired"], errors="coerce")
+    return dates
+
+
+def get_backlog(df, project):
+    """Find every scan that was acquired but not processed, for each pipeline and visit.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The final (Stage, Visit, Scan) dataframe from ``merge_dataframes.build_dataframe``.
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per (pipeline, session, study_id), ranked within each pipeline and
+        session so that the longest-waiting acquisitions come first. Subjects without
+        an acquisition date are ranked after those with one, by study_id.
+    """
+    visits = [visit for visit in VISITS if ("Acquired", visit) in df.columns.droplevel(2)]
+    study_ids = df.index.to_numpy()
+    backlog = []
+    for visit in visits:
+        for pipeline, (scan, processed_col) in PIPELINES.items():
+            if ("Processed", visit, processed_col) not in df.columns:
+                continue
+            acquired = df[("Acquired", visit, scan)].to_numpy() == "Acquired"
+            not_processed = df[("Processed", visit, processed_col)].to_numpy() == "Not Processed"
+            backlog.append(pd.DataFrame({"pipeline": pipeline,
+                                         "session": VISITS[visit],
+                                         "study_id": study_ids[acquired & not_processed],
+                                         }))
+    columns = ["pipeline", "session", "study_id", "Date-Acquired", "rank"]
+    if not backlog:
+        return pd.DataFrame(columns=columns)
+    backlog = pd.concat(backlog, ignore_index=True)
+    backlog = backlog.merge(read_acquisition_dates(project), on=["study_id", "session"], how="left")
+    backlog = backlog.sort_values(["pipeline", "session", "Date-Acquired", "study_id"], na_position="last")
+    backlog["rank"] = backlog.groupby(["pipeline", "session"]).cumcount() + 1
+    return backlog[columns].reset_index(drop=True)
+
+
+def make_batches(study_ids, n_workers):
+    """Split the participant labels into batches of at most n_workers subjects."""
+    labels = [study_id.removeprefix("sub-") for study_id in study_ids]
+    n_batches = int(np.ceil(len(labels) / n_workers))
+    return [labels[ii * n_workers:(ii + 1) * n_workers] for ii in range(n_batches)]
+
+
+def write_job_lists(backlog, project, n_workers, fmt="labels"):
+    """Write the backlog of each pipeline and session as batched job lists.
+
+    The job lists of the project's previous run are removed first.
+
+    Parameters
+    ----------
+    backlog : pandas.DataFrame
+        The output of ``get_backlog``.
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    n_workers : int
+        The maximum number of subjects per job.
+    fmt : str
+        ``"labels"`` writes one participant-label file per batch. ``"slurm"`` writes
+        one file per pipeline and session, where line N holds the participant labels
+        of SLURM array task N.
+    """
+    assert fmt in ["labels", "slurm"]
+    out_dir = p.ROOT_DIR / "reports" / "backlog"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    backlog.to_csv(out_dir / f"{project}_backlog.csv", index=False)
+    # Remove the job lists of the last run, so that no stale batch resubmits subjects
+    # that have been processed since (or whose backlog is now empty)
+    for pattern in [f"{project}_*_batch-*.txt", f"{project}_*_array.txt"]:
+        for fname in out_dir.glob(pattern):
+            fname.unlink()
+    for (pipeline, session), df in backlog.groupby(["pipeline", "session"]):
+        batches = make_batches(df["study_id"], n_workers)
+        stem = f"{project}_{session}_{pipeline}"
+        if fmt == "labels":
+            for ii, batch in enumerate(batches, start=1):
+                (out_dir / f"{stem}_batch-{ii:02d}.txt").write_text(" ".join(batch) + "\n")
+        elif fmt == "slurm":
+            array_fname = out_dir / f"{stem}_array.txt"
+            array_fname.write_text("".join(" ".join(batch) + "\n" for batch in batches))
+            print(f"sbatch --array=1-{len(batches)} ... # labels: sed -n \"${{SLURM_ARRAY_TASK_ID}}p\" {array_fname}")
+        print(f"{stem}: {len(df)} subjects in {len(batches)} job(s)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Emit batched job lists for unprocessed scans.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--workers",
+                        type=int,
+                        default=8,
+                        dest="n_workers",
+                        help="Maximum number of subjects per job.",
+                        )
+    parser.add_argument("--format",
+                        type=str,
+                        default="labels",
+                        choices=["labels", "slurm"],
+                        dest="fmt",
+                        help="Write participant-label lists or SLURM array files.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    df = read_final_df(args.project)
+    backlog = get_backlog(df, args.project)
+    write_job_lists(backlog, args.project, args.n_workers, fmt=args.fmt)
+    print("✅ Done!")
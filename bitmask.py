@@ -0,0 +1,137 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from utils import read_final_df
+
+VISITS = ["Newborn", "Six Months", "Twelve Months"]
+# (stage, scan) columns of the final dataframe, in bit order. Append new flags at the
+# end, so that saved masks keep their meaning.
+FLAGS = [("Acquired", "Anatomical"),
+         ("Acquired", "T1w"),
+         ("Acquired", "T2w"),
+         ("Acquired", "Functional"),
+         ("Acquired", "DWI"),
+         ("Processed", "Anatomical"),
+         ("Processed", "Functional-Volume"),
+         ("Processed", "Functional-Surface"),
+         ("Processed", "DWI"),
+         ("Processed", "Precomputed"),
+         ("Processed", "Recon-all"),
+         ]
+BITS = {flag: np.uint32(1 << ii) for ii, flag in enumerate(FLAGS)}
+# What each acquired scan is processed into, for the conversion rates
+CONVERSIONS = {"Anatomical": "Anatomical",
+               "Functional": "Functional-Volume",
+               "DWI": "DWI",
+               }
+DONE = ["Acquired", "Processed", "True", True]
+
+
+def encode(df):
+    """Pack the acquisition and processing state of every subject into bitmasks.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The final (Stage, Visit, Scan) dataframe from ``merge_dataframes.build_dataframe``.
+
+    Returns
+    -------
+    study_ids : numpy.ndarray
+        The study_id of each row of ``masks``.
+    masks : numpy.ndarray
+        A (visits, subjects) array of uint32, where bit ``FLAGS.index(flag)`` is
+        set if that scan was acquired (or processed) at that visit. Visits are in
+        ``VISITS`` order, and visits the project does not have are all zeros.
+    """
+    masks = np.zeros((len(VISITS), len(df)), dtype=np.uint32)
+    for jj, visit in enumerate(VISITS):
+        for (stage, scan), bit in BITS.items():
+            column = (stage, visit, scan)
+            if column in df.columns:
+                masks[jj, df[column].isin(DONE).to_numpy()] |= bit
+    return df.index.to_numpy(), masks
+
+
+def get_mask(flags):
+    """Combine (stage, scan) flags into a single bitmask."""
+    mask = np.uint32(0)
+    for flag in flags:
+        mask |= BITS[flag]
+    return mask
+
+
+def select(masks, visit, has=(), lacks=()):
+    """Find the subjects that have every flag in ``has`` and none in ``lacks`` at a visit.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array over the subjects. Combine several with ``&`` and ``|``, e.g.
+        newborn T2w acquired but six-month BOLD missing::
+
+            (select(masks, "Newborn", has=[("Acquired", "T2w")])
+             & select(masks, "Six Months", lacks=[("Acquired", "Functional")]))
+    """
+    visit_masks = masks[VISITS.index(visit)]
+    has_mask, lacks_mask = get_mask(has), get_mask(lacks)
+    return ((visit_masks & has_mask) == has_mask) & ((visit_masks & lacks_mask) == 0)
+
+
+def funnel(masks, steps):
+    """Count the subjects that pass each step, and every step before it.
+
+    Parameters
+    ----------
+    masks : numpy.ndarray
+        The bitmasks from ``encode``.
+    steps : list of tuple
+        The (visit, flags) of each step, e.g. for retention of anatomical scans
+        ``[(visit, [("Acquired", "Anatomical")]) for visit in VISITS]``.
+
+    Returns
+    -------
+    list of int
+        The number of subjects left after each step.
+    """
+    passed = np.ones(masks.shape[1], dtype=bool)
+    counts = []
+    for visit, flags in steps:
+        passed &= select(masks, visit, has=flags)
+        counts.append(int(passed.sum()))
+    return counts
+
+
+def conversion(masks, visit, scan):
+    """Get the fraction of acquired ``scan`` that was processed at a visit."""
+    acquired = select(masks, visit, has=[("Acquired", scan)])
+    processed = acquired & select(masks, visit, has=[("Processed", CONVERSIONS[scan])])
+    n_acquired = acquired.sum()
+    return processed.sum() / n_acquired if n_acquired else np.nan
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print retention and processing funnels.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    df = read_final_df(args.project)
+    study_ids, masks = encode(df)
+    visits = [visit for visit in VISITS if ("Acquired", visit) in df.columns.droplevel(2)]
+    for scan in CONVERSIONS:
+        counts = funnel(masks, [(visit, [("Acquired", scan)]) for visit in visits])
+        print(f"{scan} retention: " + " -> ".join(f"{visit} {n}" for visit, n in zip(visits, counts)))
+    for visit in visits:
+        for scan in CONVERSIONS:
+            print(f"{visit} {scan}: {conversion(masks, visit, scan):.0%} of acquired processed")
+    print("✅ Done!")
@@ -0,0 +1,179 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+import pandas as pd
+import pytest
+
+# The modules read these when they are imported, so they are set before any test
+# module imports them: a scratch root for csv/ and reports/, and an in-memory server
+# (without listing cache, so files written by a test are seen at once)
+ROOT_DIR = tempfile.mkdtemp(prefix="tracking-tests-")
+os.environ["TRACKING_ROOT_DIR"] = ROOT_DIR
+os.environ["TRACKING_SERVER_URL"] = "memory://Daily_2"
+os.environ["TRACKING_CACHE_TTL"] = "0"
+
+import fsspec  # noqa: E402
+
+import paths as p  # noqa: E402
+
+# The BABIES crawl outputs saved in the repo
+FIXTURES_DIR = Path(__file__).parent / "csv"
+CRAWL_CSVS = ["acquisition_newborn", "acquisition_sixmonth", "derivatives_newborn", "derivatives_sixmonth"]
+CHOICES = {"neonatal_status_v2": "1, Completed | 2, Scheduled | 3, Withdrawn",
+           "sixmo_status_v2": "1, Completed | 2, Scheduled | 3, Withdrawn",
+           "neonatal_notscan_v2": "1, Family declined | 2, Motion",
+           "sixmo_notscan_v2": "1, Family declined | 2, Motion",
+           "infant_sex": "1, Male | 2, Female",
+           "child_sex": "1, Male | 2, Female",
+           }
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(ROOT_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def root_dir(monkeypatch):
+    """Give every test an empty root folder and an empty server."""
+    for path in p.ROOT_DIR.iterdir():
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    (p.ROOT_DIR / "csv").mkdir()
+    (p.ROOT_DIR / "reports").mkdir()
+    memory = fsspec.filesystem("memory")
+    memory.store.clear()
+    memory.pseudo_dirs[:] = [""]
+    # Some scripts write to ./reports
+    monkeypatch.chdir(p.ROOT_DIR)
+    return p.ROOT_DIR
+
+
+@pytest.fixture
+def tracking_csvs(root_dir):
+    """The BABIES crawl outputs, and a REDCap export and data dictionary of their subjects.
+
+    Besides the crawled subjects, the export has one subject that was never
+    scanned and one ID that is out of range.
+    """
+    csvs = p.get_csv_paths("BABIES")
+    for key in CRAWL_CSVS:
+        shutil.copy(FIXTURES_DIR / csvs[key].name, csvs[key])
+    subjects = set()
+    for key in CRAWL_CSVS:
+        subjects.update(pd.read_csv(csvs[key])["study_id"].str.removeprefix("sub-"))
+    study_ids = [*sorted(subjects), "1999", "5000"]
+    answers = {"neonatal_status_v2": cycle(["1", "2", "3", ""]),
+               "sixmo_status_v2": cycle(["1", "", "2"]),
+               "neonatal_notscan_v2": cycle(["", "1", "2"]),
+               "sixmo_notscan_v2": cycle(["", "", "1"]),
+               "infant_sex": cycle(["1", "2", ""]),
+               }
+    df_redcap = pd.DataFrame([{"study_id": study_id, **{field: next(values) for field, values in answers.items()}}
+                              for study_id in study_ids])
+    # child_sex is only filled in when infant_sex is not
+    df_redcap["child_sex"] = df_redcap["infant_sex"].map({"": "2"}).fillna("")
+    df_redcap.to_csv(csvs["redcap"], index=False)
+    pd.DataFrame({"Variable / Field Name": list(CHOICES),
+                  "Choices, Calculations, OR Slider Labels": list(CHOICES.values()),
+                  }).to_csv(csvs["datadict"], index=False)
+    return csvs
+
+
+@pytest.fixture
+def server():
+    """The in-memory fsspec filesystem behind ``paths.SERVER_PATH``."""
+    return fsspec.filesystem("memory")
+
+
+class StubREDCap:
+    """The parts of the REDCap API that the tracking scripts use.
+
+    Records have a ``modified`` time (on the server's clock), which
+    ``dateRangeBegin`` filters on. Imported records are saved to ``records``.
+    ``fail`` holds the status codes to answer with, one request at a time,
+    before answering normally. None answers that request normally.
+    """
+
+    def __init__(self, records, metadata):
+        self.records = records
+        self.metadata = metadata
+        self.fail = []
+        self.requests = []
+        self.imported = []
+
+    def handle(self, data):
+        self.requests.append(data)
+        status = self.fail.pop(0) if self.fail else None
+        if status is not None:
+            return status, ""
+        fields = [value for key, value in data.items() if key.startswith("fields[")]
+        if data["content"] == "record" and "data" in data:
+            df = pd.read_csv(io.StringIO(data["data"]), dtype=str, keep_default_na=False)
+            if not set(df.columns) <= set(self.records.columns):
+                return 400, '{"error": "The following fields do not exist in the project"}'
+            self.imported.append(df)
+            self.import_records(df, overwrite=data.get("overwriteBehavior") == "overwrite")
+            return 200, f'{{"count": {len(df)}}}'
+        if data["content"] == "record":
+            df = self.records
+            if "dateRangeBegin" in data:
+                df = df[df["modified"] >= data["dateRangeBegin"]]
+            if df.empty:
+                # Like REDCap, without even a header row
+                return 200, ""
+            return 200, df[fields or df.columns.drop("modified")].to_csv(index=False)
+        if data["content"] == "metadata":
+            df = self.metadata
+            if fields:
+                df = df[df["field_name"].isin(fields)]
+            return 200, df.to_csv(index=False)
+        return 400, '{"error": "Unsupported content"}'
+
+    def import_records(self, df, overwrite):
+        """Save imported records like REDCap: unknown IDs become new records, and
+        blank values only erase a field with ``overwriteBehavior=overwrite``."""
+        id_col = df.columns[0]
+        records = self.records.set_index(id_col)
+        values = df.set_index(id_col)
+        if not overwrite:
+            values = values.replace("", None)
+        records = records.reindex(records.index.union(values.index))
+        records.update(values)
+        self.records = records.fillna("").reset_index()
+
+
+@pytest.fixture
+def redcap_server():
+    """A local REDCap stub, served from a thread. Its URL is ``stub.url``."""
+    stub = StubREDCap(records=pd.DataFrame(columns=["modified"]),
+                      metadata=pd.DataFrame(columns=["field_name", "select_choices_or_calculations"]))
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            status, text = stub.handle(dict(parse_qsl(body, keep_blank_values=True)))
+            payload = text.encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    stub.url = f"http://127.0.0.1:{httpd.server_address[1]}/api/"
+    yield stub
+    httpd.shutdown()
+    httpd.server_close()
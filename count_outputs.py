@@ -1,6 +1,11 @@
 import argparse
 
 import dataframes
+import inventory
+from history import update_aggregate
+from nifti import build_acquisition_details
+from qc import build_qc_table
+from sidecars import build_sidecar_table
 
 
 def parse_args():
@@ -19,17 +24,55 @@ def parse_args():
                         dest="session",
                         help="Visit. Must be 'newborn', 'sixmonth', or 'twelvemonth'.",
                         )
+    parser.add_argument("--verify",
+                        action="store_true",
+                        dest="verify",
+                        help="Check the expected key outputs of each derivative, not just that it exists.",
+                        )
+    parser.add_argument("--checksums",
+                        action="store_true",
+                        dest="checksums",
+                        help="With --verify, also record checksums of the verified outputs.",
+                        )
+    parser.add_argument("--qc",
+                        action="store_true",
+                        dest="qc",
+                        help="Also summarize the motion (FD, DVARS) of every NiBabies BOLD run.",
+                        )
+    parser.add_argument("--details",
+                        action="store_true",
+                        dest="details",
+                        help="Also read the NIfTI headers of the BOLD and DWI scans to flag short runs.",
+                        )
+    parser.add_argument("--sidecars",
+                        action="store_true",
+                        dest="sidecars",
+                        help="Also index the acquisition parameters in the BIDS JSON sidecars.",
+                        )
     args = parser.parse_args()
     return args
 
-def build_dataframes(project, session):
+def build_dataframes(project, session, verify=False, checksums=False, qc=False, details=False,
+                     sidecars=False, indexes=True):
+    # The inventory store and the history aggregate are shared by every session of a
+    # project, so the pipeline crawls with indexes=False and updates them afterwards
     dataframes.build_acquisition_df(project, session)
-    dataframes.build_derivatives_df(project, session)
+    if details:
+        build_acquisition_details(project, session)
+    if sidecars:
+        build_sidecar_table(project, session)
+    dataframes.build_derivatives_df(project, session, verify=verify, checksums=checksums)
+    if qc:
+        build_qc_table(project, session)
+    if indexes:
+        inventory.build_inventory(project, session)
+        update_aggregate()
 
 if __name__ == "__main__":
     # Parse command line arguments
     args = parse_args()
     project = args.project
     session = args.session
-    build_dataframes(project, session)
+    build_dataframes(project, session, verify=args.verify, checksums=args.checksums,
+                     qc=args.qc, details=args.details, sidecars=args.sidecars)
     print("✅ Done!")
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import os
+
+import duckdb
+import pandas as pd
+
+import paths as p
+from utils import get_changed_ids, read_final_df
+
+DIMENSIONS = ["project", "visit", "stage", "modality", "status", "sex", "recon_method"]
+CUBE_FNAME = p.ROOT_DIR / "reports" / "cube.parquet"
+STATE_DIR = p.ROOT_DIR / "reports" / ".cube_state"
+# Digest of the cube that the saved facts and hashes were last counted into
+DIGEST_FNAME = STATE_DIR / "cube.sha1"
+# Columns of the final dataframe that describe a subject or visit rather than a scan
+NOT_MODALITIES = {"Acquired": ["Biological Sex", "Status", "Reason Not-Acquired"],
+                  "Processed": ["Surface-Recon-Method", "Date-Processed"],
+                  }
+# How the final dataframe marks a done scan, besides the name of the stage
+DONE = [True, "True"]
+NOT_DONE = [False, "False"]
+# Every grouping set of the dimensions. Rolled-up dimensions are NULL, so the facts
+# never are (see get_facts).
+CUBE_QUERY = f"""
+SELECT {", ".join(DIMENSIONS)}, count(*) AS count
+FROM facts
+GROUP BY CUBE ({", ".join(DIMENSIONS)})
+"""
+# Add the cube of the new facts of the changed subjects and subtract that of their old facts
+MERGE_QUERY = f"""
+SELECT {", ".join(DIMENSIONS)}, sum(count)::BIGINT AS count
+FROM (SELECT * FROM cube
+      UNION ALL SELECT * FROM added
+      UNION ALL SELECT {", ".join(DIMENSIONS)}, -count FROM removed)
+GROUP BY ALL
+HAVING sum(count) <> 0
+"""
+
+
+def get_state_paths(project):
+    return {"facts": STATE_DIR / f"{project}_facts.parquet",
+            "hashes": STATE_DIR / f"{project}_hashes.csv",
+            }
+
+
+def _get_digest(fname):
+    return hashlib.sha1(fname.read_bytes()).hexdigest()
+
+
+def _write(fname, write):
+    tmp_fname = fname.with_name(fname.name + ".partial")
+    write(tmp_fname)
+    os.replace(tmp_fname, fname)
+
+
+def is_consistent(state):
+    """Whether the saved cube is the one the saved facts and hashes were counted into.
+
+    An update that failed half way (e.g. after replacing the cube but not the
+    state) leaves them out of step, and the next update must rebuild the cube.
+    """
+    return (CUBE_FNAME.exists() and state["facts"].exists() and state["hashes"].exists()
+            and DIGEST_FNAME.exists() and DIGEST_FNAME.read_text() == _get_digest(CUBE_FNAME))
+
+
+def get_facts(df, project):
+    """Unpivot the final dataframe into one row per (subject, visit, stage, modality).
+
+    Statuses are the labels of the final dataframe, with done and not done
+    booleans named after their stage (e.g. True -> "Acquired").
+
+    Returns
+    -------
+    pandas.DataFrame
+        The ``study_id`` and the ``DIMENSIONS`` of every scan, none of them null.
+    """
+    sex = df[("Acquired", "Newborn", "Biological Sex")]
+    facts = []
+    for stage, visit, modality in df.columns:
+        if modality in NOT_MODALITIES[stage]:
+            continue
+        status = df[(stage, visit, modality)]
+        status = status.mask(status.isin(DONE), stage).mask(status.isin(NOT_DONE), f"Not {stage}")
+        facts.append(pd.DataFrame({"project": project,
+                                   "study_id": df.index,
+                                   "visit": visit,
+                                   "stage": stage,
+                                   "modality": modality,
+                                   "status": status.to_numpy(),
+                                   "sex": sex.to_numpy(),
+                                   "recon_method": df[("Processed", visit, "Surface-Recon-Method")].to_numpy(),
+                                   }))
+    facts = pd.concat(facts, ignore_index=True).fillna("Missing").astype(str)
+    # A null would read as a rolled-up dimension
+    return facts.replace({"": "Missing"})
+
+
+def _run(query, **tables):
+    with duckdb.connect() as con:
+        for name, table in tables.items():
+            con.register(name, table)
+        return con.sql(query).df()
+
+
+def build_cube(facts):
+    """Count the scans in every cell of every grouping set of ``DIMENSIONS``."""
+    return _run(CUBE_QUERY, facts=facts[DIMENSIONS])
+
+
+def update_cube(project, full=False):
+    """Update the cube with the final dataframe of a project.
+
+    Subjects are hashed like in ``merge_dataframes``. Only the facts of the
+    subjects that changed since the last update are cubed, and their counts
+    replace the old ones in the saved cube, so an update costs as much as the
+    number of changed subjects. If the last update failed half way, the cube is
+    rebuilt instead.
+
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    full : bool
+        Whether to rebuild the cube from the facts of every project.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cube, with one row per non-empty cell: the ``DIMENSIONS`` (None
+        where rolled up) and the ``count`` of scans. It is also saved to
+        ``reports/cube.parquet``.
+    """
+    df = read_final_df(project)
+    facts = get_facts(df, project)
+    hashes = pd.util.hash_pandas_object(df, index=True)
+    state = get_state_paths(project)
+
+    if not full and is_consistent(state):
+        previous_hashes = pd.read_csv(state["hashes"], index_col="study_id", dtype={"hash": "uint64"})["hash"]
+        changed, removed = get_changed_ids(hashes, previous_hashes)
+        changed = changed.union(removed)
+        previous_facts = pd.read_parquet(state["facts"])
+        added = build_cube(facts[facts["study_id"].isin(changed)])
+        removed = build_cube(previous_facts[previous_facts["study_id"].isin(changed)])
+        cube = _run(MERGE_QUERY, cube=pd.read_parquet(CUBE_FNAME), added=added, removed=removed)
+        print(f"Updated the cube with {len(changed)} changed {project} subjects")
+    else:
+        others = [pd.read_parquet(fname) for fname in sorted(STATE_DIR.glob("*_facts.parquet"))
+                  if fname != state["facts"]]
+        cube = build_cube(pd.concat([*others, facts], ignore_index=True))
+        print(f"Built the cube from {len(others) + 1} projects")
+
+    # The cube first and the digest last, so that a failure in between is caught by
+    # is_consistent and the next update rebuilds the cube
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    DIGEST_FNAME.unlink(missing_ok=True)
+    _write(CUBE_FNAME, lambda fname: cube.to_parquet(fname, index=False))
+    _write(state["facts"], lambda fname: facts.to_parquet(fname, index=False))
+    _write(state["hashes"], lambda fname: hashes.to_csv(fname, index_label="study_id", header=["hash"]))
+    _write(DIGEST_FNAME, lambda fname: fname.write_text(_get_digest(CUBE_FNAME)))
+    return cube
+
+
+def load_cube(fname=CUBE_FNAME):
+    """Load the saved cube as a dict from its ``DIMENSIONS`` (None where rolled up) to the count.
+
+    Use ``get_count`` to read a cell. ``fname`` can point to the cube of a snapshot.
+    """
+    if not fname.exists():
+        return {}
+    cube = pd.read_parquet(fname)
+    keys = cube[DIMENSIONS].astype(object).where(cube[DIMENSIONS].notna(), None)
+    return dict(zip(keys.itertuples(index=False, name=None), cube["count"].tolist()))
+
+
+def get_count(cube, **dims):
+    """Count the scans in a slice of the cube, in constant time.
+
+    Dimensions that are not given are rolled up, e.g.
+    ``get_count(cube, project="BABIES", visit="Newborn", stage="Acquired", status="Acquired")``
+    counts the newborn scans acquired in BABIES, over every modality, sex and
+    recon method.
+    """
+    unknown = set(dims) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"{unknown} are not dimensions of the cube")
+    return cube.get(tuple(dims.get(dim) for dim in DIMENSIONS), 0)
+
+
+def get_values(cube, dim, **dims):
+    """List the values of a dimension in a slice of the cube, e.g. the modalities of a visit."""
+    index = DIMENSIONS.index(dim)
+    key = [dims.get(other) for other in DIMENSIONS]
+    values = set()
+    for cell in cube:
+        if cell[index] is not None and all(value == key[ii] for ii, value in enumerate(cell) if ii != index):
+            values.add(cell[index])
+    return sorted(values)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Update the tracking cube with the final dataframe of a project.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--full",
+                        action="store_true",
+                        dest="full",
+                        help="Rebuild the cube instead of updating the subjects that changed.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    update_cube(args.project, full=args.full)
+    print("✅ Done!")
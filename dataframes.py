@@ -1,145 +1,230 @@
-from pathlib import Path
-
 import pandas as pd
+import pyarrow as pa
 from paths import SERVER_PATH, get_paths
+from runs import build_run_index, get_latest_runs
 from utils import (
-    create_participant_df,
-    extract_processing_datetime,
-    load_nibabies_toml,
+    CHUNK_SIZE,
+    extract_acquisition_datetime,
+    iter_chunks,
+    iter_participants,
     print_starting_msg,
-    save_df_to_csv,
+    save_records,
 )
+from verify import verify_outputs
+
+ACQUISITION_SCHEMA = pa.schema([("study_id", pa.string()),
+                                ("Anatomical", pa.bool_()),
+                                ("T1w", pa.bool_()),
+                                ("T2w", pa.bool_()),
+                                ("Functional", pa.bool_()),
+                                ("DWI", pa.bool_()),
+                                ("Date-Acquired", pa.timestamp("s")),
+                                ])
+DERIVATIVES_SCHEMA = pa.schema([("study_id", pa.string()),
+                                ("Anatomical", pa.bool_()),
+                                ("Surface-Recon-Method", pa.string()),
+                                ("Functional-Volume", pa.bool_()),
+                                ("Functional-Surface", pa.bool_()),
+                                ("Date-Processed", pa.date32()),
+                                ("DWI", pa.bool_()),
+                                ("Precomputed", pa.bool_()),
+                                ("Recon-all", pa.bool_()),
+                                ])
 
 
 def build_acquisition_df(project, session):
-    """Build a CSV file documenting which participants received MRI scans."""
+    """Build a CSV file documenting which participants received MRI scans.
+
+    Subjects are crawled one at a time and written in chunks of ``CHUNK_SIZE``,
+    so memory stays bounded and the first rows are on disk right away.
+
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    session : str
+        The session to process (e.g., "newborn", "sixmonth", "twelvemonth").
+    """
+    records = iter_acquisition_records(project, session)
+    save_records(records, ACQUISITION_SCHEMA, project, session, "acquisition")
+
+
+def iter_acquisition_records(project, session):
+    """Yield one acquisition record per participant in the BIDS directory."""
     print_starting_msg(project, session, "Acquired Anatomical, Functional, and DWI")
     bpath = get_paths(project, session)["bids"]
-    df = create_participant_df(bpath)
+    for sub in iter_participants(bpath):
+        yield get_acquisition_record(bpath, sub, session)
+        print(".", end="", flush=True)
 
-    df[f"Anatomical"] = None
-    df[f"T1w"] = None
-    df[f"T2w"] = None
-    df[f"Functional"] = None
-    df[f"DWI"] = None
-    for i, series in df.iterrows():
-        sub = series["study_id"]
 
-        assert sub.startswith("sub-")
-        sub_path = bpath / sub
+def get_acquisition_record(bpath, sub, session):
+    """Check which scans were acquired for a single participant."""
+    assert sub.startswith("sub-")
+    sub_path = bpath / sub
+
+    assert session in ["newborn", "sixmonth", "twelvemonth"]
+    anat_path = sub_path / f"ses-{session}" / "anat"
+    func_path = sub_path / f"ses-{session}" / "func"
+    dwi_path = sub_path / f"ses-{session}" / "dwi"
+
+    has_t1w = any(anat_path.glob("*_T1w.*"))
+    has_t2w = any(anat_path.glob("*_T2w.*"))
+    if not has_t1w and not has_t2w:
+        anat_raw_path = sub_path / f"ses-{session}" / "anat_raw"
+        if anat_raw_path.exists():
+            has_t1w = any(anat_raw_path.glob("*_T1w.*"))
+            has_t2w = any(anat_raw_path.glob("*_T2w.*"))
+
+    has_func = any(func_path.glob("*_bold.*"))
+    has_dwi = any(dwi_path.glob("*_dwi.*"))
+    acquisition_date = extract_acquisition_datetime(sub_path / f"ses-{session}")
+    return {"study_id": sub,
+            "Anatomical": has_t1w or has_t2w,
+            "T1w": has_t1w,
+            "T2w": has_t2w,
+            "Functional": has_func,
+            "DWI": has_dwi,
+            "Date-Acquired": acquisition_date,
+            }
+
+
+def build_derivatives_df(project, session, verify=False, checksums=False):
+    """ Build a CSV File for Nibabies, precomputed, and other derivatives.
 
-        assert session in ["newborn", "sixmonth", "twelvemonth"]
-        anat_path = sub_path / f"ses-{session}" / "anat"
-        func_path = sub_path / f"ses-{session}" / "func"
-        dwi_path = sub_path / f"ses-{session}" / "dwi"
-
-        has_t1w = any(anat_path.glob("*_T1w.*"))
-        has_t2w = any(anat_path.glob("*_T2w.*"))
-        if not has_t1w and not has_t2w:
-            anat_raw_path = sub_path / f"ses-{session}" / "anat_raw"
-            if anat_raw_path.exists():
-                has_t1w = any(anat_raw_path.glob("*_T1w.*"))
-                has_t2w = any(anat_raw_path.glob("*_T2w.*"))
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    session : str
+        The session to process (e.g., "newborn", "sixmonth", "twelvemonth").
+    verify : bool
+        Whether to check the expected key outputs of the DWI, precomputed and
+        recon-all derivatives, instead of only checking that their folders are
+        not empty. See ``verify.EXPECTED_OUTPUTS``.
+    checksums : bool
+        Whether to also record checksums of the verified outputs.
+    """
+    records = iter_derivatives_records(project, session, verify=verify, checksums=checksums)
+    save_records(records, DERIVATIVES_SCHEMA, project, session, "derivatives")
 
-        df.loc[i, f"T1w"] = has_t1w
-        df.loc[i, f"T2w"] = has_t2w
-        df.loc[i, f"Anatomical"] = has_t1w or has_t2w
 
-        has_func = any(func_path.glob("*_bold.*"))
-        df.loc[i, f"Functional"] = has_func
+def _get_pipeline_paths(project, session):
+    """Get the derivatives folder of each pipeline that is checked for outputs."""
+    dpath = get_paths(project, session)["derivatives"]
+    if project == "BABIES":
+        dwi_path = dpath / "Diffusion"
+    elif project == "ABC":
+        dwi_path = dpath / "diffusion"
+    return {"DWI": dwi_path,
+            "Precomputed": dpath / "precomputed",
+            "Recon-all": dpath / "recon-all",
+            }
 
-        has_dwi = any(dwi_path.glob("*_dwi.*"))
-        df.loc[i, f"DWI"] = has_dwi
-        print(".", end="", flush=True)
 
-    # Save file
-    save_df_to_csv(df, project, session, "acquisition")
-
-
-def build_derivatives_df(project, session):
-    """ Build a CSV File for Nibabies, precomputed, and other derivatives."""
-    # Extract the sub-* foldernames and write to file for later
-    # Nibabies
-    nibabies_df = build_nibabies_df(project, session)
-    dwi_df = build_dwi_df(project, session)
-    precomputed_df = build_precomputed_df(project, session)
-    reconall_df = build_reconall_df(project, session)
-    # Merge the dataframes
-    df = nibabies_df.merge(dwi_df, on="study_id", how="outer")
-    df = df.merge(precomputed_df, on="study_id", how="outer")
-    df = df.merge(reconall_df, on="study_id", how="outer")
-    # Save file
-    save_df_to_csv(df, project, session, "derivatives")
-    return df
-
-def build_nibabies_df(project, session):
-    """ Build a CSV File for Nibabies derivatives."""
-    print_starting_msg(project, session, "Processed Nibabies")
+def iter_derivatives_records(project, session, verify=False, checksums=False):
+    """Yield one derivatives record per participant found in any pipeline.
 
+    Only the participant folder names of each pipeline are held in memory. The
+    records are produced in study_id order, in chunks of ``CHUNK_SIZE``.
+    """
+    print_starting_msg(project, session, "Processed Nibabies, DWI, Precomputed and Recon-All")
     nibabies_path = get_paths(project, session)["nibabies"]
-    df = create_participant_df(nibabies_path)
+    pipeline_paths = _get_pipeline_paths(project, session)
+    # The settings and date of every subject's most recent run
+    latest_runs = get_latest_runs(build_run_index(project, session))
+    SI_df = None
     if project == "BABIES" and session == "newborn":
-        SI_df = build_SI_data_df(session)
-    
-    df["Anatomical"] = None
-    df["Surface-Recon-Method"] = None
-    df["Functional-Volume"] = None
-    df["Functional-Surface"] = None
-
-    for i, series in df.iterrows():
-        sub = series["study_id"]
-        assert sub.startswith("sub-")
-        sub_path = nibabies_path / sub
-        assert sub_path.exists()
+        SI_df = build_SI_data_df(session).set_index("study_id")
+
+    members = {"Nibabies": set(iter_participants(nibabies_path))}
+    for pipeline, path in pipeline_paths.items():
+        members[pipeline] = set(iter_participants(path))
+        if not members[pipeline]:
+            print(f"No participants found in {path}")
+    subjects = sorted(set().union(*members.values()))
+
+    for chunk in iter_chunks(subjects, CHUNK_SIZE):
+        problems = {}
+        if verify:
+            for pipeline, path in pipeline_paths.items():
+                sub_paths = [path / sub for sub in chunk if sub in members[pipeline]]
+                if sub_paths:
+                    problems[pipeline] = verify_outputs(sub_paths, pipeline, checksums=checksums)
+        for sub in chunk:
+            record = dict.fromkeys(DERIVATIVES_SCHEMA.names)
+            record["study_id"] = sub
+            if sub in members["Nibabies"]:
+                record.update(get_nibabies_record(nibabies_path, sub, session, latest_runs, SI_df))
+            for pipeline, path in pipeline_paths.items():
+                if sub not in members[pipeline]:
+                    continue
+                sub_path = path / sub
+                has_outputs = sub_path.exists() and any(sub_path.glob("*"))
+                if verify:
+                    has_outputs = has_outputs and problems[pipeline][sub] is None
+                record[pipeline] = has_outputs
+            yield record
+            print(".", end="", flush=True)
+
+
+def get_nibabies_record(nibabies_path, sub, session, latest_runs, SI_df=None):
+    """Check which NiBabies outputs exist for a single participant.
 
-        assert session in ["newborn", "sixmonth", "twelvemonth"]
-        ses_path = sub_path / f"ses-{session}"
-        
-        anat_path = ses_path / "anat"
-        func_path = ses_path / "func"
-        # Have to load the toml file from the log folder
-        # We use the most recent run to specify the surface recon method
-        log_path = ses_path / "log"
-        assert log_path.exists()
-        toml_data = load_nibabies_toml(log_path)
-
-        has_anat = anat_path.exists() and any(anat_path.glob("*"))
-        df.loc[i, f"Anatomical"] = has_anat
-
-        has_func = func_path.exists() and any(func_path.glob("*"))
-        has_volume = func_path.exists() and any(func_path.glob("*_boldref.nii.gz"))
-        has_cifti = func_path.exists() and any(func_path.glob("*k_bold.dtseries.nii*"))
-
-        # for BABIES newborn, check if subject in SI_data
-        if project == "BABIES" and session == "newborn":
-            exists_in_SI = sub in SI_df["study_id"].values
-            has_SI_volume = exists_in_SI and SI_df.loc[SI_df["study_id"] == sub, "Volume"].values[0]
-            has_SI_cifti = exists_in_SI and SI_df.loc[SI_df["study_id"] == sub, "Cifti"].values[0]
-            has_volume = has_volume or has_SI_volume
-            has_cifti = has_cifti or has_SI_cifti
-        df.loc[i, f"Functional-Volume"] = has_volume
-        df.loc[i, f"Functional-Surface"] = has_cifti
-
-        # Check for surface recon method
-        recon_method = toml_data["workflow"]["surface_recon_method"]
-        df.loc[i, f"Surface-Recon-Method"] = recon_method
-
-        # Extract the processing date
-        processing_date = extract_processing_datetime(log_path)
-        df.loc[i, "Date-Processed"] = processing_date
-        print(".", end="", flush=True)
-    # Save file
-    return df
+    Parameters
+    ----------
+    nibabies_path : pathlib.Path
+        The NiBabies derivatives directory.
+    sub : str
+        The participant folder name, e.g. "sub-1001".
+    session : str
+        The session to process (e.g., "newborn", "sixmonth", "twelvemonth").
+    latest_runs : pandas.DataFrame
+        The most recent run of each subject, from ``runs.get_latest_runs``.
+    SI_df : pandas.DataFrame | None
+        The BABIES newborn SI data, indexed by study_id (see ``build_SI_data_df``).
+    """
+    assert sub.startswith("sub-")
+    sub_path = nibabies_path / sub
+    assert sub_path.exists()
+
+    assert session in ["newborn", "sixmonth", "twelvemonth"]
+    ses_path = sub_path / f"ses-{session}"
+
+    anat_path = ses_path / "anat"
+    func_path = ses_path / "func"
+    # We use the most recent run to specify the surface recon method
+    log_path = ses_path / "log"
+    assert log_path.exists()
+    if sub not in latest_runs.index:
+        raise ValueError(f"No runs with a toml file found in {log_path}")
+    latest_run = latest_runs.loc[sub]
+
+    has_anat = anat_path.exists() and any(anat_path.glob("*"))
+    has_volume = func_path.exists() and any(func_path.glob("*_boldref.nii.gz"))
+    has_cifti = func_path.exists() and any(func_path.glob("*k_bold.dtseries.nii*"))
+
+    # for BABIES newborn, check if subject in SI_data
+    if SI_df is not None and sub in SI_df.index:
+        has_volume = has_volume or bool(SI_df.at[sub, "Volume"])
+        has_cifti = has_cifti or bool(SI_df.at[sub, "Cifti"])
+
+    return {"Anatomical": has_anat,
+            "Surface-Recon-Method": latest_run["surface_recon_method"],
+            "Functional-Volume": has_volume,
+            "Functional-Surface": has_cifti,
+            "Date-Processed": latest_run["timestamp"].date(),
+            }
 
 
 def build_SI_data_df(session):
     """Build a df File for BABIES SI data.
-    
+
     Parameters
     ----------
     session : str
         The session to process (e.g., "newborn", "sixmonth", "twelvemonth").
-    
+
     Notes
     -----
     For the BABIES study, Sanjana processed the newborn data with Nibabies
@@ -149,13 +234,9 @@ def build_SI_data_df(session):
     project_path =  get_paths("BABIES", session)["project"].parent
     si_path = project_path / "SI_data" / "derivatives"/ "nibabies_new"
     assert si_path.exists()
-    df = create_participant_df(si_path)
 
-    df[f"SI_data"] = None
-    df[f"Volume"] = None
-    df[f"Cifti"] = None
-    for i, series in df.iterrows():
-        sub = series["study_id"]
+    records = []
+    for sub in iter_participants(si_path):
         assert sub.startswith("sub-")
         sub_path = si_path / sub
         assert sub_path.exists()
@@ -163,92 +244,14 @@ def build_SI_data_df(session):
         assert session in ["newborn", "sixmonth", "twelvemonth"]
         func_path = sub_path / f"ses-{session}" / "func"
         has_SI_data = func_path.exists() and any(sub_path.glob("*"))
-        df.loc[i, f"SI_data"] = has_SI_data
         has_volume = func_path.exists() and any(func_path.glob("*_boldref.nii.gz"))
         has_cifti = func_path.exists() and any(func_path.glob("*k_bold.dtseries.nii*"))
-        df.loc[i, f"Volume"] = has_volume
-        df.loc[i, f"Cifti"] = has_cifti
-    return df
+        records.append({"study_id": sub,
+                        "SI_data": has_SI_data,
+                        "Volume": has_volume,
+                        "Cifti": has_cifti,
+                        })
+    return pd.DataFrame.from_records(records, columns=["study_id", "SI_data", "Volume", "Cifti"])
 
 def df_is_empty(df):
     return df.empty or (len(df) == 1 and not df["study_id"].item())
-
-def build_dwi_df(project, session):
-    """Build a CSV File for DWI derivatives."""
-    print_starting_msg(project, session, "Processed DWI")
-    dpath = get_paths(project, session)["derivatives"]
-    if project == "BABIES":
-        dwi_path = dpath / "Diffusion"
-    elif project == "ABC":
-        dwi_path = dpath / "diffusion"
-    df = create_participant_df(dwi_path)
-    df[f"DWI"] = None
-
-    if df.empty:
-        print(f"No participants found in {dwi_path}")
-        return df
-
-    for i, series in df.iterrows():
-        sub = series["study_id"]
-        assert sub.startswith("sub-")
-        sub_path = dwi_path / sub
-        assert sub_path.exists()
-
-        assert session in ["newborn", "sixmonth", "twelvemonth"]
-
-        has_dwi = sub_path.exists() and any(sub_path.glob("*"))
-        df.loc[i, f"DWI"] = has_dwi
-        print(".", end="", flush=True)
-    return df
-
-
-def build_precomputed_df(project, session):
-    """Build a CSV File for Precomputed derivatives."""
-    print_starting_msg(project, session, "Manualy edited Anatomical Segmentation")
-
-    precomputed_path = get_paths(project, session)["derivatives"] / "precomputed"
-    if not precomputed_path.exists():
-        print(f"No precomputed data found in {precomputed_path}")
-        return pd.DataFrame(columns=["study_id", "Precomputed"])
-    df = create_participant_df(precomputed_path)
-    df[f"Precomputed"] = None
-
-    if df.empty:
-        print(f"No participants found in {precomputed_path}")
-        return df
-
-    for i, series in df.iterrows():
-        sub = series["study_id"]
-        assert sub.startswith("sub-")
-        sub_path = precomputed_path / sub
-        assert sub_path.exists()
-        has_precomputed = sub_path.exists() and any(sub_path.glob("*"))
-        df.loc[i, f"Precomputed"] = has_precomputed
-        print(".", end="", flush=True)
-    return df
-
-
-def build_reconall_df(project, session):
-    """Build a CSV File for Recon-All derivatives."""
-    print_starting_msg(project, session, "Recon-All")
-
-    reconall_path = get_paths(project, session)["derivatives"] / "recon-all"
-    if not reconall_path.exists():
-        print(f"No recon-all data found in {reconall_path}")
-        return pd.DataFrame(columns=["study_id"])
-    df = create_participant_df(reconall_path)
-    df[f"Recon-all"] = None
-
-    if df.empty:
-        print(f"No participants found in {dwi_path}")
-        return df
-
-    for i, series in df.iterrows():
-        sub = series["study_id"]
-        assert sub.startswith("sub-")
-        sub_path = reconall_path / sub
-        assert sub_path.exists()
-        has_reconall = sub_path.exists() and any(sub_path.glob("*"))
-        df.loc[i, f"Recon-all"] = has_reconall
-        print(".", end="", flush=True)
-    return df
\ No newline at end of file
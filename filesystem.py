@@ -0,0 +1,216 @@
+import fnmatch
+import os
+import stat
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+from pathlib import PurePosixPath
+
+import fsspec
+from fsspec.implementations.local import LocalFileSystem
+
+# Seconds a directory listing (and the stat results in it) is reused
+CACHE_TTL = 60
+
+StatResult = namedtuple("StatResult", ["st_mode", "st_size", "st_mtime", "st_mtime_ns"])
+
+
+class ListingCache:
+    """Directory listings of one filesystem, kept for ``ttl`` seconds.
+
+    Stat results come from the listing of the parent folder, so probing every
+    entry of a folder costs a single request.
+    """
+
+    def __init__(self, fs, ttl=CACHE_TTL):
+        self.fs = fs
+        self.ttl = ttl
+        self._listings = {}
+
+    def clear(self):
+        self._listings.clear()
+
+    def listdir(self, path):
+        """Map the name of every entry in a folder to its fsspec info.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the folder does not exist.
+        """
+        now = time.monotonic()
+        cached = self._listings.get(path)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+        entries = {}
+        for info in self.fs.ls(path, detail=True):
+            name = PurePosixPath(info["name"].rstrip("/")).name
+            if name:
+                entries[name] = info
+        self._listings[path] = (now, entries)
+        return entries
+
+    def info(self, path):
+        """Get the fsspec info of a path, or None if it does not exist."""
+        parent, name = os.path.split(path.rstrip("/"))
+        if not name:
+            try:
+                return self.fs.info(path)
+            except FileNotFoundError:
+                return None
+        try:
+            return self.listdir(parent).get(name)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+
+@lru_cache
+def get_filesystem(url, ttl=CACHE_TTL):
+    """Open the filesystem of a URL, e.g. "file:///mnt/data", "sftp://host/data",
+    "tar:///path/to/dataset.tar" or "memory://data".
+
+    Returns
+    -------
+    fs : fsspec.AbstractFileSystem
+    root : str
+        The path of the URL within the filesystem.
+    cache : ListingCache
+    """
+    fs, root = fsspec.core.url_to_fs(url)
+    return fs, root, ListingCache(fs, ttl=ttl)
+
+
+def server_path(url, ttl=CACHE_TTL):
+    """Get the root folder of a URL as a ``ServerPath``."""
+    _, root, _ = get_filesystem(url, ttl)
+    return _get_path_class(url, ttl)(root or "/")
+
+
+@lru_cache
+def _get_path_class(url, ttl):
+    # The filesystem lives on the class, so paths derived with "/" or .parent keep it
+    return type("ServerPath", (ServerPath,), {"url": url, "ttl": ttl})
+
+
+def _rebuild(url, ttl, path):
+    return _get_path_class(url, ttl)(path)
+
+
+def _mtime(info):
+    mtime = info.get("mtime", info.get("created", 0))
+    if isinstance(mtime, datetime):
+        return mtime.timestamp()
+    return float(mtime or 0)
+
+
+class ServerPath(PurePosixPath):
+    """A read-only ``pathlib.Path`` look-alike for the files on any fsspec filesystem.
+
+    Listings and stat results go through the filesystem's ``ListingCache``. Use
+    ``server_path`` to get the root folder of a URL.
+    """
+    url = None
+    ttl = CACHE_TTL
+
+    def __reduce__(self):
+        return _rebuild, (self.url, self.ttl, str(self))
+
+    def __fspath__(self):
+        # Only local paths can be handed to open(), pandas, etc. directly
+        if self.is_local:
+            return str(self)
+        raise TypeError(f"{self.url} is not a local filesystem, use {type(self).__name__}.open()")
+
+    @property
+    def fs(self):
+        return get_filesystem(self.url, self.ttl)[0]
+
+    @property
+    def cache(self):
+        return get_filesystem(self.url, self.ttl)[2]
+
+    @property
+    def is_local(self):
+        return isinstance(self.fs, LocalFileSystem)
+
+    @property
+    def _fs_path(self):
+        path = str(self)
+        return "" if path == "." else path
+
+    def _info(self):
+        return self.cache.info(self._fs_path)
+
+    def exists(self):
+        return self._info() is not None
+
+    def is_dir(self):
+        info = self._info()
+        return info is not None and info["type"] == "directory"
+
+    def is_file(self):
+        info = self._info()
+        return info is not None and info["type"] == "file"
+
+    def stat(self):
+        info = self._info()
+        if info is None:
+            raise FileNotFoundError(str(self))
+        mtime = _mtime(info)
+        mode = stat.S_IFDIR if info["type"] == "directory" else stat.S_IFREG
+        return StatResult(mode, info.get("size") or 0, mtime, int(mtime * 1e9))
+
+    def iterdir(self):
+        for name in self.cache.listdir(self._fs_path):
+            yield self / name
+
+    def glob(self, pattern):
+        """Yield the paths matching a relative glob pattern; "**" matches any number of folders."""
+        parts = pattern.split("/")
+        dirs_only = parts[-1] == ""
+        if dirs_only:
+            parts = parts[:-1]
+        for path in self._glob(parts):
+            if not dirs_only or path.is_dir():
+                yield path
+
+    def _glob(self, parts):
+        part, rest = parts[0], parts[1:]
+        if part == "**":
+            yield from (self._glob(rest) if rest else [self])
+            for child in self._iter_subdirs():
+                yield from child._glob(parts)
+            return
+        try:
+            names = self.cache.listdir(self._fs_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for name in sorted(fnmatch.filter(names, part)):
+            child = self / name
+            if not rest:
+                yield child
+            elif names[name]["type"] == "directory":
+                yield from child._glob(rest)
+
+    def _iter_subdirs(self):
+        try:
+            names = self.cache.listdir(self._fs_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for name, info in sorted(names.items()):
+            if info["type"] == "directory":
+                yield self / name
+
+    def rglob(self, pattern):
+        return self.glob(f"**/{pattern}")
+
+    def open(self, mode="rb", **kwargs):
+        return self.fs.open(self._fs_path, mode, **kwargs)
+
+    def read_bytes(self):
+        with self.open("rb") as fobj:
+            return fobj.read()
+
+    def read_text(self, encoding="utf-8"):
+        return self.read_bytes().decode(encoding)
@@ -0,0 +1,179 @@
+import os
+import uuid
+from datetime import date
+
+import duckdb
+import pandas as pd
+
+import paths as p
+
+AGGREGATE_FNAME = p.HISTORY_DIR / "_aggregates" / "run_counts.parquet"
+AGGREGATE_DTYPES = {"project": "object",
+                    "session": "object",
+                    "run_date": "datetime64[us]",
+                    "stage": "object",
+                    "scan": "object",
+                    "count": "int64",
+                    "source": "object",
+                    "mtime": "int64",
+                    }
+AGGREGATE_COLUMNS = list(AGGREGATE_DTYPES)
+# Which processed column tells us that an acquired scan has been processed
+BACKLOG_SCANS = {"Anatomical": "Anatomical",
+                 "Functional": "Functional-Volume",
+                 "DWI": "DWI",
+                 }
+
+
+def _get_partition_path(project, session, stage, run_date=None):
+    run_date = run_date or date.today()
+    out_dir = (p.HISTORY_DIR
+               / f"project={project}"
+               / f"session={session}"
+               / f"run_date={run_date.isoformat()}"
+               )
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return out_dir / f"{stage}.parquet"
+
+
+def _get_tmp_path(out_path):
+    """A temporary path next to ``out_path`` that no other writer (process) uses."""
+    return out_path.with_name(f"{out_path.name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _write_partition(relation, out_path):
+    tmp_path = _get_tmp_path(out_path)
+    relation.write_parquet(str(tmp_path))
+    tmp_path.replace(out_path)
+
+
+def append_snapshot_file(fname, project, session, stage, run_date=None):
+    """Append one tracking run, saved as a CSV file, to the history store.
+
+    The file is converted by DuckDB without loading it into pandas.
+
+    Parameters
+    ----------
+    fname : pathlib.Path
+        The per-subject tracking table written by ``count_outputs``.
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    session : str
+        The session (e.g., "newborn", "sixmonth", "twelvemonth").
+    stage : str
+        The tracking stage (e.g., "acquisition", "derivatives").
+    run_date : datetime.date | None
+        The date of the run. Defaults to today. Re-running on the same day
+        replaces that day's partition.
+
+    The partition is not counted until ``update_aggregate`` runs. Every session
+    shares the aggregate, so it is updated once after the crawls rather than by
+    each of them.
+    """
+    out_path = _get_partition_path(project, session, stage, run_date=run_date)
+    _write_partition(duckdb.read_csv(str(fname)), out_path)
+
+
+def _count_partition(fpath):
+    """Count the subjects with a True value in each column of one history file."""
+    partition = dict(part.split("=", 1) for part in fpath.relative_to(p.HISTORY_DIR).parts[:-1])
+    df = duckdb.read_parquet(str(fpath)).df()
+    counts = (df.drop(columns="study_id")
+                .select_dtypes(include="bool")
+                .sum()
+                .rename_axis("scan")
+                .reset_index(name="count")
+                )
+    counts["project"] = partition["project"]
+    counts["session"] = partition["session"]
+    counts["run_date"] = pd.Timestamp(partition["run_date"])
+    counts = counts.astype({"run_date": AGGREGATE_DTYPES["run_date"]})
+    counts["stage"] = fpath.stem
+    counts["source"] = str(fpath.relative_to(p.HISTORY_DIR))
+    counts["mtime"] = fpath.stat().st_mtime_ns
+    return counts[AGGREGATE_COLUMNS]
+
+
+def load_aggregate(fname=AGGREGATE_FNAME):
+    """Load the per-run counts aggregated so far (or those saved in a snapshot)."""
+    if not fname.exists():
+        return pd.DataFrame(columns=AGGREGATE_COLUMNS).astype(AGGREGATE_DTYPES)
+    return duckdb.read_parquet(str(fname)).df()
+
+
+def update_aggregate():
+    """Fold history files that are new (or were rewritten) into the per-run counts.
+
+    Only those files are read, so the cost is proportional to the number of new
+    runs rather than to the size of the history.
+    """
+    aggregate = load_aggregate()
+    seen = dict(zip(aggregate["source"], aggregate["mtime"]))
+    new_counts = []
+    for fpath in sorted(p.HISTORY_DIR.glob("project=*/session=*/run_date=*/*.parquet")):
+        source = str(fpath.relative_to(p.HISTORY_DIR))
+        if seen.get(source) == fpath.stat().st_mtime_ns:
+            continue
+        new_counts.append(_count_partition(fpath))
+    if not new_counts:
+        return aggregate
+    new_counts = pd.concat(new_counts, ignore_index=True)
+    aggregate = aggregate[~aggregate["source"].isin(new_counts["source"])]
+    aggregate = pd.concat([aggregate, new_counts], ignore_index=True) if len(aggregate) else new_counts
+    AGGREGATE_FNAME.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _get_tmp_path(AGGREGATE_FNAME)
+    duckdb.from_df(aggregate).write_parquet(str(tmp_path))
+    tmp_path.replace(AGGREGATE_FNAME)
+    return aggregate
+
+
+def get_weekly_counts(project, aggregate=None):
+    """Get the counts of each scan at the last run of every week."""
+    aggregate = load_aggregate() if aggregate is None else aggregate
+    return duckdb.sql(
+        """
+        SELECT session, stage, scan,
+               date_trunc('week', run_date) AS week,
+               arg_max(count, run_date) AS count
+        FROM aggregate
+        WHERE project = $project
+        GROUP BY ALL
+        ORDER BY session, stage, scan, week
+        """,
+        params={"project": project},
+    ).df()
+
+
+def get_throughput(project, aggregate=None):
+    """Get how many scans were processed during each week."""
+    weekly = get_weekly_counts(project, aggregate=aggregate)
+    return duckdb.sql(
+        """
+        SELECT session, scan, week,
+               count - lag(count, 1, 0) OVER (PARTITION BY session, scan ORDER BY week) AS processed
+        FROM weekly
+        WHERE stage = 'derivatives'
+        ORDER BY session, scan, week
+        """
+    ).df()
+
+
+def get_backlog(project, aggregate=None):
+    """Get how many acquired scans were waiting to be processed at the end of each week."""
+    weekly = get_weekly_counts(project, aggregate=aggregate)
+    pairs = pd.DataFrame(list(BACKLOG_SCANS.items()), columns=["scan", "processed_scan"])
+    return duckdb.sql(
+        """
+        SELECT acq.session, acq.scan, acq.week,
+               acq.count - coalesce(proc.count, 0) AS backlog
+        FROM weekly AS acq
+        JOIN pairs USING (scan)
+        LEFT JOIN weekly AS proc
+          ON proc.stage = 'derivatives'
+         AND proc.session = acq.session
+         AND proc.week = acq.week
+         AND proc.scan = pairs.processed_scan
+        WHERE acq.stage = 'acquisition'
+        ORDER BY acq.session, acq.scan, acq.week
+        """
+    ).df()
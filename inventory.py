@@ -0,0 +1,134 @@
+import argparse
+import sqlite3
+from contextlib import closing
+from itertools import chain
+
+import pandas as pd
+
+from paths import get_csv_paths, get_paths
+from runs import build_run_index
+from utils import get_participant_list, print_starting_msg
+
+COLUMNS = ["study_id", "session", "category", "name", "detail", "date"]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    study_id TEXT NOT NULL,
+    session TEXT NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    detail TEXT,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS inventory_study_id ON inventory (study_id, session);
+"""
+
+
+def iter_bids_files(project, session):
+    """Yield one inventory row per file in each subject's BIDS session folder."""
+    bpath = get_paths(project, session)["bids"]
+    for sub in get_participant_list(bpath):
+        ses_path = bpath / sub / f"ses-{session}"
+        for fpath in sorted(ses_path.rglob("*")):
+            if fpath.is_file():
+                yield (sub, session, "BIDS", str(fpath.relative_to(ses_path)), None, None)
+
+
+def iter_nibabies_runs(project, session):
+    """Yield one inventory row per NiBabies run, with its date and recon method."""
+    run_index = build_run_index(project, session).reset_index()
+    for row in run_index.itertuples():
+        yield (row.subject, session, "NiBabies run", row.run, row.surface_recon_method,
+               row.timestamp.date().isoformat())
+
+
+def iter_derivative_folders(project, session):
+    """Yield one inventory row per subject folder in each derivatives pipeline."""
+    dpath = get_paths(project, session)["derivatives"]
+    if not dpath.exists():
+        return
+    for pipeline in sorted(d for d in dpath.iterdir() if d.is_dir()):
+        for sub_path in sorted(pipeline.glob("sub-*")):
+            if not sub_path.is_dir():
+                continue
+            n_entries = sum(1 for _ in sub_path.iterdir())
+            yield (sub_path.name, session, "Derivative", pipeline.name, f"{n_entries} entries", None)
+
+
+def connect(project, read_only=False):
+    """Open the inventory store for a project."""
+    db_path = get_csv_paths(project)["inventory"]
+    if read_only:
+        return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA journal_mode=WAL")  # Let the dashboard read while we write
+    con.executescript(SCHEMA)
+    return con
+
+
+def build_inventory(project, session):
+    """Crawl the file-level inventory of every subject and store it by study_id."""
+    print_starting_msg(project, session, "file-level inventory")
+    # Crawl before opening the transaction, so the write lock is only held for the
+    # insert and not for the (possibly remote) crawl
+    rows = list(chain(iter_bids_files(project, session),
+                      iter_nibabies_runs(project, session),
+                      iter_derivative_folders(project, session),
+                      ))
+    with closing(connect(project)) as con, con:
+        # Replace this session's rows in a single transaction
+        con.execute("DELETE FROM inventory WHERE session = ?", (session,))
+        con.executemany(f"INSERT INTO inventory VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    print(f"Saved inventory to {get_csv_paths(project)['inventory']}")
+
+
+def get_subject_inventory(project, study_id, session=None):
+    """Look up the file-level inventory of a single subject.
+
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    study_id : str
+        The subject ID, including the "sub-" prefix.
+    session : str | None
+        The session to restrict the lookup to. If None, all sessions are returned.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per inventory item, with columns ``COLUMNS``.
+    """
+    if not get_csv_paths(project)["inventory"].exists():
+        return pd.DataFrame(columns=COLUMNS)
+    query = "SELECT * FROM inventory WHERE study_id = ?"
+    params = [study_id]
+    if session is not None:
+        query += " AND session = ?"
+        params.append(session)
+    query += " ORDER BY session, category, name"
+    with closing(connect(project, read_only=True)) as con:
+        return pd.read_sql_query(query, con, params=params)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the per-subject file inventory.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--session",
+                        type=str,
+                        required=True,
+                        choices=["newborn", "sixmonth", "twelvemonth"],
+                        dest="session",
+                        help="Visit. Must be 'newborn', 'sixmonth', or 'twelvemonth'.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_inventory(args.project, args.session)
+    print("✅ Done!")
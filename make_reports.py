@@ -1,37 +1,31 @@
 import argparse
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")  # Render headless, also in worker processes
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+from cube import get_count, get_values, load_cube, update_cube
+
 sns.set_theme(style="darkgrid")
 
 
-def count_scans(df, project):
+def count_scans(cube, project):
     # Grouped bar chart of Scan counts, X axis Scan type, Hue by visit,
-    drop_these_cols = ["T1w", "T2w", "Status", "Reason Not-Acquired"]
-    visits = ["Newborn", "Six Months"]
-    # ABC
-    if project == "ABC":
-        visits.append("Twelve Months")
-    to_drop = [("Acquired", visit, scan) for visit in visits for scan in drop_these_cols]
-    data = df.drop(columns=to_drop)
-    data = data.drop(columns=[("Processed")])
-    data = data.drop(columns=[("Acquired", "Newborn", "Biological Sex")])
-    with pd.option_context("future.no_silent_downcasting", True):
-        data = data.replace("Not Acquired", False)
-        data = data.replace("Acquired", True)
-    data = data.T
-    data = (data.groupby(by=["Visit", "Scan"]) # changed from level=[0, 1, 2]
-                .sum()
-                .sum(axis=1)
-                .to_frame(name="Count")
-                )
-    return data
-
-def count_all_scans(df, project, save=True):
-    scan_counts = count_scans(df, project)
-    proc_counts = count_processed_scans(df, project)
+    drop_these_cols = ["T1w", "T2w"]
+    return _count_modalities(cube, project, "Acquired", drop_these_cols)
+
+def count_all_scans(cube, project, save=True):
+    scan_counts = count_scans(cube, project)
+    proc_counts = count_processed_scans(cube, project)
     scan_counts.name = "Acquired"
     proc_counts.name = "Processed"
     all_counts = pd.concat([scan_counts, proc_counts], keys=["Acquired", "Processed"], axis=1)
@@ -48,66 +42,45 @@ def count_all_scans(df, project, save=True):
         want_indices_twelvemonth = [("Twelve Months", scan) for scan in ["Functional-Volume", "Functional-Surface"]]
         functional_counts_twelvemonth = all_counts.loc[want_indices_twelvemonth, want_cols].sum()
         all_counts.at[("Twelve Months", "Functional"), "Processed"] = functional_counts_twelvemonth
+    # Acquired has no Functional-Volume/-Surface rows, so the counts are floats until
+    # they are cast back (with those cells left blank)
+    all_counts = all_counts.astype("Int64")
     if save:
         all_counts.to_csv(f"./reports/{project}_all_scan_counts.csv")
     return all_counts
 
 
-def count_processed_scans(df, project):
-    drop_these_cols = ["Surface-Recon-Method", "Date-Processed", "Precomputed", "Recon-all"]
-    visits = ["Newborn", "Six Months"]
-    # ABC
-    if project == "ABC":
-        visits.append("Twelve Months")
-    to_drop = [("Processed", visit, col)
-               for visit in visits
-               for col in drop_these_cols
-               ]
-    data = df.drop(columns=to_drop)
-    data = data.drop(columns=[("Acquired")])
-    with pd.option_context("future.no_silent_downcasting", True):
-        data = data.replace("Not Processed", False)
-        data = data.replace("N/A", False)
-        data = data.replace("Processed", True)
-
-    data = (data.T
-                .groupby(by=["Visit", "Scan"])
-                .sum()
-                .sum(axis=1)
-                .to_frame(name="Count")
-              )
-    # data = data.to_frame().stack().reset_index().rename(columns={0: "Value"})
-    return data
-
-def count_surface_recons(df, project):
+def count_processed_scans(cube, project):
+    drop_these_cols = ["Precomputed", "Recon-all"]
+    return _count_modalities(cube, project, "Processed", drop_these_cols)
+
+
+def _count_modalities(cube, project, stage, drop_these_cols):
+    """Count the done scans of every (Visit, Scan) of a stage, from the cube."""
+    counts = {(visit, modality): get_count(cube, project=project, visit=visit, stage=stage,
+                                           modality=modality, status=stage)
+              for visit in get_values(cube, "visit", project=project, stage=stage)
+              for modality in get_values(cube, "modality", project=project, visit=visit, stage=stage)
+              if modality not in drop_these_cols
+              }
+    index = pd.MultiIndex.from_tuples(counts, names=["Visit", "Scan"])
+    return pd.DataFrame({"Count": list(counts.values())}, index=index)
+
+def count_surface_recons(cube, project):
     visits = ["Newborn", "Six Months"]
     # ABC
     if project == "ABC":
         visits.append("Twelve Months")
-    want_cols = [("Processed", age, "Surface-Recon-Method") for age in visits]
-    data = df.copy()[want_cols]
-    with pd.option_context("future.no_silent_downcasting", True):
-        data = data.replace("N/A", False)
-        data = data.replace("Not Processed", False)
-        # Now, how many values of "infantfs" do we have for each age?
-        infantfs = data.T.groupby(by=["Visit", "Scan"]).apply(lambda x: x[x == "infantfs"].count()).sum(axis=1)
-        infantfs.name = "infantfs"
-        # rename index to "infantfs"
-        infantfs.index.names = ["Visit", "Surface-Recon-Method"]
-        # drop index level "Surface-Recon-Method"
-        infantfs = infantfs.droplevel(1)
-
-        mcribs = data.T.groupby(by=["Visit", "Scan"]).apply(lambda x: x[x == "mcribs"].count()).sum(axis=1)
-        mcribs.name = "mcribs"
-        mcribs.index.names = ["Visit", "Surface-Recon-Method"]
-        mcribs = mcribs.droplevel(1)
-
-        counts_df = pd.concat([infantfs, mcribs], axis=1)
-        return counts_df
-
-    data = data.T.groupby(level=[0, 1]).sum().sum(axis=1).to_frame(name="Count")
-
-def custom_barchart_mpl(df, project, save=True):
+    # Every subject has one Processed Anatomical scan per visit, whatever its status
+    counts_df = pd.DataFrame({method: [get_count(cube, project=project, visit=visit, stage="Processed",
+                                                 modality="Anatomical", recon_method=method)
+                                       for visit in visits]
+                              for method in ["infantfs", "mcribs"]},
+                             index=pd.Index(visits, name="Visit"),
+                             )
+    return counts_df
+
+def custom_barchart_mpl(cube, project, save=True, fname=None):
     import numpy as np
     from matplotlib.colors import ListedColormap
     from matplotlib.patches import Patch
@@ -119,9 +92,9 @@ def custom_barchart_mpl(df, project, save=True):
     fig, ax = plt.subplots(constrained_layout=True, figsize=(12, 6), dpi=300)
 
     # Get all the counts
-    surface_recon_counts = count_surface_recons(df, project=project)
-    data_acq = count_scans(df, project=project)
-    data_proc = count_processed_scans(df, project=project)
+    surface_recon_counts = count_surface_recons(cube, project=project)
+    data_acq = count_scans(cube, project=project)
+    data_proc = count_processed_scans(cube, project=project)
     n_newborn_anat = data_acq.loc[("Newborn", "Anatomical")].item()
     n_newborn_dwi = data_acq.loc[("Newborn", "DWI")].item()
     n_newborn_func = data_acq.loc[("Newborn", "Functional")].item()
@@ -233,8 +206,65 @@ def custom_barchart_mpl(df, project, save=True):
     ax.legend(handles=handles, loc="upper right", title="Legend", ncols=ncols)
 
     if save:
-        fig.savefig(f"./reports/{project}_scan_counts.png")
-    return fig.show()
+        fname = fname or f"./reports/{project}_scan_counts.png"
+        fig.savefig(fname)
+    return fig
+
+
+def get_counts_hash(cube, project):
+    """Hash the aggregated counts that the bar chart is drawn from."""
+    digest = hashlib.sha1(project.encode())
+    for counts in [count_all_scans(cube, project, save=False), count_surface_recons(cube, project)]:
+        digest.update(counts.to_csv().encode())
+    return digest.hexdigest()[:16]
+
+
+def _render(project, fname):
+    # Render next to the cached chart first, so that a worker that dies mid-write
+    # never leaves a truncated chart in the cache
+    fig = custom_barchart_mpl(load_cube(), project=project, save=False)
+    tmp_fname = fname.with_name(fname.name + ".partial")
+    fig.savefig(tmp_fname, format=fname.suffix.lstrip("."))
+    plt.close(fig)
+    os.replace(tmp_fname, fname)
+    return fname
+
+
+def render_reports(projects, formats=("png", "svg")):
+    """Render the scan count bar chart of each project, in each format.
+
+    Charts are cached by a hash of the counts they show, so a chart is only
+    re-rendered when its counts changed. Missing charts are rendered in parallel,
+    and the cache only keeps the charts of the current counts.
+
+    Parameters
+    ----------
+    projects : list of str
+        The projects to render (e.g., ["ABC", "BABIES"]).
+    formats : list of str
+        The image formats to save (e.g., ["png", "svg"]).
+    """
+    cache_dir = Path("./reports") / ".render_cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cube = load_cube()
+    cached = {}
+    for project in projects:
+        counts_hash = get_counts_hash(cube, project)
+        for fmt in formats:
+            cached[(project, fmt)] = cache_dir / f"{project}_{counts_hash}.{fmt}"
+    to_render = {key: fname for key, fname in cached.items() if not fname.exists()}
+    if to_render:
+        with ProcessPoolExecutor() as executor:
+            futures = [executor.submit(_render, project, fname) for (project, _), fname in to_render.items()]
+            for future in futures:
+                future.result()
+    for (project, fmt), fname in cached.items():
+        shutil.copyfile(fname, Path("./reports") / f"{project}_scan_counts.{fmt}")
+    for project in projects:
+        for fname in cache_dir.glob(f"{project}_*"):
+            if fname not in cached.values():
+                fname.unlink()
+    print(f"Rendered {len(to_render)} charts ({len(cached) - len(to_render)} unchanged)")
 
 
 def parse_args():
@@ -243,9 +273,19 @@ def parse_args():
         "--project",
         type=str,
         required=True,
+        nargs="+",
         choices=["ABC", "BABIES"],
         dest="project",
-        help="Project name. Must be 'ABC' or 'BABIES'.",
+        help="Project name(s). Must be 'ABC' and/or 'BABIES'.",
+    )
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        default=["png", "svg"],
+        choices=["png", "svg"],
+        dest="formats",
+        help="Image formats of the bar chart.",
     )
     parser.add_argument(
         "--save",
@@ -264,10 +304,19 @@ def parse_args():
 
 if __name__ == "__main__":
     args = parse_args()
-    project = args.project
+    projects = args.project
     save = args.save
     save_counts = vars(args).get("save_counts", False)
-    df = pd.read_csv(f"./reports/{project}_final.csv", header=[0, 1, 2], index_col=0, keep_default_na=False)
-    custom_barchart_mpl(df, project=project, save=save)
+    # pipeline imports this module, so it is only imported here
+    from pipeline import pipeline_lock
+
+    # Only the subjects that changed since the cube was last updated are counted again.
+    # The pipeline updates the cube too, so not while it runs.
+    with pipeline_lock():
+        for project in projects:
+            update_cube(project)
+    if save:
+        render_reports(projects, formats=args.formats)
     if save_counts:
-        count_all_scans(df, project=project, save=True)
\ No newline at end of file
+        for project in projects:
+            count_all_scans(load_cube(), project=project, save=True)
\ No newline at end of file
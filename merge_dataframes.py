@@ -1,4 +1,5 @@
 import argparse
+from pathlib import Path
 from warnings import warn
 
 import numpy as np
@@ -6,6 +7,7 @@ import pandas as pd
 
 from paths import get_csv_paths
 from redcap import get_redcap_df
+from utils import get_changed_ids
 
 SCANS = ["Anatomical", "T1w", "T2w", "Functional", "DWI"]
 PROCESSED = ["Anatomical", "Functional-Volume", "Functional-Surface", "DWI", "Precomputed", "Recon-all"]
@@ -234,7 +236,19 @@ def refine_the_dataframe(df_babies, project):
     # 3. If the scan is acquired, set the corresponding processed columns to "Processed" if they are True
     return df_babies
 
-def build_dataframe(project):
+def build_dataframe(project, full=False):
+    """Merge the acquisition, derivatives and REDCap data into the final dataframe.
+
+    Only subjects whose inputs changed since the last merge are refined again;
+    their rows are spliced into the previous final dataframe.
+
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    full : bool
+        Whether to refine every subject, ignoring the previous merge.
+    """
     idx_col = "study_id"
     csvs = get_csv_paths(project)
     df_newborn = pd.read_csv(csvs["acquisition_newborn"], index_col=idx_col)
@@ -247,6 +261,11 @@ def build_dataframe(project):
         derivatives_twelvemonth = pd.read_csv(csvs["derivatives_twelvemonth"], index_col=idx_col)
         if "Recon-all" not in derivatives_twelvemonth.columns:
             derivatives_twelvemonth["Recon-all"] = False
+    # Acquisition dates are only used to schedule processing (see backlog.py)
+    df_newborn = df_newborn.drop(columns="Date-Acquired", errors="ignore")
+    df_sixmonth = df_sixmonth.drop(columns="Date-Acquired", errors="ignore")
+    if project == "ABC":
+        df_twelvemonth = df_twelvemonth.drop(columns="Date-Acquired", errors="ignore")
     # Now merge redcap df with newborn df
     df_newborn = df_newborn.merge(df_redcap, left_index=True, right_index=True, how="outer")
     df_sixmonth = df_sixmonth.merge(df_redcap, left_index=True, right_index=True, how="outer")
@@ -299,22 +318,52 @@ def build_dataframe(project):
     )
     with pd.option_context("future.no_silent_downcasting", True):
         df_babies = df_babies.fillna(False)
-    # Make the dataframe more readable
-    df_babies = refine_the_dataframe(df_babies, project=project)
+    # Make the dataframe more readable, for the subjects whose inputs changed
+    final_fname = Path(f"./reports/{project}_final.csv")
+    hashes_fname = Path(f"./reports/.merge_state/{project}_input_hashes.csv")
+    input_hashes = get_input_hashes(df_babies)
+    previous_hashes = None
+    if not full and final_fname.exists() and hashes_fname.exists():
+        previous_hashes = pd.read_csv(hashes_fname, index_col=idx_col, dtype={"hash": "uint64"})["hash"]
+        changed, removed = get_changed_ids(input_hashes, previous_hashes)
+        if changed.empty and removed.empty:
+            print(f"No {project} subjects changed since the last merge")
+            return
+    else:
+        changed = input_hashes.index
+    df_changed = refine_the_dataframe(df_babies.loc[changed], project=project)
     # assert that there are no np.nans in the dataframe
-    if df_babies.isnull().values.any():
+    if df_changed.isnull().values.any():
         # Where are the np.nans?
-        n_nans = df_babies.isnull().sum()
+        n_nans = df_changed.isnull().sum()
         warn(f"There are {n_nans} np.nans in the dataframe. Please check the dataframe.")
     # check if any False values are present in the dataframe
-    if df_babies.isin([False]).values.any():
+    if df_changed.isin([False]).values.any():
         # How many False values are there?
-        n_false = df_babies.isin([False]).sum()
+        n_false = df_changed.isin([False]).sum()
         warn(f"There are False values in the dataframe. Please check the dataframe.")
 
+    df_babies = df_changed
+    if previous_hashes is not None:
+        df_previous = pd.read_csv(final_fname, header=[0, 1, 2], index_col=0, keep_default_na=False)
+        if df_previous.columns.equals(df_changed.columns):
+            print(f"Re-merged {len(changed)} changed {project} subjects")
+            unchanged = input_hashes.index.difference(changed)
+            df_babies = pd.concat([df_previous.loc[unchanged], df_changed]).loc[input_hashes.index]
+        else:
+            # The columns changed, so every subject has to be refined again
+            return build_dataframe(project, full=True)
+
     # Save
     # Save DataFrames to csv
-    df_babies.to_csv(f"./reports/{project}_final.csv")
+    df_babies.to_csv(final_fname)
+    hashes_fname.parent.mkdir(parents=True, exist_ok=True)
+    input_hashes.to_csv(hashes_fname, header=["hash"])
+
+
+def get_input_hashes(df_babies):
+    """Hash the merged (unrefined) inputs of each subject."""
+    return pd.util.hash_pandas_object(df_babies, index=True)
 
 
 def parse_args():
@@ -326,6 +375,11 @@ def parse_args():
                         dest="project",
                         help="Project name. Must be 'ABC' or 'BABIES'.",
                         )
+    parser.add_argument("--full",
+                        action="store_true",
+                        dest="full",
+                        help="Refine every subject, instead of only those whose inputs changed.",
+                        )
     args = parser.parse_args()
     return args
 
@@ -333,4 +387,4 @@ if __name__ == "__main__":
     # Parse command line arguments
     args = parse_args()
     project = args.project
-    build_dataframe(project)
+    build_dataframe(project, full=args.full)
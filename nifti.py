@@ -0,0 +1,164 @@
+import argparse
+import gzip
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import paths as p
+from utils import iter_participants, print_starting_msg
+
+N_JOBS = 16
+# Runs shorter than this many volumes are flagged
+MIN_BOLD_VOLUMES = 100
+# header size: (dim offset, dim format, pixdim offset, pixdim format, bitpix offset,
+#               vox_offset offset, vox_offset format)
+# from the NIfTI-1 and NIfTI-2 header layouts
+HEADER_LAYOUTS = {348: (40, "8h", 76, "8f", 72, 108, "f"),
+                  540: (16, "8q", 104, "8d", 14, 168, "q"),
+                  }
+IMAGES = {"bold": "func", "dwi": "dwi"}
+COLUMNS = ["study_id", "suffix", "fname", "shape", "n_volumes", "voxel_size", "tr", "problem"]
+
+
+def _read_start(fpath, size):
+    with fpath.open("rb") as fobj:
+        # gzip only decompresses as much of the stream as is read
+        if fpath.name.endswith(".gz"):
+            with gzip.GzipFile(fileobj=fobj) as gz:
+                return gz.read(size)
+        return fobj.read(size)
+
+
+def read_header(fpath):
+    """Read the dimensions and voxel sizes from the header of a NIfTI-1 or NIfTI-2 image.
+
+    Only the first 348 (NIfTI-1) or 540 (NIfTI-2) bytes are read, so the image
+    data is never transferred or decompressed.
+
+    Returns
+    -------
+    dict
+        The ``shape``, ``n_volumes``, ``voxel_size``, ``tr`` (pixdim[4]) and,
+        for uncompressed images, whether the file is ``truncated``.
+
+    Raises
+    ------
+    ValueError
+        If the file is too short or is not a NIfTI image.
+    """
+    header = _read_start(fpath, 540)
+    if len(header) < 348:
+        raise ValueError(f"{fpath.name} is too short for a NIfTI header")
+    for endian in "<>":
+        sizeof_hdr = struct.unpack_from(f"{endian}i", header)[0]
+        if sizeof_hdr in HEADER_LAYOUTS:
+            break
+    else:
+        raise ValueError(f"{fpath.name} is not a NIfTI image")
+    if len(header) < sizeof_hdr:
+        raise ValueError(f"{fpath.name} is too short for a NIfTI header")
+    dim_at, dim_fmt, pixdim_at, pixdim_fmt, bitpix_at, vox_offset_at, vox_offset_fmt = HEADER_LAYOUTS[sizeof_hdr]
+    dim = struct.unpack_from(endian + dim_fmt, header, dim_at)
+    pixdim = struct.unpack_from(endian + pixdim_fmt, header, pixdim_at)
+    ndim = dim[0]
+    shape = tuple(int(size) for size in dim[1:ndim + 1])
+    info = {"shape": shape,
+            "n_volumes": shape[3] if ndim >= 4 else 1,
+            "voxel_size": tuple(round(float(size), 4) for size in pixdim[1:4]),
+            "tr": float(pixdim[4]) if ndim >= 4 else None,
+            "truncated": None,
+            }
+    if not fpath.name.endswith(".gz"):
+        bitpix = struct.unpack_from(f"{endian}h", header, bitpix_at)[0]
+        vox_offset = struct.unpack_from(endian + vox_offset_fmt, header, vox_offset_at)[0]
+        n_voxels = 1
+        for size in shape:
+            n_voxels *= size
+        info["truncated"] = fpath.stat().st_size < int(vox_offset) + n_voxels * bitpix // 8
+    return info
+
+
+def _count_bvals(fpath):
+    """Count the diffusion directions in the .bval file next to a DWI image, if there is one."""
+    bval = fpath.with_name(fpath.name.split(".")[0] + ".bval")
+    if not bval.exists():
+        return None
+    return len(bval.read_text().split())
+
+
+def inspect_image(study_id, suffix, fpath):
+    """Read the header of one BIDS image and check it against what is expected."""
+    record = dict.fromkeys(COLUMNS)
+    record.update(study_id=study_id, suffix=suffix, fname=fpath.name)
+    try:
+        info = read_header(fpath)
+    except (OSError, EOFError, ValueError) as error:
+        record["problem"] = str(error)
+        return record
+    record.update({key: info[key] for key in ["shape", "n_volumes", "voxel_size", "tr"]})
+    if info["truncated"]:
+        record["problem"] = "image data is truncated"
+    elif suffix == "bold" and info["n_volumes"] < MIN_BOLD_VOLUMES:
+        record["problem"] = f"only {info['n_volumes']} volumes (< {MIN_BOLD_VOLUMES})"
+    elif suffix == "dwi":
+        n_bvals = _count_bvals(fpath)
+        if n_bvals is not None and info["n_volumes"] < n_bvals:
+            record["problem"] = f"{info['n_volumes']} of {n_bvals} diffusion volumes"
+    return record
+
+
+def iter_images(project, session):
+    """Yield the (study_id, suffix, path) of every BOLD and DWI image in the BIDS directory."""
+    bpath = p.get_paths(project, session)["bids"]
+    for sub in sorted(iter_participants(bpath)):
+        for suffix, datatype in IMAGES.items():
+            for fpath in sorted((bpath / sub / f"ses-{session}" / datatype).glob(f"*_{suffix}.nii*")):
+                yield sub, suffix, fpath
+
+
+def build_acquisition_details(project, session):
+    """Read the header of every BOLD and DWI image of a session and flag incomplete scans.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per image, with its shape, number of volumes, voxel size, TR and
+        the problem found, if any. It is also saved to
+        ``csv/{project}_{session}_acquisition_details.parquet``.
+    """
+    print_starting_msg(project, session, "BOLD and DWI image headers")
+    images = list(iter_images(project, session))
+    with ThreadPoolExecutor(N_JOBS) as executor:
+        records = list(executor.map(lambda image: inspect_image(*image), images))
+    df = pd.DataFrame.from_records(records, columns=COLUMNS)
+    for column in ["shape", "voxel_size"]:
+        df[column] = df[column].map(lambda size: "x".join(map(str, size)) if size else None)
+    df.to_parquet(p.ROOT_DIR / "csv" / f"{project}_{session}_acquisition_details.parquet", index=False)
+    for row in df[df["problem"].notna()].itertuples():
+        print(f"⚠️ {row.fname}: {row.problem}")
+    return df
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Read the NIfTI headers of the BOLD and DWI scans.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--session",
+                        type=str,
+                        required=True,
+                        choices=["newborn", "sixmonth", "twelvemonth"],
+                        dest="session",
+                        help="Visit. Must be 'newborn', 'sixmonth', or 'twelvemonth'.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_acquisition_details(args.project, args.session)
+    print("✅ Done!")
@@ -1,8 +1,25 @@
+import os
 from pathlib import Path
 
-# Path to the root directory of the project
-ROOT_DIR = Path(__file__).parent.resolve() # .parents[1]
-SERVER_PATH = Path("/Volumes") / "HumphreysLab" / "Daily_2"
+from filesystem import CACHE_TTL, server_path
+
+# Path to the root directory of the project, where the csv/ and reports/ folders are.
+# Tests point it at a scratch folder.
+ROOT_DIR = Path(os.environ.get("TRACKING_ROOT_DIR", Path(__file__).parent)).resolve() # .parents[1]
+# Where the MRI data lives, as an fsspec URL: a local folder ("file:///..."), a remote
+# server ("sftp://user@host/path"), an archive ("tar://::file:///path/to/data.tar")
+# or an in-memory filesystem for tests ("memory://Daily_2")
+SERVER_URL = os.environ.get("TRACKING_SERVER_URL", "file:///Volumes/HumphreysLab/Daily_2")
+SERVER_PATH = server_path(SERVER_URL, ttl=float(os.environ.get("TRACKING_CACHE_TTL", CACHE_TTL)))
+# The sessions that each project scans
+SESSIONS = {"BABIES": ["newborn", "sixmonth"],
+            "ABC": ["newborn", "sixmonth", "twelvemonth"],
+            }
+# Append-only history of every tracking run, partitioned by project/session/run date
+HISTORY_DIR = ROOT_DIR / "history"
+# Read-only copies of the pipeline outputs. The dashboard and the API read the one
+# that snapshots/current points to.
+SNAPSHOTS_DIR = ROOT_DIR / "snapshots"
 
 def _get_session_dir(project, session):
     assert session in ["newborn", "sixmonth", "twelvemonth"]
@@ -32,6 +49,7 @@ def get_csv_paths(project):
             "derivatives_newborn": csv_path / f"{project}_newborn_derivatives.csv",
             "derivatives_sixmonth": csv_path / f"{project}_sixmonth_derivatives.csv",
             "derivatives_twelvemonth": csv_path / f"{project}_twelvemonth_derivatives.csv",
+            "inventory": csv_path / f"{project}_inventory.sqlite",
             }
 
 
@@ -0,0 +1,346 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+import count_outputs
+import cube
+import history
+import inventory
+import make_reports
+import merge_dataframes
+import paths as p
+
+LOCK_FNAME = p.ROOT_DIR / "reports" / ".pipeline.lock"
+# A lock older than this is left over from a crashed run
+LOCK_TIMEOUT = 12 * 60 * 60
+# Input fingerprint of every stage at its last successful run
+STATE_FNAME = p.ROOT_DIR / "reports" / ".pipeline_state.json"
+SNAPSHOTS_DIR = p.SNAPSHOTS_DIR
+KEEP_SNAPSHOTS = 5
+N_JOBS = 4
+# How deep to look below a session folder for new or removed subjects, sessions and
+# datatypes (e.g. derivatives/nibabies/sub-*/ses-*/func)
+TREE_DEPTH = 5
+# Where the scripts are (the root folder may be elsewhere)
+SOURCE_DIR = Path(__file__).parent.resolve()
+
+
+class PipelineLockedError(RuntimeError):
+    """Raised when another pipeline run is already in progress."""
+
+
+@contextmanager
+def pipeline_lock():
+    """Make sure only one pipeline run (from the dashboard or the CLI) happens at a time."""
+    LOCK_FNAME.parent.mkdir(parents=True, exist_ok=True)
+    if LOCK_FNAME.exists() and time.time() - LOCK_FNAME.stat().st_mtime > LOCK_TIMEOUT:
+        LOCK_FNAME.unlink(missing_ok=True)
+    try:
+        fd = os.open(LOCK_FNAME, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise PipelineLockedError(f"The pipeline is already running (see {LOCK_FNAME})")
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        LOCK_FNAME.unlink(missing_ok=True)
+
+
+@dataclass
+class Stage:
+    """One step of the pipeline, and the files it reads and writes.
+
+    ``files`` are fingerprinted by content and ``trees`` by the mtime of their
+    folders, which changes when subjects or outputs are added or removed.
+    """
+    name: str
+    func: partial
+    files: list = field(default_factory=list)
+    trees: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    deps: list = field(default_factory=list)
+
+
+def _update_cube(projects):
+    # One stage for every project, so that no two processes write the cube at once
+    for project in projects:
+        cube.update_cube(project)
+
+
+def _report(project):
+    make_reports.count_all_scans(cube.load_cube(), project=project, save=True)
+
+
+def _build_inventories(project):
+    # Every session of a project writes to the same inventory store, one at a time
+    for session in p.SESSIONS[project]:
+        inventory.build_inventory(project, session)
+
+
+def _module_files(*modules):
+    """The source files of the modules and of every module of this repo they import."""
+    files, todo = set(), [Path(module.__file__).resolve() for module in modules]
+    while todo:
+        fpath = todo.pop()
+        if fpath in files:
+            continue
+        files.add(fpath)
+        for node in ast.walk(ast.parse(fpath.read_text())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                local = SOURCE_DIR / f"{name.split('.')[0]}.py"
+                if local.exists():
+                    todo.append(local)
+    return sorted(files)
+
+
+def get_stages(projects):
+    """Declare the crawl -> merge -> cube -> count stages and the files that connect them.
+
+    The crawls of different sessions run in parallel, so the outputs that are
+    shared between sessions (the inventory store and the history aggregate) are
+    written by their own stages once the crawls are done.
+    """
+    stages = []
+    all_crawls = []
+    final_fnames = {project: p.ROOT_DIR / "reports" / f"{project}_final.csv" for project in projects}
+    for project in projects:
+        csvs = p.get_csv_paths(project)
+        crawls = []
+        for session in p.SESSIONS[project]:
+            name = f"Crawling {project} {session}"
+            stages.append(Stage(name=name,
+                                func=partial(count_outputs.build_dataframes, project, session, indexes=False),
+                                files=_module_files(count_outputs),
+                                trees=[p.get_paths(project, session)["project"]],
+                                outputs=[csvs[f"acquisition_{session}"], csvs[f"derivatives_{session}"]],
+                                ))
+            crawls.append(name)
+        # The inventory is served live from its store, so it is not part of the snapshots
+        stages.append(Stage(name=f"Indexing {project}",
+                            func=partial(_build_inventories, project),
+                            files=_module_files(inventory),
+                            trees=[p.get_paths(project, session)["project"] for session in p.SESSIONS[project]],
+                            deps=crawls,
+                            ))
+        stages.append(Stage(name=f"Merging {project}",
+                            func=partial(merge_dataframes.build_dataframe, project),
+                            files=[*_module_files(merge_dataframes), csvs["redcap"], csvs["datadict"],
+                                   *[output for stage in stages if stage.name in crawls for output in stage.outputs]],
+                            outputs=[final_fnames[project]],
+                            deps=crawls,
+                            ))
+        all_crawls.extend(crawls)
+    stages.append(Stage(name="Aggregating history",
+                        func=partial(history.update_aggregate),
+                        files=_module_files(history),
+                        # Not the whole history folder, which also holds the aggregate
+                        trees=[p.HISTORY_DIR / f"project={project}" for project in projects],
+                        outputs=[history.AGGREGATE_FNAME],
+                        deps=all_crawls,
+                        ))
+    stages.append(Stage(name="Building cube",
+                        func=partial(_update_cube, projects),
+                        files=[*_module_files(cube), *final_fnames.values()],
+                        outputs=[cube.CUBE_FNAME],
+                        deps=[f"Merging {project}" for project in projects],
+                        ))
+    for project in projects:
+        stages.append(Stage(name=f"Counting {project}",
+                            func=partial(_report, project),
+                            files=[*_module_files(make_reports), cube.CUBE_FNAME],
+                            outputs=[p.ROOT_DIR / "reports" / f"{project}_all_scan_counts.csv"],
+                            deps=["Building cube"],
+                            ))
+    return stages
+
+
+def _hash_tree(digest, root, depth=TREE_DEPTH):
+    """Add the name and mtime of every folder under root, down to ``depth`` levels."""
+    try:
+        entries = sorted(root.iterdir())
+    except (FileNotFoundError, NotADirectoryError):
+        digest.update(f"{root}:missing;".encode())
+        return
+    for entry in entries:
+        if entry.is_dir():
+            digest.update(f"{entry}:{entry.stat().st_mtime_ns};".encode())
+            if depth > 1:
+                _hash_tree(digest, entry, depth - 1)
+
+
+def fingerprint(stage):
+    """Hash the content of the input files and the folder structure of the input trees."""
+    digest = hashlib.sha1()
+    for fpath in stage.files:
+        digest.update(f"{fpath}:".encode())
+        digest.update(fpath.read_bytes() if fpath.exists() else b"missing")
+    for root in stage.trees:
+        _hash_tree(digest, root)
+    return digest.hexdigest()
+
+
+def load_state():
+    if not STATE_FNAME.exists():
+        return {}
+    return json.loads(STATE_FNAME.read_text())
+
+
+def save_state(state):
+    tmp_fname = STATE_FNAME.with_name(STATE_FNAME.name + ".partial")
+    tmp_fname.write_text(json.dumps(state, indent=2))
+    os.replace(tmp_fname, STATE_FNAME)
+
+
+def publish_snapshot(stages, keep=KEEP_SNAPSHOTS):
+    """Copy the outputs of every stage into a new snapshot folder and make it current.
+
+    The ``snapshots/current`` link is swapped in one step, so readers see either
+    the old or the new snapshot. Only the ``keep`` most recent snapshots are kept.
+    If the outputs are the same as in the current snapshot, it is kept as is.
+    """
+    outputs = [fpath for stage in stages for fpath in stage.outputs if fpath.exists()]
+    digest = hashlib.sha1()
+    for fpath in outputs:
+        digest.update(f"{fpath}:".encode())
+        digest.update(fpath.read_bytes())
+    content_hash = digest.hexdigest()[:8]
+    current = SNAPSHOTS_DIR / "current"
+    if current.exists() and current.resolve().name.endswith(content_hash):
+        return current.resolve()
+    version = f"{datetime.now():%Y%m%d-%H%M%S}-{content_hash}"
+    snapshot_dir = SNAPSHOTS_DIR / version
+    tmp_dir = SNAPSHOTS_DIR / f".{version}.partial"
+    tmp_dir.mkdir(parents=True)
+    for fpath in outputs:
+        copy_fname = tmp_dir / fpath.relative_to(p.ROOT_DIR)
+        copy_fname.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(fpath, copy_fname)
+    os.replace(tmp_dir, snapshot_dir)
+    tmp_link = SNAPSHOTS_DIR / ".current.partial"
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(version, target_is_directory=True)
+    os.replace(tmp_link, SNAPSHOTS_DIR / "current")
+    versions = sorted(path for path in SNAPSHOTS_DIR.iterdir() if path.is_dir() and not path.is_symlink()
+                      and not path.name.startswith("."))
+    for old in versions[:-keep]:
+        shutil.rmtree(old)
+    return snapshot_dir
+
+
+def run_pipeline(projects, progress=None, force=False, n_jobs=N_JOBS):
+    """Crawl the server, merge the tracking tables and count the scans.
+
+    Stages whose inputs have the same fingerprint as at their last successful
+    run, and whose outputs exist, are skipped. Independent stages (e.g. the
+    crawls of different sessions) run in parallel.
+
+    Parameters
+    ----------
+    projects : list of str
+        The projects to refresh (e.g., ["BABIES"]).
+    progress : callable | None
+        Called as ``progress(n_done, n_steps, label)`` as stages finish and once
+        at the end.
+    force : bool
+        Whether to run every stage, even if its inputs are unchanged.
+    n_jobs : int
+        The maximum number of stages to run at once.
+
+    Returns
+    -------
+    pathlib.Path | None
+        The published snapshot folder, or None if every stage was skipped.
+
+    Raises
+    ------
+    PipelineLockedError
+        If another pipeline run is already in progress.
+    """
+    stages = {stage.name: stage for stage in get_stages(projects)}
+    n_steps = len(stages)
+    done, ran = set(), set()
+
+    def report(label):
+        if progress:
+            progress(len(done), n_steps, label)
+
+    with pipeline_lock(), ProcessPoolExecutor(n_jobs) as executor:
+        state = load_state()
+        running = {}
+        while len(done) < n_steps:
+            for name, stage in stages.items():
+                if name in done or name in running.values() or not set(stage.deps) <= done:
+                    continue
+                # Fingerprint only once the stages it depends on have written their outputs
+                key = fingerprint(stage)
+                if not force and state.get(name) == key and all(fpath.exists() for fpath in stage.outputs):
+                    done.add(name)
+                    report(f"{name} (unchanged)")
+                    continue
+                report(name)
+                running[executor.submit(stage.func)] = name
+                state[name] = key
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    state.pop(name, None)
+                    save_state(state)
+                    raise
+                done.add(name)
+                ran.add(name)
+                save_state(state)
+        # The outputs of the other projects are published as well, so that refreshing
+        # one project does not drop the others from the snapshot
+        snapshot_dir = publish_snapshot(get_stages(list(p.SESSIONS))) if ran else None
+    report("Done")
+    return snapshot_dir
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the crawl -> merge -> count pipeline.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        nargs="+",
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name(s). Must be 'ABC' and/or 'BABIES'.",
+                        )
+    parser.add_argument("--force",
+                        action="store_true",
+                        dest="force",
+                        help="Run every stage, even if its inputs are unchanged.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    snapshot_dir = run_pipeline(args.project, force=args.force,
+                                progress=lambda ii, n, label: print(f"[{ii}/{n}] {label}"))
+    if snapshot_dir is None:
+        print("Nothing changed since the last run")
+    else:
+        print(f"Published {snapshot_dir}")
+    print("✅ Done!")
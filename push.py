@@ -0,0 +1,190 @@
+import argparse
+import os
+from pathlib import Path
+
+import pandas as pd
+import toml
+
+from paths import get_csv_paths
+from redcap import get_state_paths
+from redcap_api import TIMEOUT, TOKEN_ENV, URL_ENV, get_want_cols, make_session
+from utils import iter_chunks, read_final_df
+
+CONFIG_FNAME = Path(__file__).parent / "redcap_push.toml"
+# Records per import request, so that a first push of the whole cohort stays under the
+# REDCap server's request size and time limits
+BATCH_SIZE = 100
+
+
+def load_config(project, fname=CONFIG_FNAME):
+    """Read the REDCap fields of a project and the codes of the statuses.
+
+    Returns
+    -------
+    fields : dict
+        Maps (stage, visit, scan) columns of the final dataframe to REDCap fields.
+    codes : dict
+        Maps each status to its REDCap code.
+    """
+    config = toml.load(fname)
+    fields = {tuple(part.strip() for part in column.split("/")): field
+              for column, field in config[project]["fields"].items()}
+    return fields, config["codes"]
+
+
+def get_push_df(df_final, fields, codes, id_field):
+    """Code the configured statuses of every subject as REDCap field values.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per record, indexed by the REDCap record ID (``id_field``), with
+        one column per field. Statuses without a code are blank.
+    """
+    missing = [column for column in fields if column not in df_final.columns]
+    if missing:
+        raise ValueError(f"The final dataframe has no {missing} columns")
+    df = df_final[list(fields)].astype(str)
+    df = df.apply(lambda column: column.map(codes)).fillna("")
+    df.columns = list(fields.values())
+    df.index = df.index.str.removeprefix("sub-").rename(id_field)
+    return df
+
+
+def get_redcap_ids(project, id_field):
+    """Get the record IDs in the cached REDCap export of a project (see ``redcap_api.sync``)."""
+    df = pd.read_csv(get_csv_paths(project)["redcap"], dtype=str, usecols=[id_field], keep_default_na=False)
+    return pd.Index(df[id_field].unique(), name=id_field)
+
+
+def load_pushed(project, id_field):
+    """Load the field values of the last successful push, one row per record."""
+    fname = get_state_paths(project)["pushed"]
+    if not fname.exists():
+        return pd.DataFrame(index=pd.Index([], name=id_field))
+    # Record IDs are read as strings (e.g. "1001"), like the ones we compare them to
+    return pd.read_csv(fname, dtype=str, keep_default_na=False).set_index(id_field)
+
+
+def get_changed_records(df_push, df_pushed):
+    """Find the records with a field value that differs from the last push."""
+    df_pushed = df_pushed.reindex(index=df_push.index, columns=df_push.columns)
+    changed = df_pushed.isna().any(axis=1) | df_push.ne(df_pushed).any(axis=1)
+    return df_push[changed]
+
+
+def import_records(session, url, token, df):
+    """Import a batch of records, overwriting every field in ``df``.
+
+    Returns
+    -------
+    int
+        The number of records REDCap imported.
+
+    Raises
+    ------
+    ValueError
+        If REDCap rejects the data (e.g., a field that is not in the project).
+    """
+    data = {"token": token,
+            "content": "record",
+            "format": "csv",
+            "type": "flat",
+            # Blank values (e.g. a status that became "N/A") erase the old code
+            "overwriteBehavior": "overwrite",
+            "returnContent": "count",
+            "returnFormat": "json",
+            "data": df.reset_index().to_csv(index=False),
+            }
+    response = session.post(url, data=data, timeout=TIMEOUT)
+    if response.status_code == 400:
+        raise ValueError(f"REDCap rejected the import: {response.text}")
+    response.raise_for_status()
+    return int(response.json()["count"])
+
+
+def push(project, full=False, dry_run=False, url=None, token=None, batch_size=BATCH_SIZE):
+    """Write the tracking status of every changed subject to its REDCap fields.
+
+    Only the subjects with a record in the cached REDCap export are pushed, since
+    importing an unknown record ID would create a new record. The field values
+    are compared with those of the last push, and only the records that changed
+    are imported, ``batch_size`` records at a time.
+    Imports are retried on 429 and 5xx responses (see ``redcap_api.make_session``),
+    which is safe because importing the same values twice changes nothing.
+
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    full : bool
+        Whether to import every record, ignoring the last push.
+    dry_run : bool
+        Whether to only report the records that would be imported.
+    url : str | None
+        The REDCap API URL. Defaults to the ``REDCAP_API_URL`` environment variable.
+    token : str | None
+        The project's API token. Defaults to the ``REDCAP_API_TOKEN_{project}``
+        environment variable.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The records that were (or, for a dry run, would be) imported.
+    """
+    fields, codes = load_config(project)
+    id_field = get_want_cols(project)[0]
+    df_push = get_push_df(read_final_df(project), fields, codes, id_field)
+    unknown = df_push.index.difference(get_redcap_ids(project, id_field))
+    if not unknown.empty:
+        print(f"Skipping {len(unknown)} {project} subjects with no REDCap record: {', '.join(unknown)}")
+        df_push = df_push.drop(index=unknown)
+    df_pushed = load_pushed(project, id_field)
+    df_changed = df_push if full else get_changed_records(df_push, df_pushed)
+    print(f"{len(df_changed)} of {len(df_push)} {project} records changed since the last push")
+    if dry_run or df_changed.empty:
+        return df_changed
+
+    url = url or os.environ[URL_ENV]
+    token = token or os.environ[TOKEN_ENV.format(project=project)]
+    fname = get_state_paths(project)["pushed"]
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    n_imported = 0
+    with make_session() as session:
+        for batch in iter_chunks(df_changed.index, batch_size):
+            df_batch = df_changed.loc[batch]
+            n_imported += import_records(session, url, token, df_batch)
+            # Save after every batch, so a failed push resumes where it stopped
+            df_pushed = pd.concat([df_pushed.drop(index=batch, errors="ignore"), df_batch]).sort_index()
+            tmp_fname = fname.with_name(fname.name + ".partial")
+            df_pushed.to_csv(tmp_fname)
+            os.replace(tmp_fname, fname)
+            print(f"Imported {n_imported} of {len(df_changed)} records")
+    return df_changed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write the tracking status of every subject to REDCap.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--full",
+                        action="store_true",
+                        dest="full",
+                        help="Import every record instead of those that changed since the last push.",
+                        )
+    parser.add_argument("--dry-run",
+                        action="store_true",
+                        dest="dry_run",
+                        help="Only report the records that would be imported.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    push(args.project, full=args.full, dry_run=args.dry_run)
+    print("✅ Done!")
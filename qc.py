@@ -0,0 +1,142 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+import paths as p
+from utils import iter_participants, print_starting_msg
+
+CONFOUNDS_PATTERN = "*_desc-confounds_timeseries.tsv"
+CONFOUNDS_SUFFIX = "_desc-confounds_timeseries"
+QC_COLUMNS = ["framewise_displacement", "dvars"]
+# mm, the usual censoring threshold for infant fMRI
+FD_THRESHOLD = 0.5
+N_JOBS = 8
+QC_SCHEMA = pa.schema([("study_id", pa.string()),
+                       ("session", pa.string()),
+                       ("run", pa.string()),
+                       ("path", pa.string()),
+                       ("mtime_ns", pa.int64()),
+                       ("n_volumes", pa.int32()),
+                       ("mean_fd", pa.float64()),
+                       ("max_fd", pa.float64()),
+                       ("pct_fd_over", pa.float64()),
+                       ("mean_dvars", pa.float64()),
+                       ])
+
+
+def get_qc_path(project, session):
+    return p.ROOT_DIR / "csv" / f"{project}_{session}_qc.parquet"
+
+
+def load_qc_table(project, session):
+    """Load the per-run QC table saved by the last ``build_qc_table``."""
+    fname = get_qc_path(project, session)
+    if not fname.exists():
+        return QC_SCHEMA.empty_table()
+    return pq.read_table(fname, schema=QC_SCHEMA)
+
+
+def iter_confounds_files(project, session):
+    """Yield the (study_id, confounds file) of every NiBabies BOLD run."""
+    nibabies_path = p.get_paths(project, session)["nibabies"]
+    for sub in sorted(iter_participants(nibabies_path)):
+        func_path = nibabies_path / sub / f"ses-{session}" / "func"
+        for fpath in sorted(func_path.glob(CONFOUNDS_PATTERN)):
+            yield sub, fpath
+
+
+def summarize_confounds(fpath, fd_threshold=FD_THRESHOLD):
+    """Reduce one confounds file to its motion summary, reading only the QC columns.
+
+    Returns
+    -------
+    dict
+        The number of volumes, the mean and max framewise displacement, the
+        percentage of volumes with FD over ``fd_threshold`` and the mean DVARS.
+    """
+    with fpath.open("rb") as fobj:
+        table = pv.read_csv(fobj,
+                            parse_options=pv.ParseOptions(delimiter="\t"),
+                            convert_options=pv.ConvertOptions(
+                                include_columns=QC_COLUMNS,
+                                include_missing_columns=True,
+                                column_types={column: pa.float64() for column in QC_COLUMNS},
+                                null_values=["n/a", ""],
+                                ),
+                            )
+    fd = table["framewise_displacement"]
+    n_over = pc.sum(pc.greater(fd, fd_threshold)).as_py() or 0
+    return {"n_volumes": table.num_rows,
+            "mean_fd": pc.mean(fd).as_py(),
+            "max_fd": pc.max(fd).as_py(),
+            "pct_fd_over": 100 * n_over / table.num_rows if table.num_rows else np.nan,
+            "mean_dvars": pc.mean(table["dvars"]).as_py(),
+            }
+
+
+def build_qc_table(project, session, n_jobs=N_JOBS):
+    """Summarize the motion of every NiBabies BOLD run of a session.
+
+    The confounds files are parsed in a process pool. Runs whose confounds file
+    has the same mtime as in the saved table are not parsed again.
+
+    Returns
+    -------
+    pyarrow.Table
+        One row per run, with the columns of ``QC_SCHEMA``. It is also saved to
+        ``csv/{project}_{session}_qc.parquet``.
+    """
+    print_starting_msg(project, session, "Motion QC of NiBabies BOLD runs")
+    previous = {(row["path"], row["mtime_ns"]): row for row in load_qc_table(project, session).to_pylist()}
+    records, stale, stale_paths = [], [], []
+    for sub, fpath in iter_confounds_files(project, session):
+        record = {"study_id": sub,
+                  "session": session,
+                  "run": fpath.name.removesuffix(".tsv").removesuffix(CONFOUNDS_SUFFIX),
+                  "path": str(fpath),
+                  "mtime_ns": fpath.stat().st_mtime_ns,
+                  }
+        cached = previous.get((record["path"], record["mtime_ns"]))
+        if cached is not None:
+            record = cached
+        else:
+            stale.append(record)
+            stale_paths.append(fpath)
+        records.append(record)
+    with ProcessPoolExecutor(n_jobs) as executor:
+        summaries = executor.map(summarize_confounds, stale_paths)
+        for record, summary in zip(stale, summaries):
+            record.update(summary)
+    table = pa.Table.from_pylist(records, schema=QC_SCHEMA)
+    pq.write_table(table, get_qc_path(project, session))
+    print(f"Summarized {len(records)} runs ({len(stale)} new or changed)")
+    return table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Summarize the motion of every NiBabies BOLD run.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--session",
+                        type=str,
+                        required=True,
+                        choices=["newborn", "sixmonth", "twelvemonth"],
+                        dest="session",
+                        help="Visit. Must be 'newborn', 'sixmonth', or 'twelvemonth'.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_qc_table(args.project, args.session)
+    print("✅ Done!")
@@ -2,6 +2,9 @@ from pathlib import Path
 
 import pandas as pd
 
+import paths as p
+from utils import get_changed_ids
+
 BABIES_WANT_COLS = ["study_id",
                     "neonatal_status_v2",
                     "sixmo_status_v2",
@@ -65,7 +68,8 @@ def read_redcap(fname, project):
 def read_datadict(fname_datadict):
     return pd.read_csv(fname_datadict, index_col="Variable / Field Name")
 
-def process_redcap_df(df_redcap, df_datadict, project):
+def clean_redcap_ids(df_redcap, project):
+    """Drop duplicate and out-of-range study ID's and prefix them with "sub-"."""
     # Drop Duplicate Study ID's in index
     if project == "ABC":
         # Rename index from record_id to study_id
@@ -83,7 +87,10 @@ def process_redcap_df(df_redcap, df_datadict, project):
     df_redcap.drop(df_redcap.index[ids_to_drop], inplace=True)
     df_redcap.set_index("study_id", inplace=True)    # Prepend "sub-" to study ID's
     df_redcap.index = "sub-" + df_redcap.index
+    return df_redcap
 
+def decode_redcap_df(df_redcap, df_datadict, project):
+    """Map the coded answers to their labels and combine the biological sex columns."""
     if project == "ABC":
         need_cols = ABC_WANT_COLS.copy()
         need_cols.pop(need_cols.index("record_id"))
@@ -95,6 +102,10 @@ def process_redcap_df(df_redcap, df_datadict, project):
     df_redcap = get_biological_sex(df_redcap, project)
     return df_redcap
 
+def process_redcap_df(df_redcap, df_datadict, project):
+    df_redcap = clean_redcap_ids(df_redcap, project)
+    return decode_redcap_df(df_redcap, df_datadict, project)
+
 def _map_codes(df_redcap, df_datadict, column):
     missing_dict = _get_code_dict(df_datadict, column)
     df_redcap[column] = df_redcap[column].replace(missing_dict)
@@ -110,11 +121,86 @@ def _get_code_dict(df_datadict, column):
     return missing_dict
 
 def get_redcap_df(fname, fname_datadict, project):
-    df_datadict = read_datadict(fname_datadict)
-    df_redcap = process_redcap_df(read_redcap(fname, project), df_datadict, project)
+    df_redcap, _ = ingest_redcap(fname, fname_datadict, project)
     return df_redcap
 
 
+def get_state_paths(project):
+    state_dir = p.ROOT_DIR / "csv" / ".redcap_state"
+    return {"hashes": state_dir / f"{project}_record_hashes.csv",
+            "decoded": state_dir / f"{project}_decoded.csv",
+            "changed": state_dir / f"{project}_changed.csv",
+            "last_sync": state_dir / f"{project}_last_sync.txt",
+            "pushed": state_dir / f"{project}_pushed.csv",
+            }
+
+
+def get_record_hashes(df_redcap, df_datadict):
+    """Hash the wanted fields of each record.
+
+    The data dictionary is hashed along with every record, so that new answer
+    labels cause every record to be decoded again.
+    """
+    datadict_hash = pd.util.hash_pandas_object(df_datadict.astype(str), index=True).sum()
+    return pd.util.hash_pandas_object(df_redcap.assign(datadict=datadict_hash), index=True)
+
+
+def ingest_redcap(fname, fname_datadict, project, full=False):
+    """Read and decode a REDCap export, decoding only the records that changed.
+
+    The hash of every record and the decoded records are saved in
+    ``csv/.redcap_state``. Records whose hash matches the last ingest are taken
+    from there instead of being decoded again.
+
+    Parameters
+    ----------
+    fname : pathlib.Path
+        The REDCap export.
+    fname_datadict : pathlib.Path
+        The REDCap data dictionary.
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    full : bool
+        Whether to decode every record, ignoring the last ingest.
+
+    Returns
+    -------
+    df_redcap : pandas.DataFrame
+        The decoded records, indexed by study_id.
+    changed : pandas.Index
+        The study_id of every new, changed or removed record. It is also saved
+        to ``csv/.redcap_state/{project}_changed.csv`` for the later stages.
+    """
+    df_datadict = read_datadict(fname_datadict)
+    df_raw = clean_redcap_ids(read_redcap(fname, project), project)
+    hashes = get_record_hashes(df_raw, df_datadict)
+    state = get_state_paths(project)
+
+    previous_hashes = None
+    if not full and state["hashes"].exists() and state["decoded"].exists():
+        previous_hashes = pd.read_csv(state["hashes"], index_col="study_id", dtype={"hash": "uint64"})["hash"]
+        changed, removed = get_changed_ids(hashes, previous_hashes)
+    else:
+        changed, removed = hashes.index, pd.Index([], name="study_id")
+
+    df_redcap = decode_redcap_df(df_raw.loc[changed].copy(), df_datadict, project)
+    if previous_hashes is not None:
+        # Only labels are stored, so read them back as strings
+        df_previous = pd.read_csv(state["decoded"], index_col="study_id", dtype=object,
+                                  keep_default_na=False, na_values=[""])
+        unchanged = hashes.index.difference(changed)
+        df_redcap = pd.concat([df_previous.loc[unchanged], df_redcap]).loc[hashes.index]
+        df_redcap.index = hashes.index
+        print(f"Decoded {len(changed)} new or changed {project} REDCap records ({len(removed)} removed)")
+
+    changed = changed.union(removed)
+    state["hashes"].parent.mkdir(parents=True, exist_ok=True)
+    df_redcap.to_csv(state["decoded"])
+    hashes.to_csv(state["hashes"], header=["hash"])
+    changed.to_series().to_csv(state["changed"], index=False, header=["study_id"])
+    return df_redcap, changed
+
+
 def get_biological_sex(df, project):
     # 1. check if infant_sex is missing
     # 2. if missing, check if child_sex is missing
@@ -0,0 +1,205 @@
+import argparse
+import io
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from paths import get_csv_paths
+from redcap import ABC_WANT_COLS, BABIES_WANT_COLS, get_state_paths
+
+# e.g. https://redcap.<institution>.edu/api/
+URL_ENV = "REDCAP_API_URL"
+# The API token of each project, e.g. REDCAP_API_TOKEN_BABIES
+TOKEN_ENV = "REDCAP_API_TOKEN_{project}"
+# The timezone of the REDCap server, e.g. "America/Los_Angeles". REDCap reads
+# dateRangeBegin on the server's clock. Defaults to the timezone of this machine.
+TIMEZONE_ENV = "REDCAP_TIMEZONE"
+TIMEOUT = 60
+# REDCap metadata field: Data Dictionary (CSV download) header
+DATADICT_COLUMNS = {"field_name": "Variable / Field Name",
+                    "form_name": "Form Name",
+                    "section_header": "Section Header",
+                    "field_type": "Field Type",
+                    "field_label": "Field Label",
+                    "select_choices_or_calculations": "Choices, Calculations, OR Slider Labels",
+                    "field_note": "Field Note",
+                    "text_validation_type_or_show_slider_number": "Text Validation Type OR Show Slider Number",
+                    "text_validation_min": "Text Validation Min",
+                    "text_validation_max": "Text Validation Max",
+                    "identifier": "Identifier?",
+                    "branching_logic": "Branching Logic (Show field only if...)",
+                    "required_field": "Required Field?",
+                    "custom_alignment": "Custom Alignment",
+                    "question_number": "Question Number (surveys only)",
+                    "matrix_group_name": "Matrix Group Name",
+                    "matrix_ranking": "Matrix Ranking?",
+                    "field_annotation": "Field Annotation",
+                    }
+
+
+def get_want_cols(project):
+    if project == "BABIES":
+        return BABIES_WANT_COLS
+    elif project == "ABC":
+        return ABC_WANT_COLS
+    raise ValueError(f"Project {project} not recognized.")
+
+
+def get_server_timezone():
+    """The timezone of the REDCap server, or None for the timezone of this machine."""
+    name = os.environ.get(TIMEZONE_ENV)
+    return ZoneInfo(name) if name else None
+
+
+def make_session(n_retries=5):
+    """Make an HTTP session that reuses connections and retries transient errors."""
+    retry = Retry(total=n_retries,
+                  backoff_factor=1,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  # REDCap exports are POST requests, but they do not change anything
+                  allowed_methods=["POST"],
+                  )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    return session
+
+
+def _post(session, url, data, columns=()):
+    response = session.post(url, data=data, timeout=TIMEOUT)
+    response.raise_for_status()
+    try:
+        return pd.read_csv(io.StringIO(response.text), dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        # REDCap sends an empty body, without a header, when nothing matches (e.g. no
+        # record was modified since the last sync)
+        return pd.DataFrame(columns=list(columns), dtype=str)
+
+
+def _field_params(fields):
+    return {f"fields[{ii}]": field for ii, field in enumerate(fields)}
+
+
+def export_records(session, url, token, fields, since=None, tz=None):
+    """Export the given fields of every record, or of the records modified since ``since``.
+
+    ``since`` is converted to the timezone of the REDCap server, ``tz`` (see
+    ``get_server_timezone``). A naive ``since`` is taken to be local time.
+    """
+    data = {"token": token,
+            "content": "record",
+            "format": "csv",
+            "type": "flat",
+            "rawOrLabel": "raw",
+            "returnFormat": "json",
+            **_field_params(fields),
+            }
+    if since is not None:
+        data["dateRangeBegin"] = since.astimezone(tz).strftime("%Y-%m-%d %H:%M:%S")
+    return _post(session, url, data, columns=fields)
+
+
+def export_metadata(session, url, token, fields):
+    """Export the data dictionary of the given fields, with the CSV download headers."""
+    data = {"token": token,
+            "content": "metadata",
+            "format": "csv",
+            "returnFormat": "json",
+            **_field_params(fields),
+            }
+    return _post(session, url, data).rename(columns=DATADICT_COLUMNS)
+
+
+def merge_records(df_cached, df_updated, id_col):
+    """Replace the cached rows of every updated record (all of its events) with the new rows."""
+    if df_updated.empty:
+        return df_cached
+    df_cached = df_cached[~df_cached[id_col].isin(df_updated[id_col])]
+    df = pd.concat([df_cached, df_updated], ignore_index=True)
+    return df.sort_values(id_col, key=lambda ids: pd.to_numeric(ids, errors="coerce"), kind="stable")
+
+
+def _write_csv(df, fname):
+    """Write the CSV file next to the old one first, so readers never see half a file."""
+    tmp_fname = fname.with_name(fname.name + ".partial")
+    df.to_csv(tmp_fname, index=False)
+    os.replace(tmp_fname, fname)
+
+
+def sync(project, full=False, url=None, token=None):
+    """Update the cached REDCap export and data dictionary of a project.
+
+    Only the fields in ``*_WANT_COLS`` are requested, and only the records
+    modified since the last sync unless ``full`` is set (or nothing is cached).
+
+    Parameters
+    ----------
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    full : bool
+        Whether to export every record. Records deleted in REDCap are only
+        dropped from the cache by a full sync.
+    url : str | None
+        The REDCap API URL. Defaults to the ``REDCAP_API_URL`` environment variable.
+    token : str | None
+        The project's API token. Defaults to the ``REDCAP_API_TOKEN_{project}``
+        environment variable.
+
+    Set the ``REDCAP_TIMEZONE`` environment variable if the REDCap server is not
+    in the timezone of this machine.
+    """
+    url = url or os.environ[URL_ENV]
+    token = token or os.environ[TOKEN_ENV.format(project=project)]
+    csvs = get_csv_paths(project)
+    last_sync_fname = get_state_paths(project)["last_sync"]
+    fields = get_want_cols(project)
+    id_col = fields[0]
+
+    since = None
+    if not full and csvs["redcap"].exists() and last_sync_fname.exists():
+        since = datetime.fromisoformat(last_sync_fname.read_text().strip())
+    # Records saved while we export will be picked up by the next sync. The time is
+    # saved in UTC and converted to the server's timezone when it is sent.
+    started = datetime.now(timezone.utc)
+    with make_session() as session:
+        df_records = export_records(session, url, token, fields, since=since, tz=get_server_timezone())
+        df_datadict = export_metadata(session, url, token, fields)
+
+    if since is not None:
+        n_updated = df_records[id_col].nunique()
+        df_cached = pd.read_csv(csvs["redcap"], dtype=str, keep_default_na=False)
+        df_records = merge_records(df_cached, df_records, id_col)
+        print(f"Updated {n_updated} {project} records modified since {since:%Y-%m-%d %H:%M:%S}")
+    else:
+        print(f"Exported {df_records[id_col].nunique()} {project} records")
+    _write_csv(df_records, csvs["redcap"])
+    _write_csv(df_datadict, csvs["datadict"])
+    last_sync_fname.parent.mkdir(parents=True, exist_ok=True)
+    last_sync_fname.write_text(started.isoformat())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync the REDCap export of a project through the API.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--full",
+                        action="store_true",
+                        dest="full",
+                        help="Export every record instead of those modified since the last sync.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    sync(args.project, full=args.full)
+    print("✅ Done!")
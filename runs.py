@@ -0,0 +1,141 @@
+import argparse
+
+import duckdb
+import pandas as pd
+import toml
+
+import paths as p
+from utils import extract_run_datetime, get_participant_list, print_starting_msg
+
+INDEX_COLUMNS = ["subject", "session", "run"]
+# column: (toml section, key) of the NiBabies settings we keep for every run
+KEY_SETTINGS = {"surface_recon_method": ("workflow", "surface_recon_method"),
+                "cifti_output": ("workflow", "cifti_output"),
+                "version": ("environment", "version"),
+                }
+COLUMNS = INDEX_COLUMNS + ["timestamp"] + list(KEY_SETTINGS)
+
+
+def get_run_index_path(project, session):
+    return p.ROOT_DIR / "csv" / f"{project}_{session}_nibabies_runs.parquet"
+
+
+def load_run_index(project, session):
+    """Load the NiBabies run-history index saved by the last ``build_run_index``."""
+    fname = get_run_index_path(project, session)
+    if not fname.exists():
+        return pd.DataFrame(columns=COLUMNS).set_index(INDEX_COLUMNS)
+    df = duckdb.read_parquet(str(fname)).df()
+    return df.set_index(INDEX_COLUMNS).sort_index()
+
+
+def _parse_run(run):
+    """Read the timestamp and key settings of one run, or None if it has no config yet."""
+    toml_file = run / "nibabies.toml"
+    if not toml_file.exists():
+        return None
+    config = toml.loads(toml_file.read_text())
+    record = {"timestamp": extract_run_datetime(run)}
+    for column, (section, key) in KEY_SETTINGS.items():
+        value = config.get(section, {}).get(key)
+        record[column] = None if value is None else str(value)
+    return record
+
+
+def build_run_index(project, session):
+    """Index every NiBabies run of every subject in one pass over the log folders.
+
+    Runs that are already in the saved index are not parsed again, so only new
+    runs cost a TOML read.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per run, indexed by (subject, session, run), with the run
+        timestamp and the settings in ``KEY_SETTINGS``.
+    """
+    print_starting_msg(project, session, "NiBabies run history")
+    nibabies_path = p.get_paths(project, session)["nibabies"]
+    previous = load_run_index(project, session)
+    records = []
+    for sub in get_participant_list(nibabies_path):
+        log_path = nibabies_path / sub / f"ses-{session}" / "log"
+        if not log_path.exists():
+            continue
+        for run in log_path.iterdir():
+            if not run.is_dir():
+                continue
+            key = (sub, session, run.name)
+            if key in previous.index:
+                records.append({**dict(zip(INDEX_COLUMNS, key)), **previous.loc[key].to_dict()})
+                continue
+            record = _parse_run(run)
+            if record is not None:
+                records.append({**dict(zip(INDEX_COLUMNS, key)), **record})
+    df = pd.DataFrame.from_records(records, columns=COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    for column in ["subject", "session"] + list(KEY_SETTINGS):
+        df[column] = df[column].astype("category")
+    duckdb.from_df(df).write_parquet(str(get_run_index_path(project, session)))
+    print(f"Indexed {len(df)} runs ({len(df) - len(previous)} new)")
+    return df.set_index(INDEX_COLUMNS).sort_index()
+
+
+def get_latest_runs(run_index):
+    """Get the most recent run of each subject, indexed by subject."""
+    df = run_index.reset_index().sort_values(["timestamp", "run"])
+    return df.groupby("subject", observed=True).last()
+
+
+def get_reprocessed_subjects(run_index, surface_recon_method, since):
+    """Get the subjects with a run using ``surface_recon_method`` on or after ``since``.
+
+    Parameters
+    ----------
+    run_index : pandas.DataFrame
+        The output of ``build_run_index`` or ``load_run_index``.
+    surface_recon_method : str
+        The surface reconstruction method (e.g., "mcribs", "infantfs").
+    since : str | datetime.datetime
+        The earliest run date to consider.
+    """
+    mask = ((run_index["surface_recon_method"] == surface_recon_method)
+            & (run_index["timestamp"] >= pd.Timestamp(since)))
+    return sorted(run_index.index[mask].get_level_values("subject").unique())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query the NiBabies run history.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--session",
+                        type=str,
+                        required=True,
+                        choices=["newborn", "sixmonth", "twelvemonth"],
+                        dest="session",
+                        help="Visit. Must be 'newborn', 'sixmonth', or 'twelvemonth'.",
+                        )
+    parser.add_argument("--method",
+                        type=str,
+                        required=True,
+                        dest="method",
+                        help="Surface recon method, e.g. 'mcribs' or 'infantfs'.",
+                        )
+    parser.add_argument("--since",
+                        type=str,
+                        required=True,
+                        dest="since",
+                        help="Earliest run date, e.g. 2024-09-01.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_index = load_run_index(args.project, args.session)
+    for sub in get_reprocessed_subjects(run_index, args.method, args.since):
+        print(sub)
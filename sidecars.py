@@ -0,0 +1,176 @@
+import argparse
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import paths as p
+from utils import iter_participants, print_starting_msg
+
+N_JOBS = 16
+# Sidecar keys that are kept, with their type
+KEYS = {"SeriesDescription": pa.string(),
+        "ProtocolName": pa.string(),
+        "SequenceName": pa.string(),
+        "RepetitionTime": pa.float64(),
+        "EchoTime": pa.float64(),
+        "FlipAngle": pa.float64(),
+        "PhaseEncodingDirection": pa.string(),
+        "AcquisitionTime": pa.string(),
+        "AcquisitionDateTime": pa.string(),
+        }
+SIDECAR_SCHEMA = pa.schema([("subject", pa.string()),
+                            ("session", pa.string()),
+                            ("suffix", pa.string()),
+                            ("run", pa.int32()),
+                            ("name", pa.string()),
+                            ("path", pa.string()),
+                            ("mtime_ns", pa.int64()),
+                            *KEYS.items(),
+                            ])
+# Keys that should be the same for every scan of a suffix
+PROTOCOL_KEYS = ["RepetitionTime", "EchoTime", "PhaseEncodingDirection", "SequenceName"]
+RUN_PATTERN = re.compile(r"_run-(\d+)")
+
+
+def get_sidecar_path(project, session):
+    return p.ROOT_DIR / "csv" / f"{project}_{session}_sidecars.parquet"
+
+
+def load_sidecar_table(project, session):
+    """Load the sidecar table saved by the last ``build_sidecar_table``."""
+    fname = get_sidecar_path(project, session)
+    if not fname.exists():
+        return SIDECAR_SCHEMA.empty_table()
+    return pq.read_table(fname, schema=SIDECAR_SCHEMA)
+
+
+def iter_sidecars(project, session):
+    """Yield the (subject, sidecar path) of every JSON sidecar in the BIDS directory."""
+    bpath = p.get_paths(project, session)["bids"]
+    for sub in sorted(iter_participants(bpath)):
+        for fpath in sorted((bpath / sub / f"ses-{session}").glob("*/*.json")):
+            yield sub, fpath
+
+
+def read_sidecar(fpath):
+    """Read the ``KEYS`` of one sidecar, as None where they are missing."""
+    sidecar = orjson.loads(fpath.read_bytes())
+    record = {}
+    for key, dtype in KEYS.items():
+        value = sidecar.get(key)
+        if value is not None and pa.types.is_string(dtype):
+            value = str(value)
+        elif value is not None and pa.types.is_floating(dtype):
+            value = float(value)
+        record[key] = value
+    return record
+
+
+def build_sidecar_table(project, session):
+    """Index the acquisition parameters of every BIDS sidecar of a session.
+
+    Sidecars are read in parallel, and only if their mtime differs from the
+    saved table.
+
+    Returns
+    -------
+    pyarrow.Table
+        One row per sidecar, keyed by (subject, session, suffix, run), with the
+        columns of ``SIDECAR_SCHEMA``. It is also saved to
+        ``csv/{project}_{session}_sidecars.parquet``.
+    """
+    print_starting_msg(project, session, "BIDS sidecar metadata")
+    previous = {(row["path"], row["mtime_ns"]): row for row in load_sidecar_table(project, session).to_pylist()}
+    records, stale, stale_paths = [], [], []
+    for sub, fpath in iter_sidecars(project, session):
+        run = RUN_PATTERN.search(fpath.name)
+        record = {"subject": sub,
+                  "session": session,
+                  "suffix": fpath.stem.rsplit("_", 1)[-1],
+                  "run": int(run.group(1)) if run else None,
+                  "name": fpath.stem,
+                  "path": str(fpath),
+                  "mtime_ns": fpath.stat().st_mtime_ns,
+                  }
+        cached = previous.get((record["path"], record["mtime_ns"]))
+        if cached is not None:
+            record = cached
+        else:
+            stale.append(record)
+            stale_paths.append(fpath)
+        records.append(record)
+    with ThreadPoolExecutor(N_JOBS) as executor:
+        for record, values in zip(stale, executor.map(read_sidecar, stale_paths)):
+            record.update(values)
+    table = pa.Table.from_pylist(records, schema=SIDECAR_SCHEMA)
+    pq.write_table(table, get_sidecar_path(project, session))
+    print(f"Indexed {len(records)} sidecars ({len(stale)} new or changed)")
+    return table
+
+
+def _connect(table):
+    con = duckdb.connect()
+    con.register("sidecars", table)
+    return con
+
+
+def get_protocol_deviations(table, keys=PROTOCOL_KEYS):
+    """Find the scans whose parameters differ from the most common value for their suffix.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per deviating (scan, key), with the value found and the expected
+        (most common) value.
+    """
+    queries = [f"""
+        SELECT subject, session, suffix, run, name, '{key}' AS key,
+               CAST("{key}" AS VARCHAR) AS value,
+               CAST(mode("{key}") OVER (PARTITION BY suffix) AS VARCHAR) AS expected
+        FROM sidecars
+        QUALIFY value IS DISTINCT FROM expected
+        """ for key in keys]
+    with _connect(table) as con:
+        return con.sql(" UNION ALL ".join(queries) + " ORDER BY ALL").df()
+
+
+def get_acquisition_dates(table):
+    """Get the earliest AcquisitionDateTime of every subject that has one."""
+    with _connect(table) as con:
+        return con.sql("""
+            SELECT subject, session, min(TRY_CAST(AcquisitionDateTime AS TIMESTAMP)) AS date_acquired
+            FROM sidecars
+            WHERE AcquisitionDateTime IS NOT NULL
+            GROUP BY subject, session
+            ORDER BY subject
+            """).df()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index the BIDS sidecars and report protocol deviations.")
+    parser.add_argument("--project",
+                        type=str,
+                        required=True,
+                        choices=["ABC", "BABIES",],
+                        dest="project",
+                        help="Project name. Must be 'ABC' or 'BABIES'.",
+                        )
+    parser.add_argument("--session",
+                        type=str,
+                        required=True,
+                        choices=["newborn", "sixmonth", "twelvemonth"],
+                        dest="session",
+                        help="Visit. Must be 'newborn', 'sixmonth', or 'twelvemonth'.",
+                        )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    table = build_sidecar_table(args.project, args.session)
+    for row in get_protocol_deviations(table).itertuples():
+        print(f"⚠️ {row.name}: {row.key} is {row.value}, expected {row.expected}")
+    print("✅ Done!")
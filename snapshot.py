@@ -0,0 +1,102 @@
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+import paths as p
+
+STAGES = ["acquisition", "derivatives"]
+
+
+def get_data_dir():
+    """The folder that the dashboard and the API read the tracking files from.
+
+    This is the snapshot the pipeline published last (``snapshots/current``), which
+    does not change while the pipeline writes the next one. Before the first
+    snapshot, it is the root folder itself.
+    """
+    current = p.SNAPSHOTS_DIR / "current"
+    return current.resolve() if current.exists() else p.ROOT_DIR
+
+
+def get_snapshot_path(fpath, data_dir=None):
+    """Where a file of the root folder (e.g. ``cube.CUBE_FNAME``) is in the data folder."""
+    data_dir = data_dir or get_data_dir()
+    return data_dir / Path(fpath).relative_to(p.ROOT_DIR)
+
+
+def get_snapshot_files(data_dir=None):
+    """Get the tracking CSV files that make up the current data snapshot."""
+    data_dir = data_dir or get_data_dir()
+    csv_dir = data_dir / "csv"
+    reports_dir = data_dir / "reports"
+    aggregates_dir = get_snapshot_path(p.HISTORY_DIR / "_aggregates", data_dir)
+    return (sorted(csv_dir.glob("*.csv"))
+            + sorted(reports_dir.glob("*.csv"))
+            + sorted(reports_dir.glob("*.parquet"))
+            + sorted(aggregates_dir.glob("*.parquet"))
+            )
+
+
+def get_snapshot_version(extra_files=()):
+    """Fingerprint the current data snapshot.
+
+    Parameters
+    ----------
+    extra_files : list of pathlib.Path
+        Additional files (e.g. the app module) whose changes should also
+        change the snapshot version.
+
+    Returns
+    -------
+    version : str
+        A short hex digest of the data folder and of the name, size and mtime
+        of every snapshot file.
+    last_modified : datetime.datetime
+        The most recent modification time across the snapshot files (UTC).
+    """
+    data_dir = get_data_dir()
+    digest = hashlib.sha1(f"{data_dir.name};".encode())
+    latest = 0
+    for fpath in [*get_snapshot_files(data_dir), *extra_files]:
+        stat = fpath.stat()
+        digest.update(f"{fpath.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        latest = max(latest, stat.st_mtime)
+    last_modified = datetime.fromtimestamp(int(latest), tz=timezone.utc)
+    return digest.hexdigest()[:16], last_modified
+
+
+def iter_stage_fnames(data_dir=None):
+    """Yield the (project, session, stage, fname) of every crawled CSV file."""
+    data_dir = data_dir or get_data_dir()
+    for fname in sorted((data_dir / "csv").glob("*.csv")):
+        parts = fname.stem.split("_")
+        if len(parts) == 3 and parts[2] in STAGES:
+            yield (*parts, fname)
+
+
+def load_status_table():
+    """Load every crawled CSV file as one long table of scan statuses.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per (project, study_id, session, stage, scan), where ``value``
+        says whether that scan was acquired (or processed). Only the True/False
+        columns are kept, so e.g. Surface-Recon-Method and the dates are dropped.
+    """
+    columns = ["project", "study_id", "session", "stage", "scan", "value"]
+    tables = []
+    for project, session, stage, fname in iter_stage_fnames():
+        df = pd.read_csv(fname).set_index("study_id")
+        df = df[[col for col in df.columns if set(df[col].dropna().unique()) <= {True, False}]]
+        df = (df.eq(True)
+                .melt(var_name="scan", ignore_index=False)
+                .reset_index()
+                )
+        df[["project", "session", "stage"]] = project, session, stage
+        tables.append(df[columns])
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(tables, ignore_index=True)
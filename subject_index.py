@@ -0,0 +1,86 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+STATUSES = ["Done", "Missing"]
+
+
+def get_study_ids(tables):
+    """Every study_id in the tables, sorted. A subject's label is its position here.
+
+    Any folder name works (e.g. "sub-0012" or "sub-pilot"), since the IDs are
+    never parsed.
+    """
+    study_ids = pd.concat([table["study_id"].to_pandas() for table in tables.values()], ignore_index=True)
+    _, uniques = pd.factorize(study_ids.astype(str), sort=True)
+    return pd.Index(uniques, dtype=object, name="study_id")
+
+
+def to_labels(study_ids, vocabulary):
+    """Integer participant labels, in the same order (see ``get_study_ids``)."""
+    return vocabulary.get_indexer(pd.Index(study_ids, dtype=object)).astype(np.int64)
+
+
+def to_study_ids(labels, vocabulary):
+    """The study_ids of participant labels, for display."""
+    return vocabulary[labels].tolist()
+
+
+def build_index(tables, vocabulary=None):
+    """Map every (visit, stage, modality, status) cell to the subjects in it.
+
+    A subject is "Missing" a modality at a stage if it is in any table of that
+    visit but the modality is not done at that stage. So, e.g., the subjects
+    acquired but not processed are the intersection of the (Acquired, Done) and
+    (Processed, Missing) cells. Like in the final dataframe, a modality is only
+    done at the Processed stage if it was also acquired.
+
+    Parameters
+    ----------
+    tables : dict
+        Maps (visit, stage) to a pyarrow table with a ``study_id`` column and
+        one boolean column per modality.
+    vocabulary : pandas.Index | None
+        The study_ids that labels refer to. Defaults to ``get_study_ids(tables)``.
+
+    Returns
+    -------
+    dict
+        Maps (visit, stage, modality, status) to a sorted array of participant
+        labels (see ``to_labels``).
+    """
+    if vocabulary is None:
+        vocabulary = get_study_ids(tables)
+    labels = {key: to_labels(table["study_id"].to_pandas(), vocabulary) for key, table in tables.items()}
+    visits = {}
+    for (visit, stage) in tables:
+        visits[visit] = np.union1d(visits.get(visit, []), labels[(visit, stage)]).astype(np.int64)
+    index = {}
+    for (visit, stage), table in tables.items():
+        for modality in table.column_names:
+            if modality == "study_id":
+                continue
+            is_done = pc.fill_null(pc.equal(table[modality], True), False).to_numpy()
+            done = np.unique(labels[(visit, stage)][is_done])
+            if stage == "Processed" and (visit, "Acquired") in tables:
+                acquired = pc.fill_null(pc.equal(tables[(visit, "Acquired")][modality], True), False).to_numpy()
+                done = np.intersect1d(done, labels[(visit, "Acquired")][acquired])
+            index[(visit, stage, modality, "Done")] = done
+            index[(visit, stage, modality, "Missing")] = np.setdiff1d(visits[visit], done, assume_unique=True)
+    return index
+
+
+def lookup(index, cells):
+    """Find the subjects that are in every one of the cells.
+
+    Returns
+    -------
+    numpy.ndarray
+        The sorted participant labels. Unknown cells match no subjects.
+    """
+    empty = np.array([], dtype=np.int64)
+    # Start from the smallest cell, so every intersection is as cheap as it can be
+    arrays = sorted((index.get(tuple(cell), empty) for cell in cells), key=len)
+    return reduce(lambda left, right: np.intersect1d(left, right, assume_unique=True), arrays)
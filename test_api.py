@@ -0,0 +1,87 @@
+import shutil
+
+import pandas as pd
+import pytest
+from flask import Flask
+
+import api
+import paths as p
+
+URL = "/api/v1/subjects?project=BABIES&session=newborn&stage=acquisition&scan=DWI"
+
+
+@pytest.fixture
+def client(tracking_csvs):
+    api.connect.cache_clear()
+    server = Flask(__name__)
+    server.register_blueprint(api.api)
+    return server.test_client()
+
+
+def get_dwi_subjects(csvs, value=True):
+    df = pd.read_csv(csvs["acquisition_newborn"])
+    return sorted(df.loc[df["DWI"] == value, "study_id"])
+
+
+def test_subjects_are_paginated(client, tracking_csvs):
+    expected = get_dwi_subjects(tracking_csvs)
+
+    pages = [client.get(f"{URL}&page={page}&page_size=50").get_json() for page in [1, 2, 3, 4]]
+
+    assert [page["total"] for page in pages] == [len(expected)] * 4
+    assert [len(page["subjects"]) for page in pages] == [50, 50, len(expected) - 100, 0]
+    assert [row["study_id"] for page in pages for row in page["subjects"]] == expected
+    response = client.get(f"{URL}&value=false").get_json()
+    assert [row["study_id"] for row in response["subjects"]] == get_dwi_subjects(tracking_csvs, value=False)
+    assert response["page_size"] == api.DEFAULT_PAGE_SIZE
+
+
+@pytest.mark.parametrize("query", ["page=0", f"page_size={api.MAX_PAGE_SIZE + 1}", "page_size=0", "value=maybe"])
+def test_bad_pages_are_rejected(client, query):
+    response = client.get(f"{URL}&{query}")
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_subject_status(client):
+    response = client.get("/api/v1/subjects/sub-1410?project=BABIES")
+
+    assert response.status_code == 200
+    status = response.get_json()["status"]
+    assert {"project": "BABIES", "session": "newborn", "stage": "acquisition", "scan": "DWI",
+            "value": True} in status
+    assert client.get("/api/v1/subjects/sub-0000").status_code == 404
+
+
+def test_unchanged_responses_are_not_modified(client):
+    response = client.get(URL)
+    etag = response.headers["ETag"]
+
+    assert response.status_code == 200
+    assert client.get(URL, headers={"If-None-Match": etag}).status_code == 304
+    # As suffixed by the compression of the dashboard's server
+    tag, _ = response.get_etag()
+    assert client.get(URL, headers={"If-None-Match": f'"{tag}:br"'}).status_code == 304
+    other = client.get(f"{URL}&page=2", headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["ETag"] != etag
+
+
+def test_new_snapshots_change_the_etag(client, tracking_csvs):
+    response = client.get(URL)
+    etag, total = response.headers["ETag"], response.get_json()["total"]
+    # Publish a snapshot where one more subject has a DWI scan
+    snapshot_dir = p.SNAPSHOTS_DIR / "20250101-000000-00000000"
+    shutil.copytree(p.ROOT_DIR / "csv", snapshot_dir / "csv")
+    fname = snapshot_dir / "csv" / tracking_csvs["acquisition_newborn"].name
+    df = pd.read_csv(fname)
+    df.loc[df.index[~df["DWI"]][0], "DWI"] = True
+    df.to_csv(fname, index=False)
+    (p.SNAPSHOTS_DIR / "current").symlink_to(snapshot_dir.name, target_is_directory=True)
+
+    response = client.get(URL, headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_json()["total"] == total + 1
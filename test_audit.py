@@ -0,0 +1,18 @@
+import pandas as pd
+
+from audit import audit, load_stage_ids
+
+
+def test_audit_reports_odd_folder_names(tracking_csvs):
+    fname = tracking_csvs["acquisition_newborn"]
+    df = pd.read_csv(fname)
+    extra = df.iloc[:2].assign(study_id=["sub-0012", "sub-1001b"])
+    pd.concat([df, extra]).to_csv(fname, index=False)
+
+    report = audit(load_stage_ids("BABIES"), "BABIES").set_index(["session", "in_stage", "not_in_stage"])
+
+    missing = report.loc[("newborn", "BIDS", "REDCap"), "study_ids"].split()
+    assert {"sub-0012", "sub-1001b"} <= set(missing)
+    assert missing == sorted(missing)
+    # The export has a record that was never scanned
+    assert "sub-1999" in report.loc[("newborn", "REDCap", "BIDS"), "study_ids"].split()
@@ -0,0 +1,100 @@
+import pandas as pd
+import pytest
+
+import cube
+import make_reports
+import merge_dataframes
+import paths as p
+from utils import read_final_df
+
+MODALITIES = {"Acquired": ["Anatomical", "Functional", "DWI"],
+              "Processed": ["Anatomical", "Functional-Volume", "Functional-Surface", "DWI"],
+              }
+
+
+@pytest.fixture
+def df_final(tracking_csvs):
+    merge_dataframes.build_dataframe("BABIES")
+    return read_final_df("BABIES")
+
+
+def save_final(df):
+    df.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+
+
+def test_incremental_cube_matches_full_cube(df_final):
+    cube.update_cube("BABIES")
+    df = df_final.copy()
+    df.loc["sub-1410", ("Processed", "Newborn", "DWI")] = "Not Processed"
+    df.loc["sub-1043", ("Acquired", "Newborn", "Biological Sex")] = "Female"
+    df.loc["sub-9001"] = df.loc["sub-1410"]
+    df = df.drop(index="sub-1008")
+    save_final(df)
+
+    incremental = cube.update_cube("BABIES")
+
+    df_incremental = incremental.sort_values(cube.DIMENSIONS, ignore_index=True)
+    df_full = cube.update_cube("BABIES", full=True).sort_values(cube.DIMENSIONS, ignore_index=True)
+    pd.testing.assert_frame_equal(df_incremental, df_full, check_dtype=False)
+
+
+def test_update_after_a_failed_update_matches_full_cube(df_final, monkeypatch):
+    cube.update_cube("BABIES")
+    df = df_final.copy()
+    df.loc["sub-1410", ("Processed", "Newborn", "DWI")] = "Not Processed"
+    save_final(df)
+    write = cube._write
+
+    def fail_after_the_cube(fname, func):
+        if fname != cube.CUBE_FNAME:
+            raise OSError("No space left on device")
+        write(fname, func)
+
+    # The cube is replaced, but not the facts it was counted from
+    monkeypatch.setattr(cube, "_write", fail_after_the_cube)
+    with pytest.raises(OSError):
+        cube.update_cube("BABIES")
+    monkeypatch.setattr(cube, "_write", write)
+    df.loc["sub-1043", ("Acquired", "Newborn", "DWI")] = "Not Acquired"
+    save_final(df)
+
+    df_updated = cube.update_cube("BABIES").sort_values(cube.DIMENSIONS, ignore_index=True)
+
+    df_full = cube.update_cube("BABIES", full=True).sort_values(cube.DIMENSIONS, ignore_index=True)
+    pd.testing.assert_frame_equal(df_updated, df_full, check_dtype=False)
+
+
+def test_counts_match_the_final_dataframe(df_final):
+    cube.update_cube("BABIES")
+    olap = cube.load_cube()
+    sex = df_final[("Acquired", "Newborn", "Biological Sex")]
+
+    for stage, modalities in MODALITIES.items():
+        for visit in ["Newborn", "Six Months"]:
+            for modality in modalities:
+                done = df_final[(stage, visit, modality)] == stage
+                assert cube.get_count(olap, project="BABIES", visit=visit, stage=stage, modality=modality,
+                                      status=stage) == done.sum()
+                assert cube.get_count(olap, project="BABIES", visit=visit, stage=stage, modality=modality,
+                                      status=stage, sex="Female") == (done & (sex == "Female")).sum()
+    # Every subject has one fact per scan column, whatever its status
+    n_scans = sum(modality not in cube.NOT_MODALITIES[stage] for stage, _, modality in df_final.columns)
+    assert cube.get_count(olap, project="BABIES") == n_scans * len(df_final)
+
+
+def test_count_all_scans_writes_integers(df_final):
+    cube.update_cube("BABIES")
+
+    all_counts = make_reports.count_all_scans(cube.load_cube(), "BABIES")
+
+    for visit in ["Newborn", "Six Months"]:
+        for modality in MODALITIES["Acquired"]:
+            done = (df_final[("Acquired", visit, modality)] == "Acquired").sum()
+            assert all_counts.loc[(visit, modality), ("Acquired", "Count")] == done
+        volume, surface = [(df_final[("Processed", visit, modality)] == "Processed").sum()
+                           for modality in ["Functional-Volume", "Functional-Surface"]]
+        assert all_counts.loc[(visit, "Functional"), ("Processed", "Count")] == volume + surface
+    df_saved = pd.read_csv(p.ROOT_DIR / "reports" / "BABIES_all_scan_counts.csv", header=[0, 1], index_col=[0, 1],
+                           dtype=str, keep_default_na=False)
+    assert not df_saved.apply(lambda column: column.str.contains(".", regex=False)).any().any()
+    assert (df_saved != "").any().all()
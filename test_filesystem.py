@@ -0,0 +1,95 @@
+import os
+import pickle
+
+import pandas as pd
+import pytest
+
+import dataframes
+import paths as p
+from filesystem import server_path
+
+BIDS = "BABIES/MRI/newborn/BIDS"
+
+
+def write(server, path, data=b""):
+    server.pipe(str(p.SERVER_PATH / path), data)
+
+
+@pytest.fixture
+def bids(server):
+    """Two newborn subjects: sub-1001 with every scan, sub-1002 with a T1w only."""
+    ses = f"{BIDS}/sub-1001/ses-newborn"
+    write(server, f"{ses}/anat/sub-1001_ses-newborn_T2w.nii.gz")
+    write(server, f"{ses}/func/sub-1001_ses-newborn_task-rest_run-01_bold.nii.gz")
+    write(server, f"{ses}/dwi/sub-1001_ses-newborn_dwi.nii.gz")
+    write(server, f"{ses}/sub-1001_ses-newborn_scans.tsv",
+          b"filename\tacq_time\nanat/sub-1001_ses-newborn_T2w.nii.gz\t2024-03-01T10:00:00\n")
+    write(server, f"{BIDS}/sub-1002/ses-newborn/anat/sub-1002_ses-newborn_T1w.nii.gz", b"0123")
+    write(server, f"{BIDS}/participants.tsv")
+    return p.SERVER_PATH / BIDS
+
+
+def test_glob_matches_folders_and_files(bids):
+    assert [path.name for path in bids.glob("sub-*/")] == ["sub-1001", "sub-1002"]
+    assert [path.name for path in bids.rglob("*.nii.gz")] == ["sub-1001_ses-newborn_T2w.nii.gz",
+                                                              "sub-1001_ses-newborn_dwi.nii.gz",
+                                                              "sub-1001_ses-newborn_task-rest_run-01_bold.nii.gz",
+                                                              "sub-1002_ses-newborn_T1w.nii.gz",
+                                                              ]
+    assert list(bids.glob("sub-*/ses-sixmonth/*")) == []
+    assert list((bids / "missing").glob("*")) == []
+
+
+def test_exists_and_stat(bids):
+    t1w = bids / "sub-1002" / "ses-newborn" / "anat" / "sub-1002_ses-newborn_T1w.nii.gz"
+
+    assert t1w.exists() and t1w.is_file() and not t1w.is_dir()
+    assert t1w.parent.is_dir()
+    assert t1w.stat().st_size == 4
+    assert t1w.read_bytes() == b"0123"
+    assert not (bids / "sub-1003").exists()
+    with pytest.raises(FileNotFoundError):
+        (bids / "sub-1003").stat()
+
+
+def test_listings_are_cached_for_the_ttl(server, bids):
+    cached = server_path(p.SERVER_URL, ttl=60) / BIDS
+    cached.cache.clear()
+    assert [path.name for path in cached.glob("sub-*/")] == ["sub-1001", "sub-1002"]
+
+    write(server, f"{BIDS}/sub-1003/ses-newborn/anat/sub-1003_ses-newborn_T2w.nii.gz")
+
+    assert not (cached / "sub-1003").exists()
+    # The tests' own server path does not cache listings
+    assert (bids / "sub-1003").exists()
+    cached.cache.clear()
+    assert (cached / "sub-1003").exists()
+
+
+def test_paths_keep_their_filesystem_when_pickled(bids):
+    path = bids / "sub-1001"
+
+    unpickled = pickle.loads(pickle.dumps(path))
+
+    assert unpickled == path
+    assert (unpickled.url, unpickled.ttl) == (path.url, path.ttl)
+    assert unpickled.is_dir()
+
+
+def test_remote_paths_are_not_local_files(bids):
+    path = bids / "participants.tsv"
+
+    assert not path.is_local
+    with pytest.raises(TypeError, match="not a local filesystem"):
+        os.fspath(path)
+
+
+def test_crawl_reads_the_server(bids):
+    dataframes.build_acquisition_df("BABIES", "newborn")
+
+    df = pd.read_csv(p.get_csv_paths("BABIES")["acquisition_newborn"], index_col="study_id")
+    assert df.index.tolist() == ["sub-1001", "sub-1002"]
+    assert df.loc["sub-1001", ["Anatomical", "T1w", "T2w", "Functional", "DWI"]].tolist() == [True, False, True, True, True]
+    assert df.loc["sub-1002", ["Anatomical", "T1w", "T2w", "Functional", "DWI"]].tolist() == [True, True, False, False, False]
+    assert df.loc["sub-1001", "Date-Acquired"] == "2024-03-01 10:00:00"
+    assert pd.isna(df.loc["sub-1002", "Date-Acquired"])
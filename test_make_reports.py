@@ -0,0 +1,32 @@
+import pytest
+
+import cube
+import make_reports
+import merge_dataframes
+import paths as p
+from utils import read_final_df
+
+
+@pytest.fixture
+def df_final(tracking_csvs):
+    merge_dataframes.build_dataframe("BABIES")
+    cube.update_cube("BABIES")
+    return read_final_df("BABIES")
+
+
+def test_render_cache_keeps_only_the_current_charts(df_final):
+    cache_dir = p.ROOT_DIR / "reports" / ".render_cache"
+    make_reports.render_reports(["BABIES"], formats=["png"])
+    [first] = cache_dir.iterdir()
+    # Left over by a worker that was killed
+    (cache_dir / "BABIES_0123456789abcdef.png.partial").write_bytes(b"\x89PNG")
+
+    df_final.loc["sub-1410", ("Processed", "Newborn", "DWI")] = "Not Processed"
+    df_final.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+    cube.update_cube("BABIES")
+    make_reports.render_reports(["BABIES"], formats=["png"])
+
+    [second] = cache_dir.iterdir()
+    assert second != first
+    assert second.read_bytes() == (p.ROOT_DIR / "reports" / "BABIES_scan_counts.png").read_bytes()
+    assert second.read_bytes().startswith(b"\x89PNG")
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import merge_dataframes
+from utils import read_final_df
+
+
+def merge(full=False):
+    merge_dataframes.build_dataframe("BABIES", full=full)
+    return read_final_df("BABIES")
+
+
+def edit_csv(fname, func):
+    """Edit a CSV file in place, as strings indexed by study_id."""
+    df = pd.read_csv(fname, dtype=str, keep_default_na=False).set_index("study_id")
+    func(df)
+    df.to_csv(fname)
+
+
+def test_incremental_merge_matches_full_merge(tracking_csvs, capsys):
+    merge()
+
+    def edit_acquisition(df):
+        df.loc["sub-1410", "DWI"] = "False"
+        df.loc["sub-9001"] = {column: "True" for column in df.columns}
+
+    def edit_derivatives(df):
+        df.loc["sub-1008", "Anatomical"] = "True"
+
+    def edit_redcap(df):
+        df.loc["1043", "neonatal_status_v2"] = "3"
+        df.drop(index="1999", inplace=True)
+
+    edit_csv(tracking_csvs["acquisition_newborn"], edit_acquisition)
+    edit_csv(tracking_csvs["derivatives_newborn"], edit_derivatives)
+    edit_csv(tracking_csvs["redcap"], edit_redcap)
+    capsys.readouterr()
+
+    df_incremental = merge()
+
+    assert "Re-merged 4 changed BABIES subjects" in capsys.readouterr().out
+    assert "sub-1999" not in df_incremental.index
+    pd.testing.assert_frame_equal(df_incremental, merge(full=True))
+
+
+def test_unchanged_inputs_are_not_merged_again(tracking_csvs, capsys):
+    merge()
+    final_fname = tracking_csvs["redcap"].parents[1] / "reports" / "BABIES_final.csv"
+    mtime = final_fname.stat().st_mtime_ns
+
+    merge()
+
+    assert "No BABIES subjects changed since the last merge" in capsys.readouterr().out
+    assert final_fname.stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize("full", [False, True])
+def test_new_columns_merge_every_subject(tracking_csvs, full):
+    merge()
+
+    def add_column(df):
+        df["FLAIR"] = "False"
+
+    edit_csv(tracking_csvs["acquisition_sixmonth"], add_column)
+
+    df_final = merge(full=full)
+
+    assert ("Acquired", "Six Months", "FLAIR") in df_final.columns
+    pd.testing.assert_frame_equal(df_final, merge(full=True))
@@ -0,0 +1,150 @@
+import pandas as pd
+import pytest
+
+import paths as p
+import push
+from paths import get_csv_paths
+from redcap import get_state_paths
+
+TOKEN = "0123456789ABCDEF"
+STUDY_IDS = ["sub-1001", "sub-1002", "sub-1003", "sub-1004", "sub-1005"]
+
+
+@pytest.fixture
+def fields():
+    fields, _ = push.load_config("BABIES")
+    return fields
+
+
+@pytest.fixture
+def df_final(fields):
+    """A final dataframe where every configured scan is done, saved where push reads it."""
+    columns = pd.MultiIndex.from_tuples(list(fields), names=["Stage", "Visit", "Scan"])
+    df = pd.DataFrame([[stage for stage, _, _ in fields]] * len(STUDY_IDS),
+                      index=pd.Index(STUDY_IDS, name="study_id"),
+                      columns=columns,
+                      )
+    df.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+    return df
+
+
+@pytest.fixture
+def stub(redcap_server, fields):
+    """A REDCap project with a blank record for every subject, and its cached export."""
+    record_ids = [study_id.removeprefix("sub-") for study_id in STUDY_IDS]
+    redcap_server.records = pd.DataFrame({"study_id": record_ids,
+                                          **{field: "" for field in fields.values()},
+                                          "modified": "2025-01-01 09:00:00",
+                                          })
+    redcap_server.records[["study_id"]].to_csv(get_csv_paths("BABIES")["redcap"], index=False)
+    return redcap_server
+
+
+def run_push(stub, **kwargs):
+    return push.push("BABIES", url=stub.url, token=TOKEN, **kwargs)
+
+
+def get_imported_ids(stub):
+    return [record for df in stub.imported for record in df["study_id"]]
+
+
+def test_push_imports_every_record_in_batches(stub, df_final, fields):
+    run_push(stub, batch_size=2)
+
+    assert [len(df) for df in stub.imported] == [2, 2, 1]
+    assert get_imported_ids(stub) == ["1001", "1002", "1003", "1004", "1005"]
+    assert stub.imported[0].columns.tolist() == ["study_id", *fields.values()]
+    assert (stub.imported[0].drop(columns="study_id") == "1").all().all()
+
+
+def test_push_imports_only_changed_records(stub, df_final):
+    run_push(stub)
+    stub.imported.clear()
+    assert run_push(stub).empty
+    assert stub.imported == []
+
+    df_final.loc["sub-1003", ("Processed", "Newborn", "DWI")] = "Not Processed"
+    df_final.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+    run_push(stub)
+
+    assert get_imported_ids(stub) == ["1003"]
+    assert stub.imported[0].set_index("study_id").loc["1003", "neonatal_mri_dwi_proc"] == "0"
+
+
+def test_push_resumes_after_a_failed_batch(stub, df_final):
+    # The second batch is rejected
+    stub.fail = [None, 400]
+    with pytest.raises(ValueError, match="rejected"):
+        run_push(stub, batch_size=2)
+    assert get_imported_ids(stub) == ["1001", "1002"]
+
+    stub.imported.clear()
+    run_push(stub, batch_size=2)
+
+    assert get_imported_ids(stub) == ["1003", "1004", "1005"]
+
+
+def test_push_retries_transient_errors(stub, df_final):
+    stub.fail = [503]
+
+    run_push(stub)
+
+    assert len(stub.requests) == 2
+    assert get_imported_ids(stub) == ["1001", "1002", "1003", "1004", "1005"]
+
+
+def test_push_skips_subjects_without_a_redcap_record(stub, df_final, capsys):
+    # e.g. a pilot or a mistyped folder on the server
+    df_final.loc["sub-1099"] = df_final.loc["sub-1001"]
+    df_final.loc["sub-pilot"] = df_final.loc["sub-1001"]
+    df_final.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+
+    run_push(stub)
+
+    assert get_imported_ids(stub) == ["1001", "1002", "1003", "1004", "1005"]
+    assert stub.records["study_id"].tolist() == ["1001", "1002", "1003", "1004", "1005"]
+    assert "Skipping 2 BABIES subjects with no REDCap record: 1099, pilot" in capsys.readouterr().out
+
+
+def test_na_statuses_erase_the_old_code(stub, df_final):
+    run_push(stub)
+    assert stub.records.set_index("study_id").loc["1001", "neonatal_mri_dwi_proc"] == "1"
+
+    df_final.loc["sub-1001", ("Processed", "Newborn", "DWI")] = "N/A"
+    df_final.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+    run_push(stub)
+
+    assert get_imported_ids(stub)[-1] == "1001"
+    assert stub.requests[-1]["overwriteBehavior"] == "overwrite"
+    assert stub.records.set_index("study_id").loc["1001", "neonatal_mri_dwi_proc"] == ""
+
+
+def test_dry_run_imports_nothing(stub, df_final):
+    df_changed = run_push(stub, dry_run=True)
+
+    assert len(df_changed) == len(STUDY_IDS)
+    assert stub.requests == []
+    assert not get_state_paths("BABIES")["pushed"].exists()
+
+
+def test_blank_values_are_not_seen_as_changes(stub, df_final):
+    # "N/A" has no code, so it is pushed as a blank, which must read back as "" and not NaN
+    df_final.loc["sub-1001", ("Processed", "Newborn", "DWI")] = "N/A"
+    df_final.to_csv(p.ROOT_DIR / "reports" / "BABIES_final.csv")
+    run_push(stub)
+
+    df_pushed = push.load_pushed("BABIES", "study_id")
+    assert df_pushed.loc["1001", "neonatal_mri_dwi_proc"] == ""
+    assert df_pushed.index.tolist() == ["1001", "1002", "1003", "1004", "1005"]
+    stub.imported.clear()
+    assert run_push(stub).empty
+
+
+def test_get_changed_records_compares_blanks_and_missing_records():
+    df_push = pd.DataFrame({"field": ["1", "", "0"]}, index=pd.Index(["1001", "1002", "1003"], name="study_id"))
+    df_pushed = pd.DataFrame({"field": ["1", ""]}, index=pd.Index(["1001", "1002"], name="study_id"))
+
+    assert push.get_changed_records(df_push, df_pushed).index.tolist() == ["1003"]
+    # A blank that was read back as NaN would look like a change
+    df_pushed.loc["1002", "field"] = float("nan")
+    assert push.get_changed_records(df_push, df_pushed).index.tolist() == ["1002", "1003"]
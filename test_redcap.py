@@ -0,0 +1,58 @@
+import pandas as pd
+
+from redcap import get_state_paths, ingest_redcap
+
+
+def ingest(csvs, full=False):
+    return ingest_redcap(csvs["redcap"], csvs["datadict"], "BABIES", full=full)
+
+
+def edit_export(csvs, func):
+    df = pd.read_csv(csvs["redcap"], dtype=str, keep_default_na=False).set_index("study_id")
+    func(df)
+    df.to_csv(csvs["redcap"])
+
+
+def test_incremental_ingest_matches_full_ingest(tracking_csvs):
+    ingest(tracking_csvs)
+
+    def edit(df):
+        df.loc["1043", "neonatal_status_v2"] = "3"
+        df.loc["1410", ["infant_sex", "child_sex"]] = ["", "1"]
+        df.loc["1600"] = ["1", "", "", "", "2", ""]
+        df.drop(index="1999", inplace=True)
+
+    edit_export(tracking_csvs, edit)
+
+    df_incremental, changed = ingest(tracking_csvs)
+
+    assert changed.tolist() == ["sub-1043", "sub-1410", "sub-1600", "sub-1999"]
+    saved = pd.read_csv(get_state_paths("BABIES")["changed"])["study_id"]
+    assert saved.tolist() == changed.tolist()
+    assert df_incremental.loc["sub-1043", "neonatal_status_v2"] == "Withdrawn"
+    assert df_incremental.loc["sub-1410", "Biological Sex"] == "Male"
+    df_full, _ = ingest(tracking_csvs, full=True)
+    pd.testing.assert_frame_equal(df_incremental, df_full)
+
+
+def test_unchanged_export_has_no_changed_records(tracking_csvs):
+    df_first, _ = ingest(tracking_csvs)
+
+    df_redcap, changed = ingest(tracking_csvs)
+
+    assert changed.empty
+    pd.testing.assert_frame_equal(df_redcap, df_first)
+
+
+def test_new_labels_decode_every_record(tracking_csvs):
+    df_first, _ = ingest(tracking_csvs)
+    df_datadict = pd.read_csv(tracking_csvs["datadict"])
+    df_datadict["Choices, Calculations, OR Slider Labels"] = (df_datadict["Choices, Calculations, OR Slider Labels"]
+                                                              .str.replace("Withdrawn", "Withdrew"))
+    df_datadict.to_csv(tracking_csvs["datadict"], index=False)
+
+    df_redcap, changed = ingest(tracking_csvs)
+
+    assert changed.tolist() == df_first.index.tolist()
+    assert (df_redcap["neonatal_status_v2"] == "Withdrew").any()
+    assert not (df_redcap["neonatal_status_v2"] == "Withdrawn").any()
@@ -0,0 +1,110 @@
+import pandas as pd
+import pytest
+
+import redcap_api
+from paths import get_csv_paths
+from redcap import BABIES_WANT_COLS, get_state_paths
+
+TOKEN = "0123456789ABCDEF"
+
+
+@pytest.fixture
+def stub(redcap_server):
+    redcap_server.records = pd.DataFrame({
+        "study_id": ["1001", "1002", "1003"],
+        "neonatal_status_v2": ["1", "2", "1"],
+        "sixmo_status_v2": ["", "", "1"],
+        "neonatal_notscan_v2": ["", "", ""],
+        "sixmo_notscan_v2": ["", "", ""],
+        "infant_sex": ["1", "2", ""],
+        "child_sex": ["", "", "2"],
+        # Not tracked, so it should never be requested
+        "mother_dob": ["1990-01-01", "1991-02-02", "1992-03-03"],
+        "modified": ["2025-01-01 09:00:00"] * 3,
+    })
+    redcap_server.metadata = pd.DataFrame({
+        "field_name": [*BABIES_WANT_COLS, "mother_dob"],
+        "select_choices_or_calculations": ["", *["1, Completed | 2, Scheduled"] * 2,
+                                           *["1, Family declined | 2, Motion"] * 2,
+                                           *["1, Male | 2, Female"] * 2, ""],
+    })
+    return redcap_server
+
+
+def get_fields(request):
+    return [value for key, value in request.items() if key.startswith("fields[")]
+
+
+def test_sync_exports_only_the_wanted_fields(stub):
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+
+    record_request, metadata_request = stub.requests
+    assert record_request["content"] == "record"
+    assert get_fields(record_request) == BABIES_WANT_COLS
+    assert "dateRangeBegin" not in record_request
+    assert get_fields(metadata_request) == BABIES_WANT_COLS
+    csvs = get_csv_paths("BABIES")
+    df_records = pd.read_csv(csvs["redcap"], dtype=str)
+    assert df_records.columns.tolist() == BABIES_WANT_COLS
+    assert df_records["study_id"].tolist() == ["1001", "1002", "1003"]
+    df_datadict = pd.read_csv(csvs["datadict"])
+    assert df_datadict["Variable / Field Name"].tolist() == BABIES_WANT_COLS
+
+
+def test_sync_exports_only_records_modified_since_the_last_sync(stub, monkeypatch):
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+    # The last sync was at 20:00 UTC, which is noon on the server's clock
+    get_state_paths("BABIES")["last_sync"].write_text("2025-01-01T20:00:00+00:00")
+    monkeypatch.setenv(redcap_api.TIMEZONE_ENV, "America/Los_Angeles")
+    stub.records.loc[1, ["neonatal_status_v2", "modified"]] = ["1", "2025-01-01 13:00:00"]
+    stub.records.loc[2, ["neonatal_status_v2", "modified"]] = ["2", "2025-01-01 11:00:00"]
+    stub.requests.clear()
+
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+
+    assert stub.requests[0]["dateRangeBegin"] == "2025-01-01 12:00:00"
+    df_records = pd.read_csv(get_csv_paths("BABIES")["redcap"], dtype=str).set_index("study_id")
+    # Only 1002 was modified since, so the change to 1003 is not picked up (yet)
+    assert df_records["neonatal_status_v2"].to_dict() == {"1001": "1", "1002": "1", "1003": "1"}
+
+
+def test_sync_without_changes_keeps_the_cache(stub):
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+    csvs = get_csv_paths("BABIES")
+    cached = csvs["redcap"].read_bytes()
+    stub.requests.clear()
+
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+
+    assert "dateRangeBegin" in stub.requests[0]
+    assert csvs["redcap"].read_bytes() == cached
+
+
+def test_sync_full_ignores_the_last_sync(stub):
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+    stub.requests.clear()
+
+    redcap_api.sync("BABIES", full=True, url=stub.url, token=TOKEN)
+
+    assert "dateRangeBegin" not in stub.requests[0]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_sync_retries_transient_errors(stub, status):
+    stub.fail = [status]
+
+    redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+
+    # The failed export, its retry and the metadata export
+    assert len(stub.requests) == 3
+    assert get_csv_paths("BABIES")["redcap"].exists()
+
+
+def test_sync_raises_on_client_errors(stub):
+    stub.fail = [403]
+
+    with pytest.raises(Exception, match="403"):
+        redcap_api.sync("BABIES", url=stub.url, token=TOKEN)
+
+    assert len(stub.requests) == 1
+    assert not get_csv_paths("BABIES")["redcap"].exists()
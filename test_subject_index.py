@@ -0,0 +1,37 @@
+import pyarrow as pa
+
+from subject_index import build_index, get_study_ids, lookup, to_labels, to_study_ids
+
+
+def make_tables():
+    acquired = pa.table({"study_id": ["sub-0012", "sub-1001b", "sub-pilot", "sub-1002"],
+                         "DWI": [True, True, False, None],
+                         })
+    processed = pa.table({"study_id": ["sub-1001b", "sub-0012"],
+                          "DWI": [True, False],
+                          })
+    return {("Newborn", "Acquired"): acquired, ("Newborn", "Processed"): processed}
+
+
+def test_any_folder_name_gets_a_label():
+    tables = make_tables()
+    study_ids = get_study_ids(tables)
+
+    labels = to_labels(tables[("Newborn", "Acquired")]["study_id"].to_pandas(), study_ids)
+
+    assert study_ids.tolist() == ["sub-0012", "sub-1001b", "sub-1002", "sub-pilot"]
+    assert labels.tolist() == [0, 1, 3, 2]
+    assert to_study_ids(labels, study_ids) == ["sub-0012", "sub-1001b", "sub-pilot", "sub-1002"]
+
+
+def test_lookup_finds_the_subjects_of_the_selected_cells():
+    tables = make_tables()
+    study_ids = get_study_ids(tables)
+    index = build_index(tables, study_ids)
+
+    def find(*cells):
+        return to_study_ids(lookup(index, cells), study_ids)
+
+    assert find(("Newborn", "Acquired", "DWI", "Done")) == ["sub-0012", "sub-1001b"]
+    assert find(("Newborn", "Acquired", "DWI", "Missing")) == ["sub-1002", "sub-pilot"]
+    assert find(("Newborn", "Acquired", "DWI", "Done"), ("Newborn", "Processed", "DWI", "Missing")) == ["sub-0012"]
@@ -1,12 +1,18 @@
+import os
 import re
 
 from datetime import datetime
-from pathlib import Path
+from itertools import islice
 
 import pandas as pd
+import pyarrow as pa
 import toml
 
 import paths as p
+from history import append_snapshot_file
+
+# Number of subjects crawled and written at a time
+CHUNK_SIZE = 100
 
 
 def create_participant_df(subjects_path):
@@ -30,23 +36,80 @@ def get_participant_list(directory):
     directory : pathlib.Path
         The directory containing the participant folders.
     """
-    files = [f.name for f in directory.glob("sub-*/") if f.is_dir()]
-    # assert that no html files were added
-    assert not any([f.endswith(".html") for f in files])
+    files = list(iter_participants(directory))
     if not files:
         print(f"No participants found in {directory}")
     return files
 
 
+def iter_participants(directory):
+    """Yield the participant folder names in a BIDS-like directory, as they are listed."""
+    for f in directory.glob("sub-*/"):
+        if f.is_dir():
+            # assert that no html files were added
+            assert not f.name.endswith(".html")
+            yield f.name
+
+
+def iter_chunks(iterable, size):
+    """Yield successive lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def get_changed_ids(hashes, previous_hashes):
+    """Compare the hash of every subject with the one saved by the last run.
+
+    Parameters
+    ----------
+    hashes : pandas.Series
+        The uint64 hash of every subject, indexed by study_id.
+    previous_hashes : pandas.Series
+        The hashes saved by the last run.
+
+    Returns
+    -------
+    changed : pandas.Index
+        The subjects that are new or whose hash differs from the last run.
+    removed : pandas.Index
+        The subjects of the last run that are gone.
+    """
+    # Nullable integers, so that new subjects are <NA> and no hash is rounded to a float
+    previous = previous_hashes.astype("UInt64").reindex(hashes.index)
+    is_changed = hashes.astype("UInt64").ne(previous).fillna(True).astype(bool)
+    changed = hashes.index[is_changed.to_numpy()]
+    removed = previous_hashes.index.difference(hashes.index)
+    return changed, removed
+
+
+def read_final_df(project):
+    """Read the final (Stage, Visit, Scan) dataframe saved by ``merge_dataframes``.
+
+    Blank cells are read as "" and not NaN, as they were written.
+    """
+    fname = p.ROOT_DIR / "reports" / f"{project}_final.csv"
+    return pd.read_csv(fname, header=[0, 1, 2], index_col=0, keep_default_na=False)
+
+
 def find_log_file(log_path):
+    """Find the most recent NiBabies run in a subject's log folder."""
     runs = list(log_path.glob("*"))
     if not runs:
         raise ValueError(f"No runs found in {log_path}")
     runs = [p for p in runs if p.is_dir()] # Filter out any files
-    run = runs[0]
+    run = max(runs, key=_run_sort_key)
     return run
 
 
+def _run_sort_key(run):
+    # Order runs by their timestamp, falling back to the folder name
+    try:
+        return extract_run_datetime(run), run.name
+    except ValueError:
+        return datetime.min, run.name
+
+
 def load_nibabies_toml(log_path):
     """Load the NiBabies toml file.
     
@@ -63,14 +126,23 @@ def load_nibabies_toml(log_path):
     run = find_log_file(log_path)
     toml_file = run / "nibabies.toml"
     if toml_file.exists():
-        return toml.load(toml_file)
+        return toml.loads(toml_file.read_text())
     else:
         raise ValueError(f"No toml file found in {run}")
 
 
 def extract_processing_datetime(log_path):
     """Extract the processing datetime from the log file."""
-    folder_name = find_log_file(log_path).name
+    return extract_run_datetime(find_log_file(log_path))
+
+
+def extract_run_datetime(run):
+    """Extract the processing datetime from a NiBabies run folder name."""
+    folder_name = run.name
+    # Run folders are named like 20240911-101010_<uuid>
+    datetime_match = re.search(r"\d{8}-\d{6}", folder_name)
+    if datetime_match:
+        return datetime.strptime(datetime_match.group(), "%Y%m%d-%H%M%S")
     date_match = re.search(r"\d{8}", folder_name)
     if date_match:
         date_str = date_match.group()
@@ -80,14 +152,73 @@ def extract_processing_datetime(log_path):
         raise ValueError(f"No date found in {folder_name}")
 
 
+def extract_acquisition_datetime(ses_path):
+    """Extract the earliest acquisition time from a BIDS session's scans.tsv file.
+
+    Parameters
+    ----------
+    ses_path : filesystem.ServerPath
+        The path to a subject's BIDS session folder.
+
+    Returns
+    -------
+    datetime | None
+        The earliest ``acq_time`` in the scans file, or None if it is not available.
+    """
+    scans_files = list(ses_path.glob("*_scans.tsv"))
+    if not scans_files:
+        return None
+    with scans_files[0].open("rb") as fobj:
+        df = pd.read_csv(fobj, sep="\t", usecols=lambda col: col == "acq_time")
+    if "acq_time" not in df.columns:
+        return None
+    acq_times = pd.to_datetime(df["acq_time"], errors="coerce").dropna()
+    if acq_times.empty:
+        return None
+    return acq_times.min().to_pydatetime()
+
+
 def print_starting_msg(project, session, step):
     """Print a message to the console."""
     print(f"👇 Documenting which {project}-{session} subjects Have {step} data! 👇")
 
-def save_df_to_csv(df, project, session, stage):
-    """Save a dataframe to a CSV file."""
-    csv_fname = Path(f"{project}_{session}_{stage}.csv")
-    out_path = p.ROOT_DIR / "csv" / csv_fname
-    print(f"Saving CSV file to {out_path.resolve()}")
-    df.to_csv(out_path, index=False)
+def save_records(records, schema, project, session, stage):
+    """Stream per-subject records to a CSV file in fixed-size chunks.
+
+    Each chunk of ``CHUNK_SIZE`` records is appended to the file as soon as it
+    is crawled. The file is moved into place once the crawl finishes.
 
+    Parameters
+    ----------
+    records : iterable of dict
+        One record per subject, with the fields of ``schema``.
+    schema : pyarrow.Schema
+        The column names and types of the records.
+    project : str
+        The project name (e.g., "BABIES", "ABC").
+    session : str
+        The session (e.g., "newborn", "sixmonth", "twelvemonth").
+    stage : str
+        The tracking stage (e.g., "acquisition", "derivatives").
+    """
+    out_path = p.ROOT_DIR / "csv" / f"{project}_{session}_{stage}.csv"
+    partial_path = out_path.with_name(out_path.name + ".partial")
+    print(f"Saving CSV file to {out_path.resolve()}")
+    is_open = False
+    n_rows = 0
+    for chunk in iter_chunks(records, CHUNK_SIZE):
+        is_open = _write_chunk(is_open, chunk, schema, partial_path)
+        n_rows += len(chunk)
+    if not is_open:
+        # Still write the header if there were no records
+        _write_chunk(is_open, [], schema, partial_path)
+    os.replace(partial_path, out_path)
+    print(f"\nSaved {n_rows} rows")
+    append_snapshot_file(out_path, project, session, stage)
+
+
+def _write_chunk(is_open, chunk, schema, fname):
+    """Append a chunk of records to a CSV file, writing the header on the first chunk."""
+    table = pa.Table.from_pylist(chunk, schema=schema)
+    table.to_pandas().to_csv(fname, index=False, mode="a" if is_open else "w", header=not is_open)
+    return True
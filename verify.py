@@ -0,0 +1,114 @@
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import paths as p
+
+# pipeline: [(glob pattern relative to the subject folder, minimum number of matches)]
+# Every matched file must also be non-empty.
+EXPECTED_OUTPUTS = {"DWI": [("**/*.nii*", 1)],
+                    "Precomputed": [("**/*_dseg.nii*", 1)],
+                    "Recon-all": [("**/mri/aseg.mgz", 1),
+                                  ("**/surf/lh.white", 1),
+                                  ("**/surf/rh.white", 1),
+                                  ("**/scripts/recon-all.done", 1),
+                                  ],
+                    }
+CHECKSUM_CACHE = p.ROOT_DIR / "csv" / "checksums.sqlite"
+N_JOBS = 16
+
+
+def _verify_subject(sub_path, pipeline):
+    """Check the key outputs of one subject.
+
+    Returns
+    -------
+    problem : str | None
+        Why the outputs are incomplete, or None if they look complete.
+    files : list of tuple
+        The (path, size, mtime_ns) of every matched output.
+    """
+    files = []
+    for pattern, min_count in EXPECTED_OUTPUTS[pipeline]:
+        matches = [fpath for fpath in sub_path.glob(pattern) if fpath.is_file()]
+        if len(matches) < min_count:
+            return f"expected {min_count} {pattern}, found {len(matches)}", files
+        for fpath in matches:
+            stat = fpath.stat()
+            if not stat.st_size:
+                return f"{fpath.relative_to(sub_path)} is empty", files
+            files.append((str(fpath), stat.st_size, stat.st_mtime_ns))
+    return None, files
+
+
+def verify_outputs(sub_paths, pipeline, checksums=False):
+    """Check that each subject's derivatives contain the expected, non-empty outputs.
+
+    Parameters
+    ----------
+    sub_paths : list of filesystem.ServerPath
+        The subject folders of a derivatives pipeline.
+    pipeline : str
+        One of the keys of ``EXPECTED_OUTPUTS``.
+    checksums : bool
+        Whether to also record a checksum of every matched output in the cache.
+
+    Returns
+    -------
+    dict
+        Maps each subject folder name to None if its outputs look complete,
+        otherwise to a description of what is wrong.
+    """
+    with ThreadPoolExecutor(N_JOBS) as executor:
+        results = list(executor.map(lambda sub_path: _verify_subject(sub_path, pipeline), sub_paths))
+    problems = {}
+    all_files = []
+    for sub_path, (problem, files) in zip(sub_paths, results):
+        problems[sub_path.name] = problem
+        all_files.extend(files)
+        if problem:
+            print(f"\n⚠️ {pipeline} outputs for {sub_path.name} are incomplete: {problem}")
+    if checksums and all_files:
+        update_checksums(all_files)
+    return problems
+
+
+def _sha256(fpath):
+    digest = hashlib.sha256()
+    with fpath.open("rb") as fobj:
+        for chunk in iter(lambda: fobj.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def update_checksums(files):
+    """Record the checksum of each file, hashing only files whose size or mtime changed.
+
+    Parameters
+    ----------
+    files : list of tuple
+        The (path, size, mtime_ns) of each file.
+
+    Returns
+    -------
+    dict
+        Maps each path to its SHA-256 checksum.
+    """
+    with closing(sqlite3.connect(CHECKSUM_CACHE)) as con, con:
+        con.execute("CREATE TABLE IF NOT EXISTS checksums "
+                    "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)")
+        cached = {}
+        for path, size, mtime_ns in files:
+            row = con.execute("SELECT sha256 FROM checksums WHERE path = ? AND size = ? AND mtime_ns = ?",
+                              (path, size, mtime_ns)).fetchone()
+            if row:
+                cached[(path, size, mtime_ns)] = row[0]
+        stale = [key for key in files if key not in cached]
+        with ThreadPoolExecutor(N_JOBS) as executor:
+            hashes = list(executor.map(lambda key: _sha256(p.SERVER_PATH / key[0]), stale))
+        con.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)",
+                        [(*key, sha256) for key, sha256 in zip(stale, hashes)])
+    print(f"\nHashed {len(stale)} new or changed files ({len(files) - len(stale)} unchanged)")
+    cached.update(zip(stale, hashes))
+    return {key[0]: cached[key] for key in files}